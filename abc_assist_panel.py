@@ -59,8 +59,11 @@ class AbcAssistPanel(wx.Panel):
         self._editor = editor
         self.settings = settings
         self.context = None
+        self.document = EditorSnapshot(editor)  # call self.document.text_changed() when the text of the editor changes
         self.abc_section = None
         self.elements = AbcStructure.generate_abc_elements(cwd)
+        self.match_statistics = MatchStatistics()
+        self.element_matchers = AbcStructure.generate_element_matchers(self.elements, self.match_statistics)
         self.actions_handlers = AbcActionHandlers(self.elements)
 
         self.sizer = wx.BoxSizer(wx.VERTICAL)
@@ -125,7 +128,7 @@ class AbcAssistPanel(wx.Panel):
 
     def update_assist(self):
         try:
-            self.context = AbcContext(self._editor, self.settings, on_invalidate=self.update_assist)
+            self.context = AbcContext(self._editor, self.settings, on_invalidate=self.update_assist, document=self.document)
             element, match = self.get_current_element()
             self.context.current_element = element
             if element is not None:
@@ -151,11 +154,13 @@ class AbcAssistPanel(wx.Panel):
         self.current_html.Thaw()
 
     def get_current_element(self):
-        for element in self.elements:
-            m = element.matches(self.context)
-            if m:
-                return element, m
-        return None, None
+        matcher = self.element_matchers.get(self.context.abc_section)
+        if matcher is None:
+            return None, None
+        element, match = matcher.find_element(self.context)
+        if self.match_statistics.caret_moves % 100 == 0:
+            logging.debug('abc assist: %s', self.match_statistics)
+        return element, match
 
     def on_link_clicked(self, evt):
         href = evt.GetLinkInfo().GetHref()
@@ -1,5 +1,7 @@
 from tune_elements import *
 from abc_character_encoding import ensure_unicode, unicode_text_to_abc
+from abc_tune import AbcTune
+from bisect import bisect_left
 import wx
 import sys
 PY3 = sys.version_info.major > 2
@@ -7,9 +9,171 @@ if PY3:
     xrange = range
 
 
+class EditorSnapshot(object):
+    """ Remembers what has been read from the editor since the last modification: lines, tune boundaries,
+        scope texts with their utf-8 offsets and parsed tunes. One snapshot is shared by all the AbcContexts
+        (one for every caret move) so moving the caret does not read the same text from the editor again.
+
+        text_changed() has to be called for every modification of the editor, it starts a new version.
+    """
+    max_cached_scopes = 64  # scopes that depend on the selection change with every caret move
+
+    def __init__(self, editor, cache_regex_matches=True):
+        self._editor = editor
+        self.version = 0
+        self.cache_regex_matches = cache_regex_matches
+        self.regex_scans = 0
+        self.clear()
+
+    def clear(self):
+        self._line_count = None
+        self._lines = {}
+        self._tune_start_lines = {}  # line_no -> line of the X: field above it
+        self._tune_lines = {}        # tune start line -> (body start line, body end line)
+        self._file_header_end_line = None
+        self._scopes = {}            # (start_pos, end_pos) -> TuneScopeInfo
+        self._byte_offsets = {}      # (start_pos, end_pos) -> utf-8 offset of every character of the scope text
+        self._regex_matches = {}     # (start_pos, end_pos) -> {regex: (matches, ends)}
+        self._abc_tunes = {}         # text -> AbcTune
+
+    def text_changed(self):
+        self.version += 1
+        self.clear()
+
+    def get_line_count(self):
+        if self._line_count is None:
+            self._line_count = self._editor.GetLineCount()
+        return self._line_count
+
+    def get_line(self, line_no):
+        line = self._lines.get(line_no)
+        if line is None:
+            line = self._editor.GetLine(line_no)
+            self._lines[line_no] = line
+        return line
+
+    def get_tune_start_line(self, line_no):
+        """ returns the line of the X: field of the tune that contains line_no, None when line_no is in the file header """
+        if line_no in self._tune_start_lines:
+            return self._tune_start_lines[line_no]
+        start_line = line_no
+        while start_line >= 0 and not self.get_line(start_line).startswith('X:'):
+            start_line -= 1
+            if start_line in self._tune_start_lines:
+                start_line = self._tune_start_lines[start_line]
+                break
+        if start_line is not None and start_line < 0:
+            start_line = None
+        self._tune_start_lines[line_no] = start_line
+        return start_line
+
+    def get_tune_lines(self, tune_start_line):
+        """ returns (body start line, body end line) of the tune that starts at tune_start_line.
+            The body starts after the K: field, both are None when there is no K: field """
+        result = self._tune_lines.get(tune_start_line)
+        if result is None:
+            body_start_line = self.get_body_start_line(tune_start_line + 1)
+            body_end_line = None
+            if body_start_line is not None:
+                body_end_line = self.get_body_end_line(body_start_line)
+            result = (body_start_line, body_end_line)
+            self._tune_lines[tune_start_line] = result
+        return result
+
+    def get_body_start_line(self, tune_start_line):
+        key_line = tune_start_line
+        line_count = self.get_line_count()
+        while key_line < line_count and not self.get_line(key_line).startswith('K:'):
+            key_line += 1
+
+        body_line = None
+        if self.get_line(key_line).startswith('K:'):
+            body_line = key_line + 1
+        return body_line
+
+    def get_body_end_line(self, body_start_line):
+        end_line_no = body_start_line
+        line_count = self.get_line_count()
+        end_found = False
+        while not end_found and end_line_no < line_count:
+            line = self.get_line(end_line_no)
+            if line.startswith('X:'):
+                end_found = True
+            else:
+                end_found = not line.strip()  # last empty line is also part of the body
+                end_line_no += 1
+        return end_line_no
+
+    def get_file_header_end_line(self):
+        if self._file_header_end_line is None:
+            start_line = 0
+            line_count = self.get_line_count()
+            while start_line < line_count and not self.get_line(start_line).startswith('X:'):
+                start_line += 1
+            self._file_header_end_line = start_line
+        return self._file_header_end_line
+
+    def get_scope(self, start_pos, end_pos):
+        key = (start_pos, end_pos)
+        result = self._scopes.get(key)
+        if result is None:
+            if len(self._scopes) >= self.max_cached_scopes:
+                self._scopes.clear()
+                self._byte_offsets.clear()
+                self._regex_matches.clear()
+            text = self._editor.GetTextRange(start_pos, end_pos)
+            result = TuneScopeInfo(text, start_pos, end_pos, text.encode('utf-8'))
+            self._scopes[key] = result
+        return result
+
+    def get_char_offset(self, scope_info, byte_offset):
+        """ converts an offset in the utf-8 encoded text of a scope to an offset in its text """
+        text = scope_info.text
+        if len(text) == len(scope_info.encoded_text):
+            return byte_offset
+        key = (scope_info.start, scope_info.stop)
+        byte_offsets = self._byte_offsets.get(key)
+        if byte_offsets is None:
+            byte_offsets = [0]
+            offset = 0
+            for ch in text:
+                offset += len(ch.encode('utf-8'))
+                byte_offsets.append(offset)
+            self._byte_offsets[key] = byte_offsets
+        return min(bisect_left(byte_offsets, byte_offset), len(text))
+
+    def get_regex_matches(self, regex, scope_info):
+        """ returns (matches, ends): all the matches of regex in the text of a scope and where each of them ends """
+        key = (scope_info.start, scope_info.stop)
+        scope_matches = self._regex_matches.get(key)
+        if scope_matches is None:
+            scope_matches = {}
+            if self.cache_regex_matches:
+                self._regex_matches[key] = scope_matches
+        result = scope_matches.get(regex)
+        if result is None:
+            matches = list(regex.finditer(scope_info.text or ''))
+            result = (matches, [m.end() for m in matches])
+            scope_matches[regex] = result
+            self.regex_scans += 1
+        return result
+
+    def get_abc_tune(self, abc_code):
+        result = self._abc_tunes.get(abc_code)
+        if result is None:
+            if len(self._abc_tunes) >= self.max_cached_scopes:
+                self._abc_tunes.clear()
+            result = AbcTune(abc_code)
+            self._abc_tunes[abc_code] = result
+        return result
+
+
 class AbcContext(object):
-    def __init__(self, editor, settings, on_invalidate=None):
+    def __init__(self, editor, settings, on_invalidate=None, document=None):
         self._editor = editor
+        if document is None:
+            document = EditorSnapshot(editor)
+        self.document = document
         self.on_invalidate = on_invalidate
         self.settings = settings
         self.editor_sel_start, self.editor_sel_end = editor.GetSelection()
@@ -36,58 +200,25 @@ class AbcContext(object):
             TuneScope.NextCharacter: self.get_scope_next_character,
         }
         self._tune_scope_info = {}
+        self._text_selections = {}
 
         line_no = self._editor.GetCurrentLine()
-        self.tune_start_line = self.get_tune_start_line(line_no)
+        self.tune_start_line = document.get_tune_start_line(line_no)
         self.body_start_line = None
         self.body_end_line = None
 
         if self.tune_start_line is None:
             self.abc_section = AbcSection.FileHeader
         else:
-            self.body_start_line = self.get_body_start_line(self.tune_start_line + 1)
+            self.body_start_line, self.body_end_line = document.get_tune_lines(self.tune_start_line)
             if self.body_start_line is None:
                 self.abc_section = AbcSection.TuneHeader
+            elif line_no < self.body_start_line:
+                self.abc_section = AbcSection.TuneHeader
+            elif line_no < self.body_end_line:
+                self.abc_section = AbcSection.TuneBody
             else:
-                self.body_end_line = self.get_body_end_line(self.body_start_line)
-                if line_no < self.body_start_line:
-                    self.abc_section = AbcSection.TuneHeader
-                elif line_no < self.body_end_line:
-                    self.abc_section = AbcSection.TuneBody
-                else:
-                    self.abc_section = AbcSection.OutsideTune
-
-    def get_tune_start_line(self, current_line):
-        start_line = current_line
-        while not self._editor.GetLine(start_line).startswith('X:'):
-            start_line -= 1
-            if start_line < 0:
-                return None
-        return start_line
-
-    def get_body_start_line(self, tune_start_line):
-        key_line = tune_start_line
-        line_count = self._editor.GetLineCount()
-        while key_line < line_count and not self._editor.GetLine(key_line).startswith('K:'):
-            key_line += 1
-
-        body_line = None
-        if self._editor.GetLine(key_line).startswith('K:'):
-            body_line = key_line + 1
-        return body_line
-
-    def get_body_end_line(self, body_start_line):
-        end_line_no = body_start_line
-        line_count = self._editor.GetLineCount()
-        end_found = False
-        while not end_found and end_line_no < line_count:
-            line = self._editor.GetLine(end_line_no)
-            if line.startswith('X:'):
-                end_found = True
-            else:
-                end_found = not line.strip()  # last empty line is also part of the body
-                end_line_no += 1
-        return end_line_no
+                self.abc_section = AbcSection.OutsideTune
 
     @property
     def current_match(self):
@@ -116,6 +247,7 @@ class AbcContext(object):
         else:
             scope_info = self.get_empty_scope_info()
         self._tune_scope_info[TuneScope.MatchText] = scope_info
+        self._text_selections.pop(TuneScope.MatchText, None)
 
         inner_scope_info = None
         if inner_match:
@@ -130,6 +262,7 @@ class AbcContext(object):
             except IndexError:
                 pass  # no group named inner present
         self._tune_scope_info[TuneScope.InnerText] = inner_scope_info
+        self._text_selections.pop(TuneScope.InnerText, None)
 
     @property
     def match_text(self):
@@ -181,6 +314,25 @@ class AbcContext(object):
     def get_selection_within_scope(self, tune_scope):
         return self.translate_range_for_scope(TuneScope.SelectedText, tune_scope)
 
+    def get_text_selection(self, tune_scope):
+        """ returns the selection as (p1, p2, at_character) in the (unicode) text of a scope, see get_text_selection
+            in tune_elements """
+        result = self._text_selections.get(tune_scope)
+        if result is None:
+            p1, p2 = self.get_selection_within_scope(tune_scope)
+            scope_info = self.get_scope_info(tune_scope)
+            get_char_offset = self.document.get_char_offset
+            result = get_text_selection(scope_info.text, get_char_offset(scope_info, p1), get_char_offset(scope_info, p2))
+            self._text_selections[tune_scope] = result
+        return result
+
+    def get_regex_matches(self, regex, tune_scope):
+        return self.document.get_regex_matches(regex, self.get_scope_info(tune_scope))
+
+    def get_abc_tune(self, tune_scope=TuneScope.Tune):
+        """ returns the AbcTune of a scope, it is parsed once for every version of the text """
+        return self.document.get_abc_tune(self.get_scope_info(tune_scope).text or '')
+
     def translate_range_for_scope(self, from_scope, to_scope):
         f = self.get_scope_info(from_scope)
         t = self.get_scope_info(to_scope)
@@ -212,10 +364,7 @@ class AbcContext(object):
             return self.create_scope(start_pos, end_pos)
 
     def get_scope_file_header(self):
-        start_line = 0
-        line_count = self._editor.GetLineCount()
-        while start_line < line_count and not self._editor.GetLine(start_line).startswith('X:'):
-            start_line += 1
+        start_line = self.document.get_file_header_end_line()
         tune_start_pos = self._editor.PositionFromLine(start_line)
         return self.create_scope(0, tune_start_pos)
 
@@ -311,13 +460,13 @@ class AbcContext(object):
         return TuneScopeInfo(None, None, None, None)
 
     def create_scope(self, start_pos, end_pos):
-        text = self._editor.GetTextRange(start_pos, end_pos)
-        return TuneScopeInfo(text, start_pos, end_pos, text.encode('utf-8'))
+        return self.document.get_scope(start_pos, end_pos)
 
     def insert_text(self, text):
         self._editor.BeginUndoAction()
         self._editor.AddText(text)
         self._editor.EndUndoAction()
+        self.document.text_changed()
         self.invalidate()
 
     def set_relative_selection(self, relative_selection):
@@ -354,6 +503,7 @@ class AbcContext(object):
             self._editor.ReplaceSelection(text)
         finally:
             self._editor.EndUndoAction()
+            self.document.text_changed()
             self.invalidate()
 
     def ensure_tune_scope(self, tune_scope):
@@ -418,6 +568,7 @@ class AbcContext(object):
 
     def invalidate(self):  # context has changed so is not valid anymore
         self._tune_scope_info = {}
+        self._text_selections = {}
         self.current_element = None
         self._current_match = None
         if self.on_invalidate is not None:
@@ -433,4 +584,26 @@ class AbcContext(object):
             m = tune_match(get_line(line_no))
             if m:
                 last_index = max(last_index, int(m.group(1)))
-        return last_index
\ No newline at end of file
+        return last_index
+
+def benchmark_caret_moves(editor, elements, settings=None, step=1):
+    """ Puts the caret at every step-th position of the editor and finds the element there, first like the assist
+        panel used to (a new snapshot for every caret move and every element scanning the text with its regex),
+        then with one snapshot that keeps the matches. Returns the MatchStatistics of both. """
+    results = []
+    for shared in (False, True):
+        statistics = MatchStatistics()
+        matchers = AbcStructure.generate_element_matchers(elements, statistics)
+        document = EditorSnapshot(editor, cache_regex_matches=shared)
+        for pos in xrange(0, editor.GetTextLength() + 1, step):
+            editor.SetSelection(pos, pos)
+            if editor.GetSelection() != (pos, pos):
+                continue  # inside a multi-byte character
+            if not shared:
+                document = EditorSnapshot(editor, cache_regex_matches=False)
+            context = AbcContext(editor, settings, document=document)
+            matchers[context.abc_section].find_element(context)
+        results.append(statistics)
+    print('before: {0}'.format(results[0]))
+    print('after:  {0}'.format(results[1]))
+    return results
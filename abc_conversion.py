@@ -0,0 +1,884 @@
+# Conversion of abc code to svg, pdf and midi by calling abcm2ps, ghostscript and abc2midi.
+# These functions do not depend on wx, so they can be used both by EasyABC and by the
+# command line converter abc_convert.py.
+
+import sys
+import os, os.path
+import re
+import codecs
+import platform
+import subprocess
+import shutil
+import hashlib
+import threading
+from fractions import Fraction
+
+from utils import read_entire_file
+from abc_character_encoding import get_encoding_abc
+from abc_tune import voice_re
+from render_cache import get_render_cache
+from render_server import get_abcm2ps_render_server
+
+try:
+    from wx import GetTranslation as _
+except ImportError:
+    def _(text):
+        return text
+
+PY3 = sys.version_info.major > 2
+if PY3:
+    basestring = str
+
+is_windows = sys.platform == 'win32'
+is_mac = sys.platform == 'darwin'
+
+abcm2ps_default_encoding = 'utf-8'  ## 'latin-1'
+
+default_midi_volume = 96
+default_midi_pan = 64
+default_midi_instrument = 0
+
+line_end_re = re.compile('\r\n|\r|\n')
+
+class Abcm2psException(Exception): pass
+
+# The command lines and the output of the external programs are passed to message_listener(text, clear).
+# EasyABC shows them in its messages window.
+message_listener = None
+message_capture = threading.local()
+
+def add_message(text, clear=False):
+    messages = getattr(message_capture, 'messages', None)
+    if messages is not None:
+        messages.append(text)
+    elif message_listener is not None:
+        message_listener(text, clear)
+
+class collect_messages(object):
+    """ with collect_messages() as messages: collects the messages of the current thread in the list messages
+        instead of passing them to message_listener, so a worker thread never writes to the messages window """
+    def __enter__(self):
+        self.previous = getattr(message_capture, 'messages', None)
+        message_capture.messages = []
+        return message_capture.messages
+
+    def __exit__(self, exc_type, exc_value, tb):
+        message_capture.messages = self.previous
+        return False
+
+def text_to_lines(text):
+    return line_end_re.split(text)
+
+def read_abc_file(path):
+    file_as_bytes = read_entire_file(path)
+    encoding = get_encoding_abc(file_as_bytes)
+    if encoding and encoding != 'utf-8':
+        try:
+            return file_as_bytes.decode(encoding)
+        except UnicodeError:
+            pass
+    try:
+        return file_as_bytes.decode('utf-8')
+    except UnicodeError:
+        return file_as_bytes.decode('latin-1')
+
+def get_output_from_process(cmd, input=None, creationflags=None, cwd=None, bufsize=0, encoding='utf-8', errors='strict', output_encoding=None, process_started=None):
+    ''' process_started(process) is called right after the process has started, so another thread can kill it '''
+    stdin_pipe = None
+    if input is not None:
+        stdin_pipe = subprocess.PIPE
+        if isinstance(input, basestring):
+            input = input.encode(encoding, errors)
+
+    if creationflags is None:
+        if is_windows:
+            creationflags = 0x08000000  # CREATE_NO_WINDOW, subprocess only has it since Python 3.7
+        else:
+            creationflags = 0
+
+    process = subprocess.Popen(cmd, stdin=stdin_pipe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creationflags, cwd=cwd, bufsize=bufsize)
+    if process_started is not None:
+        process_started(process)
+    stdout_value, stderr_value = process.communicate(input)
+    returncode = process.returncode
+
+    if output_encoding is None:
+        output_encoding = encoding
+    stdout_value, stderr_value = stdout_value.decode(output_encoding, errors), stderr_value.decode(output_encoding, errors)
+    return stdout_value, stderr_value, returncode
+
+def process_MCM(abc):
+    """ Processes sticky rhythm feature of mcmusiceditor https://www.mcmusiceditor.com/download/sticky-rhythm.pdf
+    :param abc: abc possibly containing sticky rhythm
+    :return: abc-compliant
+    """
+    abc, n = re.subn(r'(?m)^(L:\s*mcm_default)', r'L:1/8', abc)
+    if n:
+        # erase non-note fragments of the text by replacing them by spaces (thereby preserving offsets)
+        repl_by_spaces = lambda m: ' ' * len(m.group(0))
+        s = abc.replace('\r', '\n')
+        s = re.sub(r'(?s)%%begin(ps|text).+?%%end(ps|text)', repl_by_spaces, s) # remove embedded text/postscript
+        s = re.sub(r'(?m)^\w:.*?$|%.*$', repl_by_spaces, s)                 # remove non-embedded fields and comments
+        s = re.sub(r'".*?"|!.+?!|\+\w+?\+|\[\w:.*?\]', repl_by_spaces, s)   # remove strings, ornaments and embedded fields
+
+        fragments = []
+        last_fragment_end = 0
+        for m in re.finditer(r"(?P<note>([_=^]?[A-Ga-gxz](,+|'+)?))(?P<len>\d{0,2})(?P<dot>\.?)", s):
+            if m.group('len') == '':
+                length = 0
+            else:
+                length = Fraction(8, int(m.group('len')))
+                if m.group('dot'):
+                    length = length * 3 / 2
+
+            start, end = m.start(0), m.end(0)
+            fragments.append((False, abc[last_fragment_end:start]))
+            fragments.append((True, m.group('note') + str(length)))
+            last_fragment_end = end
+        fragments.append((False, abc[last_fragment_end:]))
+        abc = ''.join((text for is_note, text in fragments))
+    return abc
+
+def change_abc_tempo(abc_code, tempo_multiplier):
+    ''' multiples all Q: fields in the abc code by the given multiplier and returns the modified abc code '''
+
+    def subfunc(m, multiplier):
+        try:
+            if '=' in m.group(0):
+                parts = m.group(0).split('=')
+                parts[1] = str(int(int(parts[1])*multiplier))
+                return '='.join(parts)
+
+            q = int(int(m.group(1))*multiplier)
+            if '[' in m.group(0):
+                return '[Q: %d]' % q
+            else:
+                return 'Q: %d' % q
+        except:
+            return m.group(0)
+
+    abc_code, n1 = re.subn(r'(?m)^Q: *(.+)', lambda m, mul=tempo_multiplier: subfunc(m, mul), abc_code)
+    abc_code, _ = re.subn(r'\[Q: *(.+)\]', lambda m, mul=tempo_multiplier: subfunc(m, mul), abc_code)
+    # if no Q: field that is not inline add a new Q: field after the X: line
+    # (it seems to be ignored by abcmidi if added earlier in the code)
+    if n1 == 0:
+        default_tempo = 120
+        extra_line = 'Q:%d' % int(default_tempo * tempo_multiplier)
+        lines = text_to_lines(abc_code)
+        for i in range(len(lines)):
+            if lines[i].startswith('X:'):
+                lines.insert(i+1, extra_line)
+                break
+        abc_code = os.linesep.join(lines)
+    return abc_code
+
+# 1.3.6 [SS] 2014-12-17
+def process_abc_code(settings, abc_code, header, minimal_processing=False, tempo_multiplier=None, landscape=False):
+    ''' adds file header and possibly some extra fields, and may also change the Q: field '''
+
+    #print traceback.extract_stack(None, 3)
+    extra_lines = \
+    '%%leftmargin 0.5cm\n' \
+    '%%rightmargin 0.5cm\n' \
+    '%%botmargin 0cm\n'  \
+    '%%topmargin 0cm\n'
+
+    if minimal_processing or settings['abcm2ps_clean']:
+        extra_lines = ''
+
+    if settings['abcm2ps_number_bars']:
+        extra_lines += '%%barnumbers 1\n'
+    if settings['abcm2ps_no_lyrics']:
+        extra_lines += '%%musiconly 1\n'
+    if settings['abcm2ps_refnumbers']:
+        extra_lines += '%%withxrefs 1\n'
+    if settings['abcm2ps_ignore_ends']:
+        extra_lines += '%%continueall 1\n'
+    if settings['abcm2ps_clean'] == False and settings['abcm2ps_defaults'] == False:
+        extra_lines += '%%leftmargin ' + settings['abcm2ps_leftmargin'] + 'cm \n'
+        extra_lines += '%%rightmargin ' + settings['abcm2ps_rightmargin'] + 'cm \n'
+        extra_lines += '%%topmargin ' + settings['abcm2ps_topmargin'] + 'cm \n'
+        extra_lines += '%%botmargin ' + settings['abcm2ps_botmargin'] + 'cm \n'
+        extra_lines += '%%pagewidth ' + settings['abcm2ps_pagewidth'] + 'cm \n'
+        extra_lines += '%%pageheight ' + settings['abcm2ps_pageheight'] + 'cm \n'
+
+        extra_lines += '%%scale ' + settings['abcm2ps_scale'] + ' \n'
+    parts = []
+    if landscape and not minimal_processing:
+        parts.append('%%landscape 1\n')
+    if header:
+        parts.append(header.rstrip() + os.linesep)
+    if extra_lines:
+        parts.append(extra_lines)
+    parts.append(abc_code)
+    abc_code = ''.join(parts)
+
+    abc_code = re.sub(r'\[\[(.*/)(.+?)\]\]', r'\2', abc_code)  # strip PmWiki links and just include the link text
+    if tempo_multiplier:
+        abc_code = change_abc_tempo(abc_code, tempo_multiplier)
+
+    abc_code = process_MCM(abc_code)
+
+    # 1.3.6.3 [JWdJ] 2015-04-22 fixing newlines to part of process_abc_code
+    abc_code = re.sub(r'\r\n|\r', '\n', abc_code)  ## TEST
+
+    return abc_code
+
+def AbcToPS(abc_code, cache_dir, extra_params='', abcm2ps_path=None, abcm2ps_format_path=None):
+    ''' converts from abc to postscript. Returns (ps_file, error_message) tuple, where ps_file is None if the creation was not successful '''
+    # hash_code = get_hash_code(abc_code, read_text_if_file_exists(abcm2ps_format_path))
+    ps_file = os.path.abspath(os.path.join(cache_dir, 'temp.ps'))
+
+    # determine parameters
+    cmd1 = [abcm2ps_path, '-', '-O', '%s' % ps_file]
+    if extra_params:
+        # split extra_params on spaces, but treat quoted strings as one element even if they contain spaces
+        cmd1 = cmd1 + [x or y for (x, y) in re.findall(r'"(.+?)"|(\S+)', extra_params)]
+    if abcm2ps_format_path and not '-F' in cmd1:
+        # strip .fmt file ending
+        if abcm2ps_format_path.lower().endswith('.fmt'):
+            abcm2ps_format_path = abcm2ps_format_path[:-4]
+        cmd1 = cmd1 + ['-F', abcm2ps_format_path]
+
+    if os.path.exists(ps_file):
+        os.remove(ps_file)
+
+    input_abc = abc_code + os.linesep * 2
+    stdout_value, stderr_value, returncode = get_output_from_process(cmd1, input=input_abc, encoding=abcm2ps_default_encoding)
+    stderr_value = os.linesep.join([x for x in stderr_value.split('\n')
+                                    if not x.startswith('abcm2ps-') and not x.startswith('File ') and not x.startswith('Output written on ')])
+    stderr_value = stderr_value.strip()
+    add_message('\nAbcToPs\n' + " ".join(cmd1) + '\n' + stdout_value + stderr_value)
+    if not os.path.exists(ps_file):
+        ps_file = None
+    return (ps_file, stderr_value)
+
+def GetSvgFileList(first_page_file_path):
+    ''' given 'file001.svg' this function will return all existing files in the series, eg. ['file001.svg', 'file002.svg'] '''
+    result = []
+    for i in range(1, 1000):
+        fn = first_page_file_path.replace('001.svg', '%.3d.svg' % i)
+        if os.path.exists(fn):
+            result.append(fn)
+        else:
+            break
+    return result
+
+# 1.3.6.3 [JWDJ] 2015-04-21 splitted AbcToSvg up into 2 functions (abc_to_svg does not do preprocessing)
+def abc_to_svg(abc_code, cache_dir, settings, target_file_name=None, with_annotations=True, one_file_per_page=True, update_messages=True):
+    """ converts from abc to postscript. Returns (svg_files, error_message) tuple, where svg_files is an empty list if the creation was not successful
+        update_messages is False for background renders that should not replace the messages of the visible tune """
+    abcm2ps_path = settings.get('abcm2ps_path', '')
+    abcm2ps_format_path = settings.get('abcm2ps_format_path', '')
+    extra_params = settings.get('abcm2ps_extra_params', '')
+
+    if target_file_name:
+        svg_file = target_file_name
+        svg_file_first = svg_file.replace('.svg', '001.svg')
+    else:
+        #grab svg file from cache if it exists
+        #svg_file = os.path.abspath(os.path.join(cache_dir, 'temp_%s.svg' % hash)) # 1.3.6 [SS] 2014-11-13
+        svg_file = os.path.abspath(os.path.join(cache_dir, 'temp.svg')) # 1.3.6 [SS] 2014-11-13
+        svg_file_first = svg_file.replace('.svg', '001.svg')
+
+        #if os.path.exists(svg_file_first):  p09 disable cache
+            #return (GetSvgFileList(svg_file_first), '')
+
+        # 1.3.6 [SS] 2014-11-16
+        # clear out all 001.svg, 002.svg and etc. so the old files
+        # do not appear accidently
+        files_to_be_deleted = GetSvgFileList(svg_file_first)
+        for f in files_to_be_deleted:
+            os.remove(f)
+
+    # determine parameters
+    cmd1 = [abcm2ps_path, '-', '-O', '%s' % os.path.basename(svg_file)]
+    if one_file_per_page:
+        cmd1 = cmd1 + ['-v']
+    else:
+        cmd1 = cmd1 + ['-g']
+
+    if with_annotations:
+        cmd1 = cmd1 + ['-A']
+
+
+    if extra_params:
+        # split extra_params on spaces, but treat quoted strings as one element even if they contain spaces
+        cmd1 = cmd1 + [x or y for (x, y) in re.findall(r'"(.+?)"|(\S+)', extra_params)]
+    if abcm2ps_format_path and not '-F' in cmd1:
+        # strip .fmt file ending
+        if abcm2ps_format_path.lower().endswith('.fmt'):
+            abcm2ps_format_path = abcm2ps_format_path[:-4]
+        cmd1 = cmd1 + ['-F', abcm2ps_format_path]
+
+
+    if os.path.exists(svg_file_first):
+        os.remove(svg_file_first)
+
+    #fse = sys.getfilesystemencoding()
+    #cmd1 = [arg.encode(fse) if isinstance(arg,unicode) else arg for arg in cmd1]
+
+    # clear execmessages any time the music panel is refreshed
+    if update_messages:
+        add_message(u'\nAbcToSvg\n' + " ".join(cmd1), clear=True)
+
+    # identical abc code rendered by the same abcm2ps with the same format gives the same svg, so reuse it
+    render_cache = get_svg_render_cache(cache_dir, settings)
+    cache_key = None
+    if render_cache is not None:
+        cache_key = render_cache.get_svg_key(abc_code, settings, with_annotations, one_file_per_page)
+        cached = render_cache.get(cache_key, lambda count: [svg_file.replace('.svg', '%.3d.svg' % i) for i in range(1, count + 1)])
+        if cached is not None:
+            if update_messages:
+                add_message('\n' + _('(taken from cache)'))
+            return cached
+
+    input_abc = abc_code + os.linesep * 2
+    output = None
+    render_server = get_svg_render_server(cache_dir, settings)
+    if render_server is not None:
+        output = render_server.render(cmd1, input_abc.encode(abcm2ps_default_encoding), svg_file,
+                                      dependencies=[settings.get('abcm2ps_format_path', '')], cwd=os.path.dirname(svg_file))
+    if output is not None:
+        stdout_value, stderr_value, returncode = output
+        stdout_value, stderr_value = stdout_value.decode(abcm2ps_default_encoding), stderr_value.decode(abcm2ps_default_encoding)
+    else:
+        stdout_value, stderr_value, returncode = get_output_from_process(cmd1, input=input_abc, encoding=abcm2ps_default_encoding, bufsize=-1, cwd=os.path.dirname(svg_file))
+    if update_messages:
+        add_message('\n' + stdout_value + stderr_value)
+
+    if returncode < 0:
+        if update_messages:
+            add_message('\n' + _('%(program)s exited abnormally (errorcode %(error)#8x)') % {'program': 'Abcm2ps', 'error': returncode & 0xffffffff})
+        raise Abcm2psException('Unknown error - abcm2ps may have crashed')
+    stderr_value = os.linesep.join([x for x in stderr_value.splitlines()
+                                    if not x.startswith('abcm2ps-') and not x.startswith('File ') and not x.startswith('Output written on ')])
+    stderr_value = stderr_value.strip()
+    if os.path.exists(svg_file_first):
+        svg_files = GetSvgFileList(svg_file_first)
+        if cache_key is not None and returncode == 0:
+            render_cache.put(cache_key, svg_files, stderr_value)
+        return (svg_files, stderr_value)
+    else:
+        return ([], stderr_value)
+
+def get_svg_render_cache(cache_dir, settings):
+    ''' returns the persistent cache for abcm2ps generated svg files or None when it is disabled in the settings '''
+    try:
+        max_size = int(settings.get('svg_cache_size_mb', 100)) * 1024 * 1024
+    except ValueError:
+        max_size = 0
+    if max_size <= 0:
+        return None
+    return get_render_cache(os.path.join(cache_dir, 'svg'), max_size)
+
+def get_svg_render_server(cache_dir, settings):
+    ''' returns the warm abcm2ps processes used to render svg files or None when they are disabled in the settings '''
+    try:
+        worker_count = int(settings.get('abcm2ps_warm_workers', 1))
+    except ValueError:
+        worker_count = 0
+    if worker_count <= 0:
+        return None
+    return get_abcm2ps_render_server(os.path.join(cache_dir, 'abcm2ps_workers'), worker_count)
+
+# p09 2014-10-14 2014-12-17 2015-01-28 [SS]
+def AbcToPDF(settings, abc_code, header, cache_dir, extra_params='', abcm2ps_path=None, gs_path=None, abcm2ps_format_path=None, generate_toc=False):
+    pdf_file = os.path.abspath(os.path.join(cache_dir, 'temp.pdf'))
+    # 1.3.6 [SS] 2014-12-17
+    abc_code = process_abc_code(settings, abc_code, header, minimal_processing=True)
+    (ps_file, error) = AbcToPS(abc_code, cache_dir, extra_params, abcm2ps_path, abcm2ps_format_path)
+    if not ps_file:
+        return None
+
+    #if generate_toc:
+    #    add_table_of_contents_to_postscript_file(ps_file)
+
+    if isinstance(gs_path, bytes):
+        gs_path = gs_path.decode()
+
+    # convert ps to pdf
+    # p09 we already checked for gs_path in restore_settings() 2014-10-14
+    cmd2 = [gs_path, '-sDEVICE=pdfwrite', '-sOutputFile=%s' % pdf_file, '-dBATCH', '-dNOPAUSE', ps_file]
+    #FAU:PDF:Manage the case where one put ps2pdf from ghostscript instead of gs directly
+    if 'ps2pdf' in gs_path:
+        cmd2 = [gs_path, ps_file, pdf_file]
+    elif is_mac and int(platform.mac_ver()[0].split('.')[0]) <= 13 and gs_path == '/usr/bin/pstopdf':
+        cmd2 = [gs_path, ps_file, '-o', pdf_file]
+    if os.path.exists(pdf_file):
+        os.remove(pdf_file)
+
+    # 1.3.6.1 [SS] 2015-01-13
+    add_message('\nAbcToPDF\n' + " ".join(cmd2))
+    stdout_value, stderr_value, returncode = get_output_from_process(cmd2)
+    # 1.3.6.1 [SS] 2015-01-13
+    add_message('\n' + stderr_value)
+    if os.path.exists(pdf_file):
+        return pdf_file
+
+def export_tune_to_pdf(settings, tune, filepath, scratch_dir):
+    ''' used by ExportPool, so it should not touch any wx controls '''
+    pdf_file = AbcToPDF(settings, tune.abc, tune.header, scratch_dir, settings.get('abcm2ps_extra_params', ''),
+                        settings.get('abcm2ps_path', ''),
+                        settings.get('gs_path', ''),
+                        settings.get('abcm2ps_format_path', ''))
+    if pdf_file:
+        shutil.copy(pdf_file, filepath)
+        return True
+    return False
+
+# 1.3.6.4 [SS] 2015-07-10
+gchordpat = re.compile('\"[^\"]+\"')
+
+keypat = re.compile('([A-G]|[a-g]|)(#|b?)')
+
+def test_for_guitar_chords(abccode):
+    ''' The function returns False if there are no guitar chords
+        in the tune abccode; otherwise it returns True. It is
+        not sufficient to just find a token with enclosed by
+        double quotes. The token must begin with a letter between
+        A-G or a-g. We try up to 5 times in case, the token is
+        used to present other information above the staff.
+
+        The function is used to create a cleaner processed file
+        for MIDI by eliminating unnecessary %%MIDI commands.
+    '''
+    i = 0
+    k = 0
+    found = False
+    while k < 5:
+        m = gchordpat.search(abccode, i)
+        if m:
+            token = m.group(0)
+            i = m.end() + 1
+            if keypat.match(token[1:-1]):
+                found = True
+                break
+        else:
+            break
+        k = k + 1
+    return found
+
+# 1.3.6.4 [SS] 2015-07-03
+def list_voices_in(abccode):
+    ''' The function scans the entire abccode searching for V:
+        and extracts the voice identifier (assuming it is not
+        too long). A list of all the unique identifiers are
+        returned.
+    '''
+    voices = []
+    [voices.append(v) for v in [m.group('voice_id') or m.group('inline_voice_id') for m in voice_re.finditer(abccode)] if v not in voices]
+    return voices
+
+# 1.3.6.4 [SS] 2015-07-03
+def grab_time_signature(abccode):
+    ''' The function detects the first time signature M: n/m in
+        abccode and returns [n, m].
+    '''
+    fracpat = re.compile(r'(\d+)/(\d+)')
+    loc = abccode.find('M:')
+    meter = abccode[loc+2:loc+10]
+    meter = meter.lstrip()
+    if meter.find('C') >= 0:
+        return [4, 4]
+    m = fracpat.match(meter)
+    if m:
+        num = int(m.group(1))
+        den = int(m.group(2))
+    else:  #no M: in tune
+        num = 4
+        den = 4
+    return [num, den]
+
+# 1.3.6.4 [SS] 2015-07-03
+def drum_intro(timesig):
+    ''' Depending on the numerator of the time signature, the function
+        returns a MIDI drum command which produces a sequence of clicks.
+    '''
+    n = timesig[0]
+    if n == 2:
+        d = '%%MIDI drum dd 77 76'
+    elif n == 3:
+        # 1.3.6.4 [SS] 2015-09-06
+        d = '%%MIDI drum ddd 77 76 76'
+    elif n == 4:
+        d = '%%MIDI drum dddd 77 76 77 76 110 50 60 50'
+    elif n == 6:
+        d = '%%MIDI drum dddddd 77 76 76 77 76 76 110 50 50 60 50 50'
+    elif n == 9:
+        d = '%%MIDI drum ddddddddd 77 76 76 77 76 76 77 76 76 110 50 50 60 50 50 60 50 50'
+    else:
+        d = '%%MIDI drum d 77'
+    return d
+
+#1.3.6.4 [SS] 2015-07-05
+def need_left_repeat(abccode):
+    ''' Determine whether a left repeat |: is missing. If there
+        are no right repeats (either :| or ::) then we do not need
+        a left repeat. If a right repeat is found then we need
+        to find a left repeat that appears before the first right
+        repeat. Otherwise it is missing.
+     '''
+    loc1 = abccode.find(r':|')
+    loc2 = abccode.find(r'::')
+    if loc1 != -1 and loc2 != -1:
+        loc = min(loc1, loc2)
+    elif loc1 != -1:
+        loc = loc1
+    elif loc2 != -1:
+        loc = loc2
+    else:
+        # no right repeat found
+        return False
+
+    loc1 = abccode.find(r'|:')
+    if loc1 == -1:
+        # left repeat missing but right repeat found
+        return True
+    if loc1 < loc:
+        return False
+    # left repeat found after right repeat. (Left repeat
+    # missing for first repeat block.)
+    return True
+
+# 1.3.6.4 [SS] 2015-07-03
+def make_abc_introduction(abccode, voicelist):
+    ''' Given the music in abc notation, the function creates a sequence
+        of clicks which counts in the tune. The function needs to determine
+        the time signature and a list of all the voice names in the tune.
+        If there are no voices, the sequence is in inserted after the first K:;
+        otherwise, the sequence is inserted into the first voice and the
+        other voices are padded with silent measures. Frequently, the
+        left repeat symbol is omitted. We need to put a left repeat after
+        the clicking sequence so that clicking sequence is not repeated.
+    '''
+    intro = []
+    meter = grab_time_signature(abccode)
+
+    if voicelist:
+        intro.append("V: {0}".format(voicelist[0]))
+    intro.append(drum_intro(meter))
+    intro.append("%%MIDI drumon")
+    if need_left_repeat(abccode):
+        intro.append("Z|Z|:\\")
+    else:
+        intro.append("Z|Z|\\")
+    intro.append("%%MIDI drumoff")
+
+    if voicelist:
+        for v in voicelist[1:]:
+            intro.append("V: {0}".format(v))
+            if need_left_repeat(abccode):
+                intro.append("Z|Z|:\\")
+            else:
+                intro.append("Z|Z|\\")
+    return intro
+
+# 1.3.6.3 [JWDJ] 2015-04-21 split up AbcToMidi into 2 functions: preprocessing (process_abc_for_midi) and actual midi generation (abc_to_midi)
+def process_abc_for_midi(abc_code, header, cache_dir, settings, tempo_multiplier):
+    ''' This function inserts extra lines in the abc tune controlling the assignment of musical instruments to the different voices
+        per the instructions in the ABC Settings/abc2midi and voices. If the tune already contains these instructions, eg. %%MIDI program,
+        %%MIDI chordprog, etc. then the function avoids changing these assignments by suppressing the output of the additional commands.
+        Note that these assignments can also be embedded in the body of the tune using the instruction [I: MIDI = program 10] for
+        examples see https://abcmidi.sourceforge.io/ and click link [I:MIDI=...].
+    '''
+    ####   set all the control flags which determine which %%MIDI commands are written
+
+    play_chords = settings.get('play_chords')
+    default_midi_program = settings.get('midi_program')
+    default_midi_chordprog = settings.get('midi_chord_program')
+    default_midi_bassprog = settings.get('midi_bass_program')
+    # 1.3.6.4 [SS] 2015-06-07
+    default_midi_melodyvol = settings.get('melodyvol')
+    default_midi_chordvol = settings.get('chordvol')
+    default_midi_bassvol = settings.get('bassvol')
+    # 1.3.6.3 [SS] 2015-05-04
+    default_tempo = settings.get('bpmtempo')
+    # build the list of midi program to be used for each voice
+    midi_program_ch_list = ['midi_program_ch%d' % ch for ch in range(1, 16 + 1)]
+
+    # this flag is added just in case none would have been set but shouldn't be the case.
+    if not default_midi_bassprog:
+        default_midi_bassprog = default_midi_chordprog
+
+    # verify if MIDI instructions are already present if yes, no extra command should be added
+
+    add_midi_program_extra_line = True
+    add_midi_volume_extra_line = True # 1.3.6.3 [JWDJ] 2015-04-21 added so that when abc contains instrument selection, the volume from the settings can still be used
+    add_midi_gchord_extra_line = True
+    add_midi_chordprog_extra_line = True
+    add_midi_introduction = settings.get('midi_intro')  # 1.3.6.4 [SS] 2015-07-05
+
+    if not test_for_guitar_chords(abc_code):
+        add_midi_chordprog_extra_line = False
+        add_midi_gchord_extra_line = False
+
+    # 1.3.6.3 [JWDJ] 2015-04-17 header was forgotten when checking for MIDI directives
+    abclines = text_to_lines(header + abc_code)
+    for line in abclines:
+        if line.startswith('%%MIDI program'):
+            add_midi_program_extra_line = False
+        elif line.startswith('%%MIDI control 7 '):
+            add_midi_volume_extra_line = False
+        elif line.startswith('%%MIDI gchord'):
+            add_midi_gchord_extra_line = False
+        elif line.startswith('%%MIDI chordprog') or line.startswith('%%MIDI bassprog'):
+            add_midi_chordprog_extra_line = False
+        if not (add_midi_program_extra_line or add_midi_volume_extra_line or add_midi_gchord_extra_line or add_midi_chordprog_extra_line):
+            break
+
+    #### create the abc_header which will be placed in front of the processed abc file
+    # extra_lines is a list of all the MIDI commands to be put in abcheader
+
+    #FAU: enforce at least one extra_lines to avoid to introduce a blank line
+    extra_lines = ['%']
+
+    # build default list of midi_program
+    # this is needed in case no instrument per voices where defined or in case option "separate defaults per voice" is not checked
+
+    midi_program_ch = []
+    for channel in range(16):
+        midi_program_ch.append([default_midi_program, default_midi_volume, default_midi_pan])
+
+    separate_defaults_per_voice = settings.get('separate_defaults_per_voice', False)
+    if separate_defaults_per_voice:
+        for channel in range(16):
+            program_vol_pan = settings.get(midi_program_ch_list[channel])
+            if program_vol_pan:
+                midi_program_ch[channel] = program_vol_pan
+
+    # Though these instructions shouldn't be needed (they are added for each voice afterwards),
+    # there is a problem with QuickTime on the Mac and these lines ensure that the MIDI file is
+    # played correctly.
+    if is_mac:
+        for channel in range(16):
+            extra_lines.append('%%MIDI program {0} {1}'.format(channel+1, midi_program_ch[channel][0]))
+        extra_lines.append('%%MIDI program {0}'.format(default_midi_program)) # 1.3.6 [SS] 2014-11-16
+    if add_midi_volume_extra_line:
+        extra_lines.append('%%MIDI control 7 {0}'.format(midi_program_ch[0][1]))
+        extra_lines.append('%%MIDI control 10 {0}'.format(midi_program_ch[0][2]))
+
+    # add extra instruction to play guitar chords
+    if add_midi_gchord_extra_line:
+        if play_chords:
+            extra_lines.append('%%MIDI gchordon')
+            # 1.3.6 [SS] 2014-11-26
+            gchord = settings.get('gchord')
+            if gchord and gchord != 'default':
+                extra_lines.append('%%MIDI gchord '+ gchord)
+
+        else:
+            extra_lines.append('%%MIDI gchordoff')
+    # add extra instruction to define instrument for guitar chords and bass
+    # These lines should be added to only the voices that have guitar chords. However,
+    # unless we scan the voice in advance, we do not know whether it does have guitar
+    # chords. There is nothing wrong in including these commands in every voice since
+    # they will be ignored if nonapplicable; but it makes a rather messy processed for
+    # midi file which is harder to interpret.
+
+    # The extra_lines are added after X:1 in case the tune is not multivoice but
+    # has guitar chords embedded. If it is a multivoice tune or the tune does not
+    # have guitar chords, these lines are not necessary but do not do any harm.
+    #
+    # 1.3.6.4 [SS] 2015-06-29
+    if add_midi_program_extra_line:
+        extra_lines.append('%%MIDI program {0}'.format(default_midi_program))
+
+    if add_midi_chordprog_extra_line:
+        extra_lines.append('%%MIDI chordprog {0}'.format(default_midi_chordprog))
+        extra_lines.append('%%MIDI bassprog {0}'.format(default_midi_bassprog))
+        # 1.3.6.4 [SS] 2015-06-07
+        extra_lines.append('%%MIDI chordvol {0}'.format(default_midi_chordvol))
+        extra_lines.append('%%MIDI bassvol {0}'.format(default_midi_bassvol))
+
+    # 1.3.6.3 [SS] 2015-03-19
+    if int(settings.get('transposition', 0)) != 0:
+        extra_lines.append('%%MIDI transpose {0}'.format(settings['transposition']))
+
+    # 1.3.6.3 [SS] 2015-05-04
+    if default_tempo != 120:
+        extra_lines.append('Q:1/4 = %s' % default_tempo)
+
+    abcheader = os.linesep.join(extra_lines + [header.strip()])
+
+    # 1.3.6.4 [SS] 2015-07-07
+    voicelist = list_voices_in(abc_code)
+    # 1.3.6.4 [SS] 2015-07-03
+    if add_midi_introduction:
+        midi_introduction = make_abc_introduction(abc_code, voicelist)
+
+    ####  modify abc_code to add MIDI instruction just after voice definition
+    # (because using channel only in header doesn't seem to allow association with voice
+
+    abclines = text_to_lines(abc_code) # 1.3.6.3 [JWDJ] 2015-04-17 split abc_code without header
+
+    # 1.3.7.0 [SS] 2016-01-05
+    # always add %%MIDI control 7 so user can control volume of melody
+    #if add_midi_program_extra_line or add_midi_gchord_extra_line or add_midi_introduction:
+    if True:  # 1.3.7.0 [SS] 2016-01-05
+        list_voice = [] # keeps track of the voices we have already seen
+        new_abc_lines = [] # contains the new processed abc tune
+        voice = 0
+        header_finished = False
+        for line in abclines:
+            new_abc_lines.append(line)
+            # do not take into account the definition present in the header (maybe it would be better... to be further analysed)
+            if line.startswith('K:'):
+                if not header_finished:
+                    # 1.3.6.4 [SS] 2015-07-09
+                    if len(voicelist) == 0:
+                        new_abc_lines.append('%%MIDI control 7 {0}'.format(int(default_midi_melodyvol)))
+                    # 1.3.6.4 [SS] 2015-07-03
+                    if add_midi_introduction:
+                        new_abc_lines.extend(midi_introduction)
+                header_finished = True
+            if header_finished:
+                match = voice_re.match(line)
+                if match:
+                    inline_voice_id = match.group('inline_voice_id')
+                    voice_ID = inline_voice_id or match.group('voice_id')
+                    if voice_ID not in list_voice:
+                        # 1.3.6.4 [SS] 2015-07-08
+                        # if it is an inline voice, we are not want to include the following notes before
+                        # specifying the %%MIDI parameters
+                        if inline_voice_id:
+                            # remove last line in new_abc and put it back afterwards
+                            removedline = new_abc_lines.pop()
+                            new_abc_lines.append('V: {0}'.format(voice_ID))
+
+                        # 1.3.6.4 [SS] 2015-06-19
+                        # ideally you should determine whether gchords are present in this voice
+                        voice_has_gchords = True
+
+                        #as it's a new voice, add MIDI program instruction
+                        list_voice.append(voice_ID)
+                        if add_midi_program_extra_line:
+                            new_abc_lines.append('%%MIDI program {0}'.format(midi_program_ch[voice][0]))
+                        if add_midi_volume_extra_line:
+                            new_abc_lines.append('%%MIDI control 7 {0}'.format(midi_program_ch[voice][1]))
+                            new_abc_lines.append('%%MIDI control 10 {0}'.format(midi_program_ch[voice][2]))
+
+                        if voice_has_gchords:
+                            if add_midi_gchord_extra_line:
+                                if play_chords:
+                                    new_abc_lines.append('%%MIDI gchordon')
+                                else:
+                                    new_abc_lines.append('%%MIDI gchordoff')
+                            if add_midi_chordprog_extra_line:
+                                new_abc_lines.append('%%MIDI chordprog {0}'.format(default_midi_chordprog))
+                                new_abc_lines.append('%%MIDI bassprog {0}'.format(default_midi_bassprog))
+                                # 1.3.6.4 [SS] 2015-06-19
+                                new_abc_lines.append('%%MIDI chordvol {0}'.format(default_midi_chordvol))
+                                new_abc_lines.append('%%MIDI bassvol {0}'.format(default_midi_bassvol))
+                        if inline_voice_id:
+                            new_abc_lines.append(removedline)
+                        voice += 1
+                        if voice == 16:
+                            voice = 0
+
+        abc_code = os.linesep.join(new_abc_lines)
+
+    #### assemble everything together
+
+    # 1.3.6.4 [SS] 2014-07-07 replacement for process_abc_code
+    # we do not want any abcm2ps options added
+    sections = [abcheader.rstrip() + os.linesep, abc_code]
+    abc_code = ''.join(sections) # put it together
+    abc_code = re.sub(r'\[\[(.*/)(.+?)\]\]', r'\2', abc_code)  # strip PmWiki links and just include the link text
+    if tempo_multiplier:
+        abc_code = change_abc_tempo(abc_code, tempo_multiplier)
+    abc_code = process_MCM(abc_code)
+    # 1.3.6.3 [JWdJ] 2015-04-22 fixing newlines to part of process_abc_code
+    abc_code = re.sub(r'\r\n|\r', '\n', abc_code)  ## TEST
+    # 1.3.6 [SS] 2014-12-17
+    #abc_code = process_abc_code(settings,abc_code, abcheader, tempo_multiplier=tempo_multiplier, minimal_processing=True)
+
+    abc_code = abc_code.replace(r'\"', ' ')  # replace escaped " characters with space since abc2midi doesn't understand them
+
+    # make sure that X field is on the first line since abc2midi doesn't seem to support
+    # fields and instructions that come before the X field
+    if not abc_code.startswith('X:'):
+        abclines = text_to_lines(abc_code) # take it apart again
+        for i in range(len(abclines)):
+            if abclines[i].startswith('X:'):
+                line = abclines[i]
+                del abclines[i]
+                abclines.insert(0, line)
+                break
+        abc_code = os.linesep.join(abclines) # put it back together
+
+    #### for debugging
+    #Write temporary abc_file (for debug purpose)
+    #temp_abc_file =  os.path.abspath(os.path.join(cache_dir, 'temp_%s.abc' % hash)) 1.3.6 [SS] 2014-11-13
+    temp_abc_file = os.path.abspath(os.path.join(cache_dir, 'temp.abc')) # 1.3.6 [SS] 2014-11-13
+    f = codecs.open(temp_abc_file, 'wb', 'UTF-8') #p08 patch
+    f.write(abc_code)
+    f.close()
+
+    return abc_code
+
+# 1.3.6.3 [JWDJ] 2015-04-21 split up AbcToMidi into 2 functions: preprocessing (process_abc_for_midi) and actual midi generation (abc_to_midi)
+def abc_to_midi(abc_code, settings, midi_file_name, add_follow_score_markers, update_messages=True, process_started=None):
+
+    abc2midi_path = settings.get('abc2midi_path')
+    cmd = [abc2midi_path, '-', '-o', midi_file_name]
+    cmd = add_abc2midi_options(cmd, settings, add_follow_score_markers)
+    if update_messages:
+        add_message('\nAbcToMidi\n' + " ".join(cmd))
+    input_abc = abc_code + os.linesep * 2
+    stdout_value, stderr_value, returncode = get_output_from_process(cmd, input=input_abc, process_started=process_started)
+    if update_messages:
+        add_message('\n' + stdout_value + stderr_value)
+    if stdout_value:
+        stdout_value = re.sub(r'(?m)(writing MIDI file .*\r?\n?)', '', stdout_value)
+    if returncode != 0:
+        # 1.3.7.0 [SS] 2016-01-06
+        if update_messages:
+            add_message('\n' + _('%(program)s exited abnormally (errorcode %(error)#8x)') % { 'program': 'AbcToMidi', 'error': returncode & 0xffffffff })
+        return None
+
+    return midi_file_name
+
+def get_midi_cache_key(abc_code, settings, tempo_multiplier, add_follow_score_markers):
+    ''' returns a key that is the same for abc code that abc2midi would convert to the same midi file.
+        abc_code should be the result of process_abc_for_midi '''
+    cmd = add_abc2midi_options([settings.get('abc2midi_path')], settings, add_follow_score_markers)
+    h = hashlib.sha1()
+    for part in [abc_code, tempo_multiplier] + cmd:
+        h.update(u'{0}'.format(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def export_tune_to_midi(settings, tempo_multiplier, tune, filepath, scratch_dir):
+    ''' used by ExportPool, so it should not touch any wx controls '''
+    abc_code = process_abc_for_midi(tune.abc, tune.header, scratch_dir, settings, tempo_multiplier)
+    return abc_to_midi(abc_code, settings, filepath, False) is not None
+
+# 1.3.6 [SS] 2014-11-24
+def add_abc2midi_options(cmd, settings, add_follow_score_markers):
+    #Force BF option flag to be at the last position according to jwdj/EasyABC#86 and sshlien/abcmidi#8
+    #if str2bool(settings['barfly']):
+    #    cmd.append('-BF')
+    if str2bool(settings['nofermatas']):
+        cmd.append('-NFER')
+    if str2bool(settings['nograce']):
+        cmd.append('-NGRA')
+    if str2bool(settings['nodynamics']):
+        cmd.append('-NFNP')
+    # 1.3.6.3 [SS] 2015-03-20
+    if settings['tuning'] != '440':
+        cmd.append('-TT %s' % settings['tuning'])
+    # 1.3.6.4 [JWDJ] 2016-06-22
+    if add_follow_score_markers:
+        cmd.append('-EA')
+    if str2bool(settings['barfly']):
+        cmd.append('-BF')
+    return cmd
+
+# 1.3.6 [SS] 2014-11-24
+def str2bool(v):
+    ''' converts a string to a boolean if necessary'''
+    if type(v) == str:
+        return v.lower() in ('yes', 'true', 't', '1')
+    else:
+        return v
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+""" Converts abc files to svg, pdf, midi or MusicXML without starting the EasyABC user interface.
+
+    Examples:
+        python abc_convert.py -f pdf tunes/
+        python abc_convert.py -f midi -f xml -o out -j 4 tunes/ extra.abc
+
+    Files whose output is newer than the abc file are skipped, unless --force is given.
+    The same abcm2ps, abc2midi and ghostscript settings as EasyABC are used; pass --settings
+    to reuse the settings file of an installed EasyABC.
+"""
+
+import sys
+import os, os.path
+import re
+import shutil
+import pickle
+import tempfile
+import threading
+import argparse
+from collections import namedtuple
+
+import abc_conversion
+from abc_conversion import *
+from export_pool import ExportPool, ExportJob
+from render_server import shutdown_render_servers
+from utils import search_files, get_application_path
+
+abc_extensions = ['.abc']
+output_formats = ['svg', 'pdf', 'midi', 'xml']
+output_extensions = {'svg': '.svg', 'pdf': '.pdf', 'midi': '.mid', 'xml': '.xml'}
+
+default_settings = {
+    'abcm2ps_path': '', 'abc2midi_path': '', 'gs_path': '',
+    'abcm2ps_format_path': '', 'abcm2ps_extra_params': '',
+    'abcm2ps_number_bars': False, 'abcm2ps_no_lyrics': False,
+    'abcm2ps_refnumbers': False, 'abcm2ps_ignore_ends': False,
+    'abcm2ps_leftmargin': '1.78', 'abcm2ps_rightmargin': '1.78',
+    'abcm2ps_topmargin': '1.00', 'abcm2ps_botmargin': '1.00',
+    'abcm2ps_scale': '0.75', 'abcm2ps_clean': False,
+    'abcm2ps_defaults': True, 'abcm2ps_pagewidth': '21.59', 'abcm2ps_pageheight': '27.94',
+    'play_chords': False, 'midi_program': default_midi_instrument, 'midi_chord_program': 24,
+    'midi_bass_program': 25, 'gchord': 'default', 'separate_defaults_per_voice': False,
+    'transposition': 0, 'tuning': '440',
+    'nodynamics': False, 'nofermatas': False, 'nograce': False, 'barfly': True,
+    'bpmtempo': 120, 'chordvol': default_midi_volume, 'bassvol': default_midi_volume,
+    'melodyvol': default_midi_volume, 'midi_intro': 0,
+    'xmlcompressed': False,
+    'svg_cache_size_mb': 0,  # every file is rendered once, so caching would only cost disk space
+    'abcm2ps_warm_workers': 0,  # a waiting abcm2ps would keep the scratch directory of a worker in use
+}
+
+# same attributes as the tunes that EasyABC passes to export_tune_to_pdf and export_tune_to_midi
+AbcFileTune = namedtuple('AbcFileTune', 'x_number title abc header')
+
+# a conversion of one abc file (svg, pdf) or of one tune (midi, xml) to one output file
+ConversionTask = namedtuple('ConversionTask', 'output_format source_path tune')
+
+xml_lock = threading.Lock()  # abc2xml keeps its state in module globals, so only one conversion at a time
+
+
+def get_file_header(abc_code):
+    """ Returns the lines before the first tune that apply to all tunes, like EasyABC's GetFileHeaderBlock """
+    lines = []
+    getall = False
+    for line in text_to_lines(abc_code):
+        if line.startswith('X:') or line.startswith('T:'):
+            break
+        elif line.startswith('%%beginps'):
+            getall = True
+            lines.append(line)
+        elif re.match(r'%%.*|[a-zA-Z_]:.*', line):
+            lines.append(line)
+        elif getall:
+            lines.append(line)
+        if line.startswith('%%endps'):
+            getall = False
+    abc = '\n'.join(lines)
+    abc = re.sub(r'(?ms)(^%%multicol start.*%%multicol end[ \t]*?[\r\n]+)', '', abc)
+    abc = re.sub(r'(?ms)(^%%begintext.*%%endtext.*?[\r\n]+)', '', abc)
+    abc = re.sub(r'(?m)(^%%(EPS|text|multicol|center|sep|vskip|newpage).*[\r\n]*)', '', abc)
+    return abc
+
+
+def split_abc_tunes(abc_code):
+    """ Returns an AbcFileTune for every tune (starting with an X: line) in the abc code """
+    header = get_file_header(abc_code)
+    tunes = []
+    tune_lines = None
+    for line in text_to_lines(abc_code):
+        if line.startswith('X:'):
+            tune_lines = [line]
+            tunes.append(tune_lines)
+        elif tune_lines is not None:
+            tune_lines.append(line)
+
+    result = []
+    for lines in tunes:
+        x_number = lines[0][2:].strip()
+        title = ''
+        for line in lines:
+            if line.startswith('T:'):
+                title = line[2:].strip()
+                break
+        result.append(AbcFileTune(x_number, title, '\n'.join(lines).rstrip() + '\n', header))
+    return result
+
+
+def find_program(name, settings_value=None):
+    """ Returns the path of an external program: the configured one, the one shipped in bin/ or the one on the PATH """
+    if settings_value and os.path.exists(settings_value):
+        return settings_value
+    exe_name = name
+    if is_windows:
+        exe_name += '.exe'
+    bundled = os.path.join(get_application_path(), 'bin', exe_name)
+    if os.path.exists(bundled):
+        return bundled
+    which = getattr(shutil, 'which', None)  # since Python 3.3
+    if which is not None:
+        return which(name) or ''
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, exe_name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return ''
+
+
+def load_settings(settings_path):
+    settings = dict(default_settings)
+    if settings_path:
+        with open(settings_path, 'rb') as f:
+            settings.update(pickle.load(f))
+        # the user interface stores the tuning as a number
+        settings['tuning'] = str(settings.get('tuning', 440))
+    return settings
+
+
+def is_up_to_date(output_path, source_paths):
+    try:
+        output_time = os.path.getmtime(output_path)
+    except OSError:
+        return False
+    return all(output_time >= os.path.getmtime(p) for p in source_paths if p and os.path.exists(p))
+
+
+def get_output_base(abc_path, input_root, output_dir):
+    """ Returns output path without extension. The directory structure below input_root is kept in output_dir """
+    stem = os.path.splitext(abc_path)[0]
+    if not output_dir:
+        return stem
+    if input_root:
+        return os.path.join(output_dir, os.path.relpath(stem, input_root))
+    return os.path.join(output_dir, os.path.basename(stem))
+
+
+def collect_abc_files(inputs):
+    """ Returns a list of (abc_path, input_root) tuples, where input_root is the directory given on the command line """
+    result = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for abc_path in sorted(search_files(path, abc_extensions)):
+                result.append((abc_path, path))
+        else:
+            result.append((path, None))
+    return result
+
+
+def create_tasks(abc_files, formats, settings, output_dir=None, force=False):
+    """ Returns the list of ExportJobs that are needed to bring the output up to date and the number of skipped outputs """
+    jobs = []
+    skipped = 0
+    dependencies = [settings.get('abcm2ps_format_path')]
+    for abc_path, input_root in abc_files:
+        base = get_output_base(abc_path, input_root, output_dir)
+        sources = [abc_path] + dependencies
+        abc_code = None
+        tunes = None
+        for output_format in formats:
+            if output_format in ('svg', 'pdf'):
+                output_path = base + output_extensions[output_format]
+                check_path = output_path
+                if output_format == 'svg':
+                    check_path = output_path.replace('.svg', '001.svg')  # abcm2ps writes one file per page
+                if not force and is_up_to_date(check_path, sources):
+                    skipped += 1
+                    continue
+                if abc_code is None:
+                    abc_code = read_abc_file(abc_path)
+                tune = AbcFileTune('', '', abc_code, '')
+                jobs.append(ExportJob(len(jobs), ConversionTask(output_format, abc_path, tune), output_path))
+            else:
+                if tunes is None:
+                    if abc_code is None:
+                        abc_code = read_abc_file(abc_path)
+                    tunes = split_abc_tunes(abc_code)
+                for tune in tunes:
+                    output_path = '{0}_{1}{2}'.format(base, tune.x_number, output_extensions[output_format])
+                    if not force and is_up_to_date(output_path, sources):
+                        skipped += 1
+                        continue
+                    jobs.append(ExportJob(len(jobs), ConversionTask(output_format, abc_path, tune), output_path))
+    return jobs, skipped
+
+
+def convert(settings, task, output_path, scratch_dir):
+    ''' used by ExportPool, called from a worker thread '''
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except OSError:
+            if not os.path.isdir(output_dir):  # another worker may have created it in the mean time
+                raise
+
+    output_format = task.output_format
+    tune = task.tune
+    if output_format == 'pdf':
+        return export_tune_to_pdf(settings, tune, output_path, scratch_dir)
+    elif output_format == 'svg':
+        abc_code = process_abc_code(settings, tune.abc, tune.header, minimal_processing=True)
+        svg_files, error = abc_to_svg(abc_code, scratch_dir, settings, target_file_name=os.path.abspath(output_path),
+                                      with_annotations=False, update_messages=False)
+        if error:
+            add_message(error)
+        return bool(svg_files)
+    elif output_format == 'midi':
+        return export_tune_to_midi(settings, None, tune, output_path, scratch_dir)
+    elif output_format == 'xml':
+        from xml2abc_interface import abc_to_xml
+        abc_code = process_abc_code(settings, tune.abc, tune.header, minimal_processing=True)
+        info_messages = []
+        with xml_lock:
+            abc_to_xml(abc_code, output_path, settings.get('xmlcompressed', False), info_messages=info_messages)
+        for message in info_messages:
+            add_message(message)
+        if settings.get('xmlcompressed', False):
+            output_path = os.path.splitext(output_path)[0] + '.mxl'
+        return os.path.exists(output_path)
+    raise ValueError('Unknown output format: %s' % output_format)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Converts abc files to svg, pdf, midi or MusicXML.')
+    parser.add_argument('inputs', nargs='+', metavar='PATH', help='abc file or directory that is searched for abc files')
+    parser.add_argument('-f', '--format', dest='formats', action='append', choices=output_formats,
+                        help='output format, can be given more than once (default: pdf)')
+    parser.add_argument('-o', '--output-dir', help='directory for the output files (default: next to the abc files)')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='number of conversions that run at the same time (default: number of processors)')
+    parser.add_argument('--force', action='store_true', help='also convert files whose output is up to date')
+    parser.add_argument('--settings', help='EasyABC settings file (settings1.3.dat) to take the conversion settings from')
+    parser.add_argument('--format-file', help='abcm2ps format file')
+    parser.add_argument('--abcm2ps', help='path of abcm2ps')
+    parser.add_argument('--abc2midi', help='path of abc2midi')
+    parser.add_argument('--gs', help='path of ghostscript (needed for pdf)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the external programs')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    formats = options.formats or ['pdf']
+
+    settings = load_settings(options.settings)
+    settings['abcm2ps_path'] = find_program('abcm2ps', options.abcm2ps or settings.get('abcm2ps_path'))
+    settings['abc2midi_path'] = find_program('abc2midi', options.abc2midi or settings.get('abc2midi_path'))
+    settings['gs_path'] = find_program('gs', options.gs or settings.get('gs_path'))
+    if options.format_file:
+        settings['abcm2ps_format_path'] = options.format_file
+    settings['abcm2ps_warm_workers'] = 0  # also when the settings file of EasyABC asks for them
+
+    required_programs = []
+    if 'svg' in formats or 'pdf' in formats:
+        required_programs.append(('abcm2ps', 'abcm2ps_path'))
+    if 'pdf' in formats:
+        required_programs.append(('gs', 'gs_path'))
+    if 'midi' in formats:
+        required_programs.append(('abc2midi', 'abc2midi_path'))
+    for name, key in required_programs:
+        if not settings[key]:
+            sys.stderr.write('%s not found, use --%s to specify its location\n' % (name, name))
+            return 2
+
+    output_lock = threading.Lock()
+    def write_message(text, clear=False):
+        if options.verbose and text.strip():
+            with output_lock:
+                sys.stderr.write(text.strip() + '\n')
+    abc_conversion.message_listener = write_message
+
+    abc_files = collect_abc_files(options.inputs)
+    jobs, skipped = create_tasks(abc_files, formats, settings, options.output_dir, options.force)
+    if not jobs:
+        print('Nothing to do, %d output files are up to date' % skipped)
+        return 0
+
+    scratch_root = tempfile.mkdtemp(prefix='abc_convert')
+    failures = 0
+    try:
+        pool = ExportPool(lambda task, output_path, scratch_dir: convert(settings, task, output_path, scratch_dir),
+                          scratch_root, options.jobs)
+        pool.start(jobs)
+        try:
+            while not pool.is_done:
+                for result in pool.get_results():
+                    task = result.job.tune
+                    with output_lock:
+                        if result.success:
+                            print('%s -> %s' % (task.source_path, result.job.file_path))
+                        else:
+                            failures += 1
+                            sys.stderr.write('Failed: %s -> %s\n' % (task.source_path, result.job.file_path))
+                            if result.error:
+                                sys.stderr.write(result.error)
+        except KeyboardInterrupt:
+            pool.cancel()
+            pool.join()
+            return 130
+        pool.join()
+    finally:
+        shutdown_render_servers()
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+    print('%d converted, %d failed, %d up to date' % (len(jobs) - failures, failures, skipped))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
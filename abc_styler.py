@@ -13,199 +13,754 @@
 #    You should have received a copy of the GNU Lesser General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import sys
 PY3 = sys.version_info >= (3,0,0)
+if PY3:
+    xrange = range
+
+STYLE_DEFAULT = 0
+STYLE_COMMENT_NORMAL = 1
+STYLE_COMMENT_SPECIAL = 2
+STYLE_GRACE = 3
+STYLE_FIELD = 4
+STYLE_FIELD_VALUE = 5
+STYLE_FIELD_INDEX = 6
+STYLE_EMBEDDED_FIELD = 7
+STYLE_EMBEDDED_FIELD_VALUE = 8
+STYLE_BAR = 9
+STYLE_CHORD = 10
+STYLE_STRING = 11
+STYLE_ORNAMENT_EXCL = 12
+STYLE_ORNAMENT_PLUS = 13
+STYLE_ORNAMENT = 14
+STYLE_LYRICS = 15
+
+fields = 'ABCDEFGHIJKLMmNOPQRrSsTUVWwXYZ'
+ornaments = 'HIJKLMNOPQRSTUVWhijklmnopqrstuvw~'
+# go back to default style if next character is \r\n (to avoid some strange syntax highlighting with lyrics at least on mac version)
+style_changers = {
+    STYLE_FIELD_VALUE: '\n%',
+    STYLE_COMMENT_NORMAL: '\n',
+    STYLE_COMMENT_SPECIAL: '\n%',
+    STYLE_ORNAMENT_EXCL: '!\n%',
+    STYLE_ORNAMENT_PLUS: '+\n%',
+    STYLE_GRACE: '}\n%',
+    STYLE_CHORD: ']\n%',
+    STYLE_EMBEDDED_FIELD_VALUE: ']\n%',
+    STYLE_STRING: '"\n%',
+    STYLE_DEFAULT: '|[:.!%"{+\n' + ornaments
+}
+style_keepers = {
+    STYLE_BAR: '|[]:1234',
+    STYLE_ORNAMENT: ornaments,
+}
+style_per_char = {
+    '!': STYLE_ORNAMENT_EXCL,
+    '+': STYLE_ORNAMENT_PLUS,
+    '{': STYLE_GRACE,
+}
+
+
+def style_text_per_char(text, ch_prev=0):
+    """ Styles text (bytes that start at the beginning of a line) one character at a time and returns the styles as a bytearray.
+        This is how ABCStyler used to work, it is kept as the reference for the rules that ABCStyler.style_lines implements faster. """
+    chars = [chr(c) for c in bytearray(text)]
+    chars.append('\x00')  # add a dummy character so the last actual character gets processed too
+    styles = bytearray(len(text))
+    state = STYLE_DEFAULT
+    next_state = None
+    style_changer = None
+    style_keeper = None
+    chPrev = chr(ch_prev)
+    ch = chars[0]
+    count = 0
+    for chNext in chars[1:]:
+        if (not style_changer or ch in style_changer) and (not style_keeper or not ch in style_keeper):
+            style_changer = None
+            if style_keeper:
+                style_keeper = None
+                state = STYLE_DEFAULT
+
+            if ch in '\r\n':
+                state = STYLE_DEFAULT
+            elif state == STYLE_DEFAULT:
+                if chPrev in '\n[\x00' and ch in fields and chNext == ':':
+                    if chPrev == '[':
+                        state = STYLE_EMBEDDED_FIELD   # field on the [M:3/4] form
+                    elif ch in 'wW':
+                        state = STYLE_LYRICS
+                        style_changer = style_changers[STYLE_FIELD_VALUE]
+                    elif ch == 'X':
+                        state = STYLE_FIELD_INDEX
+                        style_changer = style_changers[STYLE_FIELD_VALUE]
+                    else:
+                        state = STYLE_FIELD
+                elif ch == '|' or (ch in ':.' and chNext in '|:') or (ch == '[' and chNext in '1234'):
+                    state = STYLE_BAR
+                    style_keeper = style_keepers[state]
+                elif ch in '!+{':
+                    state = style_per_char[ch]
+                    style_changer = style_changers[state]
+                elif ch == '%':
+                    if chNext == '%' and chPrev in '\n\x00':
+                        state = STYLE_COMMENT_SPECIAL
+                    else:
+                        state = STYLE_COMMENT_NORMAL
+                        style_changer = style_changers[state]
+                elif ch == '"':
+                    state = STYLE_STRING
+                    style_changer = style_changers[state]
+                elif ch in ornaments:
+                    state = STYLE_ORNAMENT
+                    style_keeper = style_keepers[state]
+                elif chPrev == '[':
+                    state = STYLE_CHORD
+                    style_changer = style_changers[state]
+            elif state in (STYLE_ORNAMENT_EXCL, STYLE_ORNAMENT_PLUS):
+                if style_per_char.get(ch) == state:
+                    next_state = STYLE_DEFAULT
+            elif state == STYLE_GRACE:
+                if ch == '}':
+                    next_state = STYLE_DEFAULT
+            elif state == STYLE_COMMENT_SPECIAL and chPrev == '%':
+                style_changer = style_changers[state]
+            elif state in (STYLE_FIELD_VALUE, STYLE_LYRICS, STYLE_COMMENT_SPECIAL):
+                if ch == '%' and chPrev != '\\':
+                    state = STYLE_COMMENT_NORMAL
+                    style_changer = style_changers[state]
+            elif state in (STYLE_CHORD, STYLE_EMBEDDED_FIELD_VALUE):
+                if ch == ']':
+                    state = STYLE_DEFAULT
+            elif state == STYLE_FIELD:
+                if ch == ':':
+                    next_state = STYLE_FIELD_VALUE
+                    style_changer = style_changers[next_state]
+            elif state == STYLE_EMBEDDED_FIELD:
+                if ch == ':':
+                    next_state = STYLE_EMBEDDED_FIELD_VALUE
+                    style_changer = style_changers[next_state]
+            elif state == STYLE_STRING:
+                if ch == '"':
+                    if chPrev != '\\':
+                        next_state = STYLE_DEFAULT
+                    else:
+                        style_changer = style_changers[state]  # when " is escaped with \ then look for next ""
+            else:
+                state = STYLE_DEFAULT
+                style_changer = style_changers[state]
+
+        styles[count] = state
+        count += 1
+
+        if next_state is not None:
+            state = next_state
+            next_state = None
+
+        chPrev = ch
+        ch = chNext
+    return styles
+
+
+def char_set(chars):
+    return frozenset(bytearray(chars.encode('latin-1')))
+
+def char_class_re(chars, negate=False):
+    return re.compile(b'[' + (b'^' if negate else b'') + re.escape(chars.encode('latin-1')) + b']')
+
+# changers and keepers are referred to by their index + 1, so a lexer state consists of small integers (0 is None)
+changer_strings = sorted(set(style_changers.values()))
+keeper_strings = sorted(set(style_keepers.values()))
+changer_ids = dict((chars, i + 1) for i, chars in enumerate(changer_strings))
+keeper_ids = dict((chars, i + 1) for i, chars in enumerate(keeper_strings))
+changer_sets = [None] + [char_set(chars) for chars in changer_strings]
+keeper_sets = [None] + [char_set(chars) for chars in keeper_strings]
+# these find the next character that can change the style. A \r is included because it can end a line
+changer_res = [None] + [char_class_re(chars + '\r') for chars in changer_strings]
+not_keeper_res = [None] + [char_class_re(chars, negate=True) for chars in keeper_strings]
+
+# Without a changer or keeper every character is examined, but in these states only the listed characters
+# (or any character after one of the characters in after_characters) can change the state
+trigger_res = {
+    STYLE_DEFAULT: char_class_re('\r\n|:.[!+{%"\x00' + ornaments),
+    STYLE_ORNAMENT_EXCL: char_class_re('!\r\n'),
+    STYLE_ORNAMENT_PLUS: char_class_re('+\r\n'),
+    STYLE_GRACE: char_class_re('}\r\n'),
+    STYLE_COMMENT_SPECIAL: char_class_re('%\r\n'),
+    STYLE_FIELD_VALUE: char_class_re('%\r\n'),
+    STYLE_LYRICS: char_class_re('%\r\n'),
+    STYLE_CHORD: char_class_re(']\r\n'),
+    STYLE_EMBEDDED_FIELD_VALUE: char_class_re(']\r\n'),
+    STYLE_FIELD: char_class_re(':\r\n'),
+    STYLE_EMBEDDED_FIELD: char_class_re(':\r\n'),
+    STYLE_STRING: char_class_re('"\r\n'),
+}
+after_characters = {
+    STYLE_DEFAULT: char_set('\n[\x00'),
+    STYLE_COMMENT_SPECIAL: char_set('%'),
+}
+default_after_characters = after_characters[STYLE_DEFAULT]
+
+# In the default style most constructs can be recognized at once. Each alternative matches a complete construct, in the
+# order the rules are applied, and only when it ends on the same line; otherwise the characters are styled one by one.
+def class_chars(chars):
+    return re.escape(chars.encode('latin-1'))
+
+bar_chars = class_chars(style_keepers[STYLE_BAR])
+ornament_chars = class_chars(ornaments)
+field_chars = class_chars(fields)
+
+# The characters in front of a construct (a run) are notes, rests, spaces, single bars, ornaments and line ends.
+# Their style only depends on the character itself, see run_styles
+run_chars = b'[^' + class_chars('\r\n|:.[!+{%"\x00' + ornaments) + b']*'
+default_token_re = re.compile(
+    run_chars +
+    b'(?:(?:[:.](?![|:])'
+    b'|\\|+(?=[^' + bar_chars + b'])'
+    b'|[' + ornament_chars + b'](?=[\\s\\S])'
+    b'|\\r?\\n(?!%|[' + field_chars + b']:)'  # unless the next line starts with a field or a comment
+    b')' + run_chars + b')*'
+    b'(?:(?P<bar>(?:\\||[:.](?=[|:])|\\[(?=[1234]))[' + bar_chars + b']*(?=[^' + bar_chars + b']))'
+    b'|(?P<excl>![^!\\r\\n%]*!)'
+    b'|(?P<plus>\\+[^+\\r\\n%]*\\+)'
+    b'|(?P<grace>\\{[^}\\r\\n%]*\\})'
+    b'|(?P<comment>%[^\\r\\n]*\\r?)\\n'
+    b'|(?P<string>"[^"\\r\\n%]*(?:(?<=\\\\)"[^"\\r\\n%]*)*(?<!\\\\)")'
+    b'|(?P<embedded>\\[(?P<embedded_field>[' + field_chars + b']:)(?P<embedded_value>[^\\]\\r\\n%]*)\\])'
+    b'|(?P<chord>\\[(?P<chord_notes>[A-Ga-gz^_=](?!:)[^\\]\\r\\n%]*)\\]))?')
+# at the start of a line (after \n) fields and comments that end on the same line
+line_start_token_re = re.compile(
+    b'(?:(?P<lyrics>[wW]:[^\\r\\n%]*\\r?)'
+    b'|(?P<index>X:[^\\r\\n%]*\\r?)'
+    b'|(?P<field>(?P<field_name>[' + field_chars + b']:)(?P<field_value>[^\\r\\n%]*\\r?))'
+    b'|(?P<special>%%[^\\r\\n%]*\\r?)'
+    b'|(?P<comment>%(?!%)[^\\r\\n]*\\r?))\\n')
+run_styles = bytearray(256)
+run_styles[ord('|')] = STYLE_BAR
+for c in ornaments:
+    run_styles[ord(c)] = STYLE_ORNAMENT
+run_styles = bytes(run_styles)
+token_styles = {
+    'bar': STYLE_BAR,
+    'excl': STYLE_ORNAMENT_EXCL,
+    'plus': STYLE_ORNAMENT_PLUS,
+    'grace': STYLE_GRACE,
+    'comment': STYLE_COMMENT_NORMAL,
+    'string': STYLE_STRING,
+    'lyrics': STYLE_LYRICS,
+    'index': STYLE_FIELD_INDEX,
+    'special': STYLE_COMMENT_SPECIAL,
+}
+token_parts = {
+    'embedded': (('embedded_field', STYLE_EMBEDDED_FIELD), ('embedded_value', STYLE_EMBEDDED_FIELD_VALUE)),
+    'chord': (('chord_notes', STYLE_CHORD),),
+    'field': (('field_name', STYLE_FIELD), ('field_value', STYLE_FIELD_VALUE)),
+}
+field_start_characters = char_set(fields + '%')
+
+# a lexer state is (style, changer id, keeper id, previous character)
+initial_lexer_state = (STYLE_DEFAULT, 0, 0, 0)
+newline_lexer_state = (STYLE_DEFAULT, 0, 0, 0x0A)  # the state after every \n
+
+def encode_lexer_state(lexer_state):
+    """ packs a lexer state into an integer that Scintilla keeps for every line.
+        The state after a \n becomes 0, which is also the line state of lines that have not been styled yet """
+    style, changer, keeper, ch_prev = lexer_state
+    return style | (changer << 5) | (keeper << 9) | ((ch_prev ^ 0x0A) << 11)
+
+def decode_lexer_state(line_state):
+    return (line_state & 0x1F, (line_state >> 5) & 0xF, (line_state >> 9) & 0x3, ((line_state >> 11) & 0xFF) ^ 0x0A)
+
 
 class ABCStyler:
+    """ Styles the abc code in a Scintilla editor.
+
+        The style of a character only depends on the characters in front of it on the same line and on the state of the
+        lexer at the start of the line, which is kept as the line state of every styled line. After an edit, styling starts
+        at the changed line and stops as soon as the next unchanged line starts in the same state as before.
+        Regular expressions find complete constructs (bars, strings, fields, comments, ...) and the next character that
+        can change the style, so runs of characters are styled at once instead of character by character. """
+    chunk_size = 100000  # number of bytes that are read from the editor at once
+
     def __init__(self, styled_text_ctrl):
         self.e = styled_text_ctrl
-        self.STYLE_DEFAULT = 0
-        self.STYLE_COMMENT_NORMAL = 1
-        self.STYLE_COMMENT_SPECIAL = 2
-        self.STYLE_GRACE = 3
-        self.STYLE_FIELD = 4
-        self.STYLE_FIELD_VALUE = 5
-        self.STYLE_FIELD_INDEX = 6
-        self.STYLE_EMBEDDED_FIELD = 7
-        self.STYLE_EMBEDDED_FIELD_VALUE = 8
-        self.STYLE_BAR = 9
-        self.STYLE_CHORD = 10
-        self.STYLE_STRING = 11
-        self.STYLE_ORNAMENT_EXCL = 12
-        self.STYLE_ORNAMENT_PLUS = 13
-        self.STYLE_ORNAMENT = 14
-        self.STYLE_LYRICS = 15
-
-        self.fields = 'ABCDEFGHIJKLMmNOPQRrSsTUVWwXYZ'
-        self.ornaments = 'HIJKLMNOPQRSTUVWhijklmnopqrstuvw~'
-        # go back to default style if next character is \r\n (to avoid some strange syntax highlighting with lyrics at least on mac version)
-        self.style_changers = {
-            self.STYLE_FIELD_VALUE: '\n%',
-            self.STYLE_COMMENT_NORMAL: '\n',
-            self.STYLE_COMMENT_SPECIAL: '\n%',
-            self.STYLE_ORNAMENT_EXCL: '!\n%',
-            self.STYLE_ORNAMENT_PLUS: '+\n%',
-            self.STYLE_GRACE: '}\n%',
-            self.STYLE_CHORD: ']\n%',
-            self.STYLE_EMBEDDED_FIELD_VALUE: ']\n%',
-            self.STYLE_STRING: '"\n%',
-            self.STYLE_DEFAULT: '|[:.!%"{+\n' + self.ornaments
-        }
-        self.style_keepers = {
-            self.STYLE_BAR: '|[]:1234',
-            self.STYLE_ORNAMENT: self.ornaments,
-        }
-        self.style_per_char = {
-            '!': self.STYLE_ORNAMENT_EXCL,
-            '+': self.STYLE_ORNAMENT_PLUS,
-            '{': self.STYLE_GRACE,
-        }
+        self.STYLE_DEFAULT = STYLE_DEFAULT
+        self.STYLE_COMMENT_NORMAL = STYLE_COMMENT_NORMAL
+        self.STYLE_COMMENT_SPECIAL = STYLE_COMMENT_SPECIAL
+        self.STYLE_GRACE = STYLE_GRACE
+        self.STYLE_FIELD = STYLE_FIELD
+        self.STYLE_FIELD_VALUE = STYLE_FIELD_VALUE
+        self.STYLE_FIELD_INDEX = STYLE_FIELD_INDEX
+        self.STYLE_EMBEDDED_FIELD = STYLE_EMBEDDED_FIELD
+        self.STYLE_EMBEDDED_FIELD_VALUE = STYLE_EMBEDDED_FIELD_VALUE
+        self.STYLE_BAR = STYLE_BAR
+        self.STYLE_CHORD = STYLE_CHORD
+        self.STYLE_STRING = STYLE_STRING
+        self.STYLE_ORNAMENT_EXCL = STYLE_ORNAMENT_EXCL
+        self.STYLE_ORNAMENT_PLUS = STYLE_ORNAMENT_PLUS
+        self.STYLE_ORNAMENT = STYLE_ORNAMENT
+        self.STYLE_LYRICS = STYLE_LYRICS
+
+        self.fields = fields
+        self.ornaments = ornaments
+        self.style_changers = style_changers
+        self.style_keepers = style_keepers
+        self.style_per_char = style_per_char
+
+        self.styled_line_count = 0  # the lines before this line have been styled before
+        self.dirty_end_line = -1    # the last line that has changed since it was styled
+        self.restyled_line_count = 0
+        self.has_line_states = False  # whether a line state other than 0 has been set
+
+    def invalidate(self):
+        """ Should be called when the styles of the whole text are cleared """
+        self.styled_line_count = 0
+        self.dirty_end_line = -1
+
+    def text_changed(self, first_line, lines_added):
+        """ Should be called after text was inserted or deleted at first_line. lines_added is negative when lines were deleted """
+        if first_line < self.styled_line_count:
+            self.styled_line_count = max(first_line, self.styled_line_count + lines_added)
+        if self.dirty_end_line >= first_line:
+            self.dirty_end_line = max(first_line, self.dirty_end_line + lines_added)
+        dirty_end_line = first_line + max(0, lines_added)
+        if lines_added and self.has_line_states:
+            # Scintilla keeps the line states by line number, so the first line that moved can have the line state of a
+            # neighbour and still look unchanged. Restyling it compares the line after it with its own line state
+            dirty_end_line += 1
+        self.dirty_end_line = max(self.dirty_end_line, dirty_end_line)
+
+    def style_char(self, style, changer, keeper, ch, chPrev, chNext):
+        """ Applies the styling rules to one character (see style_text_per_char).
+            Returns the style of the character and the style, changer and keeper for the next character """
+        next_style = None
+        if (not changer or ch in changer_sets[changer]) and (not keeper or not ch in keeper_sets[keeper]):
+            changer = 0
+            if keeper:
+                keeper = 0
+                style = STYLE_DEFAULT
+
+            if ch == 10 or ch == 13:  # \n or \r
+                style = STYLE_DEFAULT
+            elif style == STYLE_DEFAULT:
+                c = chr(ch)
+                n = chr(chNext)
+                p = chr(chPrev)
+                if p in '\n[\x00' and c in fields and n == ':':
+                    if p == '[':
+                        style = STYLE_EMBEDDED_FIELD
+                    elif c in 'wW':
+                        style = STYLE_LYRICS
+                        changer = changer_ids[style_changers[STYLE_FIELD_VALUE]]
+                    elif c == 'X':
+                        style = STYLE_FIELD_INDEX
+                        changer = changer_ids[style_changers[STYLE_FIELD_VALUE]]
+                    else:
+                        style = STYLE_FIELD
+                elif c == '|' or (c in ':.' and n in '|:') or (c == '[' and n in '1234'):
+                    style = STYLE_BAR
+                    keeper = keeper_ids[style_keepers[style]]
+                elif c in '!+{':
+                    style = style_per_char[c]
+                    changer = changer_ids[style_changers[style]]
+                elif c == '%':
+                    if n == '%' and p in '\n\x00':
+                        style = STYLE_COMMENT_SPECIAL
+                    else:
+                        style = STYLE_COMMENT_NORMAL
+                        changer = changer_ids[style_changers[style]]
+                elif c == '"':
+                    style = STYLE_STRING
+                    changer = changer_ids[style_changers[style]]
+                elif c in ornaments:
+                    style = STYLE_ORNAMENT
+                    keeper = keeper_ids[style_keepers[style]]
+                elif p == '[':
+                    style = STYLE_CHORD
+                    changer = changer_ids[style_changers[style]]
+            elif style in (STYLE_ORNAMENT_EXCL, STYLE_ORNAMENT_PLUS):
+                if style_per_char.get(chr(ch)) == style:
+                    next_style = STYLE_DEFAULT
+            elif style == STYLE_GRACE:
+                if ch == 0x7D:  # }
+                    next_style = STYLE_DEFAULT
+            elif style == STYLE_COMMENT_SPECIAL and chPrev == 0x25:  # %
+                changer = changer_ids[style_changers[style]]
+            elif style in (STYLE_FIELD_VALUE, STYLE_LYRICS, STYLE_COMMENT_SPECIAL):
+                if ch == 0x25 and chPrev != 0x5C:  # % not preceded by \
+                    style = STYLE_COMMENT_NORMAL
+                    changer = changer_ids[style_changers[style]]
+            elif style in (STYLE_CHORD, STYLE_EMBEDDED_FIELD_VALUE):
+                if ch == 0x5D:  # ]
+                    style = STYLE_DEFAULT
+            elif style == STYLE_FIELD:
+                if ch == 0x3A:  # :
+                    next_style = STYLE_FIELD_VALUE
+                    changer = changer_ids[style_changers[next_style]]
+            elif style == STYLE_EMBEDDED_FIELD:
+                if ch == 0x3A:  # :
+                    next_style = STYLE_EMBEDDED_FIELD_VALUE
+                    changer = changer_ids[style_changers[next_style]]
+            elif style == STYLE_STRING:
+                if ch == 0x22:  # "
+                    if chPrev != 0x5C:
+                        next_style = STYLE_DEFAULT
+                    else:
+                        changer = changer_ids[style_changers[style]]  # when " is escaped with \ then look for next ""
+            else:
+                style = STYLE_DEFAULT
+                changer = changer_ids[style_changers[style]]
+
+        if next_style is None:
+            return style, style, changer, keeper
+        return style, next_style, changer, keeper
+
+    def style_lines(self, text, lexer_state=initial_lexer_state, line_states=None):
+        """ Styles text (bytes) that starts at the beginning of a line in lexer_state.
+            Returns the styles as a bytearray and the lexer state at the end of the text.
+            Every line that does not start in newline_lexer_state (it follows a \r without \n) is added to the
+            line_states dictionary as {line number relative to the first line: lexer state} """
+        style, changer, keeper, ch_prev = lexer_state
+        styles = bytearray(len(text))  # filled with STYLE_DEFAULT
+        text = bytearray(text)  # indexing gives integers on both python 2 and 3
+        length = len(text)
+        match_default_token = default_token_re.match
+        match_line_start_token = line_start_token_re.match
+        line_offset = 0    # the number of line ends before counted_pos
+        counted_pos = 0
+        i = 0
+        while i < length:
+            ch = text[i]
+            if style == STYLE_DEFAULT and not changer and not keeper:
+                # match a complete construct, the characters in front of it keep the default style
+                m = None
+                if ch_prev not in default_after_characters:
+                    m = match_default_token(text, i)
+                elif ch_prev != 0x5B:  # not after [, so at the start of a line
+                    m = match_line_start_token(text, i)
+                    if not m and not (ch in field_start_characters and text[i+1:i+2] in (b':', b'%')):
+                        m = match_default_token(text, i)
+                if m:
+                    end = m.end()
+                    if end > i:
+                        name = m.lastgroup
+                        if name is None:
+                            styles[i:end] = text[i:end].translate(run_styles)
+                        else:
+                            start = m.start(name)
+                            if start > i:
+                                styles[i:start] = text[i:start].translate(run_styles)
+                            if name in token_styles:
+                                start, end = m.span(name)
+                                styles[start:end] = bytearray((token_styles[name],)) * (end - start)
+                            else:
+                                for part, part_style in token_parts[name]:
+                                    start, end = m.span(part)
+                                    styles[start:end] = bytearray((part_style,)) * (end - start)
+                        i = m.end()
+                        ch_prev = text[i-1]
+                        continue
+
+            if ch == 0x0A:  # \n always gets the default style and resets the state
+                style, changer, keeper, ch_prev = newline_lexer_state
+                i += 1
+                continue
+
+            # find the next character that might change the style, the characters before it get the current style
+            if changer:
+                m = changer_res[changer].search(text, i)
+            elif keeper:
+                m = not_keeper_res[keeper].search(text, i)
+            elif style in trigger_res and ch_prev not in after_characters.get(style, ()):
+                m = trigger_res[style].search(text, i)
+            else:
+                m = True
+            if m is not True:
+                end = m.start() if m else length
+                if end > i:
+                    styles[i:end] = bytearray((style,)) * (end - i)
+                    ch_prev = text[end-1]
+                    i = end
+                    if i == length or text[i] == 0x0A:
+                        continue
+                    ch = text[i]
+            ch_next = text[i+1] if i + 1 < length else 0
+            styles[i], style, changer, keeper = self.style_char(style, changer, keeper, ch, ch_prev, ch_next)
+            ch_prev = ch
+            i += 1
+            if ch == 0x0D and ch_next != 0x0A and line_states is not None:  # a line that ends with \r only
+                line_offset += text.count(b'\n', counted_pos, i) + 1
+                counted_pos = i
+                line_states[line_offset] = (style, changer, keeper, ch_prev)
+        return styles, (style, changer, keeper, ch_prev)
+
+    def style_text(self, text):
+        """ Styles a complete document, returns the styles as a bytearray """
+        return self.style_lines(text, initial_lexer_state, {})[0]
+
+    def get_lexer_state(self, line_no):
+        """ The state of the lexer at the start of line line_no """
+        if line_no == 0:
+            return initial_lexer_state
+        return decode_lexer_state(self.e.GetLineState(line_no))
+
+    def start_styling(self, position):
+        try:
+            self.e.StartStyling(position, 31)   # only style the text style bits
+        except:
+            self.e.StartStyling(position)
 
     def OnStyleNeeded(self, event):
-        STYLE_DEFAULT = self.STYLE_DEFAULT
-        STYLE_COMMENT_NORMAL = self.STYLE_COMMENT_NORMAL
-        STYLE_COMMENT_SPECIAL = self.STYLE_COMMENT_SPECIAL
-        STYLE_GRACE = self.STYLE_GRACE
-        STYLE_FIELD = self.STYLE_FIELD
-        STYLE_FIELD_VALUE = self.STYLE_FIELD_VALUE
-        STYLE_FIELD_INDEX = self.STYLE_FIELD_INDEX
-        STYLE_EMBEDDED_FIELD = self.STYLE_EMBEDDED_FIELD
-        STYLE_EMBEDDED_FIELD_VALUE = self.STYLE_EMBEDDED_FIELD_VALUE
-        STYLE_BAR = self.STYLE_BAR
-        STYLE_CHORD = self.STYLE_CHORD
-        STYLE_STRING = self.STYLE_STRING
-        STYLE_ORNAMENT_EXCL = self.STYLE_ORNAMENT_EXCL
-        STYLE_ORNAMENT_PLUS = self.STYLE_ORNAMENT_PLUS
-        STYLE_ORNAMENT = self.STYLE_ORNAMENT
-        STYLE_LYRICS = self.STYLE_LYRICS
-        STYLE_CHORD = self.STYLE_CHORD
-        style_changers = self.style_changers
-        style_per_char = self.style_per_char
-        style_keepers = self.style_keepers
-        fields = self.fields
-        ornaments = self.ornaments
         editor = self.e
-        get_char_at = editor.GetCharAt
         get_text_range = editor.GetTextRangeRaw
         set_styling = editor.SetStyleBytes
-        start = editor.GetEndStyled()    # this is the first character that needs styling
-        end = event.GetPosition()        # this is the last character that needs styling
-        line_start = editor.LineFromPosition(start)
-        start = editor.PositionFromLine(line_start)
-        state = STYLE_DEFAULT  #  editor.GetStyleAt(start-1)  # init style
+        get_line_state = editor.GetLineState
+        set_line_state = editor.SetLineState
+        line_count = editor.GetLineCount()
         text_length = editor.GetTextLength()
-        next_state = None
-        try:
-            editor.StartStyling(start, 31)   # only style the text style bits
-        except:
-            editor.StartStyling(start)
-        i = start
-        chPrev = chr(get_char_at(i-1))
-        ch = chr(get_char_at(i))
-
-        buffer_pos = start + 1
-        #FAU: In some case of end of line / end of file might end up with a a styles[count] pointing out of range.
-        #FAU: Add +1 in buffer_size
-        #buffer_size = min(100000, end-start)
-        buffer_size = min(100000, end-start+1)
-        styles = bytearray(buffer_size)
-        style_changer = None
-        style_keeper = None
-        while True:
-            count = 0
-            next_buffer = get_text_range(buffer_pos, min(buffer_pos + buffer_size, text_length))
-            if PY3:
-                next_buffer = list(map(chr, next_buffer))
-            buffer_pos += len(next_buffer)
-            if buffer_pos >= text_length:
-                if not PY3:
-                    next_buffer = list(next_buffer)
-                next_buffer.append('\x00')  # add a dummy character so the last actual character gets processed too
-            for chNext in next_buffer:
-                if (not style_changer or ch in style_changer) and (not style_keeper or not ch in style_keeper):
-                    style_changer = None
-                    if style_keeper:
-                        style_keeper = None
-                        state = STYLE_DEFAULT
-
-                    if ch in '\r\n':
-                        state = STYLE_DEFAULT
-                    elif state == STYLE_DEFAULT:
-                        if chPrev in '\n[\x00' and ch in fields and chNext == ':':
-                            if chPrev == '[':
-                                state = STYLE_EMBEDDED_FIELD   # field on the [M:3/4] form
-                            elif ch in 'wW':
-                                state = STYLE_LYRICS
-                                style_changer = style_changers[STYLE_FIELD_VALUE]
-                            elif ch == 'X':
-                                state = STYLE_FIELD_INDEX
-                                style_changer = style_changers[STYLE_FIELD_VALUE]
-                            else:
-                                state = STYLE_FIELD
-                        elif ch == '|' or (ch in ':.' and chNext in '|:') or (ch == '[' and chNext in '1234'):
-                            state = STYLE_BAR
-                            style_keeper = style_keepers[state]
-                        elif ch in '!+{':
-                            state = style_per_char[ch]
-                            style_changer = style_changers[state]
-                        elif ch == '%':
-                            if chNext == '%' and chPrev in '\n\x00':
-                                state = STYLE_COMMENT_SPECIAL
-                            else:
-                                state = STYLE_COMMENT_NORMAL
-                                style_changer = style_changers[state]
-                        elif ch == '"':
-                            state = STYLE_STRING
-                            style_changer = style_changers[state]
-                        elif ch in ornaments:
-                            state = STYLE_ORNAMENT
-                            style_keeper = style_keepers[state]
-                        elif chPrev == '[':
-                            state = STYLE_CHORD
-                            style_changer = style_changers[state]
-                    elif state in (STYLE_ORNAMENT_EXCL, STYLE_ORNAMENT_PLUS):
-                        if style_per_char.get(ch) == state:
-                            next_state = STYLE_DEFAULT
-                    elif state == STYLE_GRACE:
-                        if ch == '}':
-                            next_state = STYLE_DEFAULT
-                    elif state == STYLE_COMMENT_SPECIAL and chPrev == '%':
-                        style_changer = style_changers[state]
-                    elif state in (STYLE_FIELD_VALUE, STYLE_LYRICS, STYLE_COMMENT_SPECIAL):
-                        if ch == '%' and chPrev != '\\':
-                            state = STYLE_COMMENT_NORMAL
-                            style_changer = style_changers[state]
-                    elif state in (STYLE_CHORD, STYLE_EMBEDDED_FIELD_VALUE):
-                        if ch == ']':
-                            state = STYLE_DEFAULT
-                    elif state == STYLE_FIELD:
-                        if ch == ':':
-                            next_state = STYLE_FIELD_VALUE
-                            style_changer = style_changers[next_state]
-                    elif state == STYLE_EMBEDDED_FIELD:
-                        if ch == ':':
-                            next_state = STYLE_EMBEDDED_FIELD_VALUE
-                            style_changer = style_changers[next_state]
-                    elif state == STYLE_STRING:
-                        if ch == '"':
-                            if chPrev != '\\':
-                                next_state = STYLE_DEFAULT
-                            else:
-                                style_changer = style_changers[state]  # when " is escaped with \ then look for next ""
+
+        def position_from_line(line_no):
+            if line_no >= line_count:
+                return text_length
+            return editor.PositionFromLine(line_no)
+
+        # the first line that needs styling. When the line end in front of the first changed character has changed
+        # (for example the \n of a \r\n was deleted), the previous line ends in a different state, so it is styled too
+        line_no = editor.LineFromPosition(max(0, editor.GetEndStyled() - 1))
+        end_line = editor.LineFromPosition(event.GetPosition())      # the last line that needs styling
+        lexer_state = self.get_lexer_state(line_no)
+        pos = position_from_line(line_no)
+        self.start_styling(pos)
+        while line_no <= end_line:
+            last_line = min(end_line, editor.LineFromPosition(pos + self.chunk_size))
+            if line_no <= self.dirty_end_line:
+                last_line = min(last_line, self.dirty_end_line)  # so styling can stop right after the changed lines
+            chunk_end = position_from_line(last_line + 1)
+            line_states = {}
+            styles, lexer_state = self.style_lines(get_text_range(pos, chunk_end), lexer_state, line_states)
+            set_styling(len(styles), bytes(styles))
+            self.restyled_line_count += last_line + 1 - line_no
+
+            state_changed = False
+            if line_states or self.has_line_states:
+                # lines that start in newline_lexer_state have line state 0, which is also the initial line state.
+                # As long as all lines end with \n, the line states do not have to be looked at
+                self.has_line_states = True
+                for next_line_no in xrange(line_no + 1, min(last_line + 2, line_count)):
+                    line_state = encode_lexer_state(line_states.get(next_line_no - line_no, newline_lexer_state))
+                    state_changed = get_line_state(next_line_no) != line_state
+                    if state_changed:
+                        set_line_state(next_line_no, line_state)
+                if last_line + 1 >= line_count:
+                    state_changed = False
+            line_no = last_line + 1
+            pos = chunk_end
+            if state_changed:
+                self.dirty_end_line = max(self.dirty_end_line, line_no)  # the next line was styled for a different start state
+            elif self.dirty_end_line < line_no < min(self.styled_line_count, line_count):
+                # the following lines have not changed since they were styled and they start in the same state
+                line_no = self.styled_line_count
+                lexer_state = self.get_lexer_state(line_no)
+                pos = position_from_line(line_no)
+                self.start_styling(pos)  # marks the skipped lines as styled
+
+        self.styled_line_count = max(self.styled_line_count, line_no)
+        if line_no > self.dirty_end_line:
+            self.dirty_end_line = -1
+
+
+def benchmark_styling(megabytes=5, repeat=3):
+    """ Prints the throughput of styling one character at a time (the old way) and with ABCStyler.style_lines """
+    import time
+    tune = (u'X:1\nT:Benchmark reel\nC:Trad.\nM:4/4\nL:1/8\nQ:1/4=120\n%%MIDI program 73\nK:D\n'
+            u'|:"D"dAFA dAFA|"G"B2GB "A"AFEF|!trill!d2 {ed}cd TB2AG|[1"D"FDEC D4:|[2"D"FDEC D2z2||\n'
+            u'w:la la la la la la la la la la la\n'
+            u'% a comment with [brackets] and "quotes"\n'
+            u'|:fa~a2 [K:G]bgag|f2ed +fermata+B2AF|[M:3/4]"Em"E2 "A7"A2 (3Bcd|"D"d6:|\n')
+    text = (tune * (megabytes * 1024 * 1024 // len(tune) + 1)).encode('utf-8')
+    styler = ABCStyler(None)
+    results = []
+    for name, func in [('per character', style_text_per_char), ('regular expressions', styler.style_text)]:
+        timings = []
+        for i in range(repeat):
+            start_time = time.time()
+            styles = func(text)
+            timings.append(time.time() - start_time)
+        best = min(timings)
+        print('%-20s %.2f s for %.1f MB (%.2f MB/s)' % (name, best, len(text) / 1048576.0, len(text) / 1048576.0 / best))
+        results.append(styles)
+    if results[0] != results[1]:
+        print('the styles differ!')
+
+
+class SimulatedEditor(object):
+    """ The part of a Scintilla editor that ABCStyler uses. Line states move along with inserted and removed lines
+        the way Scintilla's CellBuffer moves them, including the joining and splitting of \r\n """
+    line_end_re = re.compile(b'\r\n|\r|\n')
+
+    def __init__(self, text):
+        self.text = text
+        self.styles = bytearray(len(text))
+        self.line_states = []
+        self.end_styled = 0
+        self.style_pos = 0
+
+    def line_starts(self):
+        return [0] + [m.end() for m in self.line_end_re.finditer(self.text)]
+
+    def GetLineCount(self):
+        return len(self.line_starts())
+
+    def GetTextLength(self):
+        return len(self.text)
+
+    def PositionFromLine(self, line_no):
+        line_starts = self.line_starts()
+        if line_no < len(line_starts):
+            return line_starts[line_no]
+        return -1
+
+    def LineFromPosition(self, pos):
+        from bisect import bisect_right
+        return bisect_right(self.line_starts(), pos) - 1
+
+    def GetTextRangeRaw(self, start, end):
+        return self.text[start:end]
+
+    def GetEndStyled(self):
+        return self.end_styled
+
+    def StartStyling(self, pos):
+        self.end_styled = self.style_pos = pos
+
+    def SetStyleBytes(self, length, styles):
+        self.styles[self.style_pos:self.style_pos + length] = bytearray(styles)[:length]
+        self.style_pos += length
+        self.end_styled = self.style_pos
+
+    def GetLineState(self, line_no):
+        if line_no < len(self.line_states):
+            return self.line_states[line_no]
+        return 0
+
+    def SetLineState(self, line_no, value):
+        self.line_states.extend([0] * (line_no + 1 - len(self.line_states)))
+        self.line_states[line_no] = value
+
+    def char_at(self, pos):
+        if 0 <= pos < len(self.text):
+            return self.text[pos:pos + 1]
+        return b'\0'
+
+    def insert_line_state(self, line_no, at_line_start):
+        if self.line_states:
+            if line_no > 0 and at_line_start:
+                line_no -= 1
+            self.line_states.extend([0] * (line_no - len(self.line_states)))
+            self.line_states.insert(line_no, self.GetLineState(line_no))  # a copy of the state of the line that moves
+
+    def remove_line_state(self, line_no):
+        if line_no < len(self.line_states):
+            del self.line_states[line_no]
+
+    def insert(self, pos, text):
+        """ Inserts text at pos and returns the number of lines added """
+        line_count = self.GetLineCount()
+        line_no = self.LineFromPosition(pos) + 1
+        at_line_start = self.PositionFromLine(line_no - 1) == pos
+        ch_prev, ch_after = self.char_at(pos - 1), self.char_at(pos)
+        if ch_prev == b'\r' and ch_after == b'\n':
+            self.insert_line_state(line_no, False)  # splits a \r\n
+            line_no += 1
+        ch = b''
+        for i in xrange(len(text)):
+            ch = text[i:i + 1]
+            if ch == b'\r' or (ch == b'\n' and ch_prev != b'\r'):
+                self.insert_line_state(line_no, at_line_start)
+                line_no += 1
+            ch_prev = ch
+        if ch == b'\r' and ch_after == b'\n':
+            self.remove_line_state(line_no - 1)  # joins a \r\n
+        self.text = self.text[:pos] + text + self.text[pos:]
+        self.styles[pos:pos] = bytearray(len(text))
+        self.end_styled = min(self.end_styled, pos)
+        return self.GetLineCount() - line_count
+
+    def delete(self, pos, length):
+        """ Deletes length bytes at pos and returns the number of lines added (negative or 0) """
+        line_count = self.GetLineCount()
+        if pos == 0 and length == len(self.text):
+            self.line_states = []
+        else:
+            line_no = self.LineFromPosition(pos) + 1
+            ch_before = self.char_at(pos - 1)
+            ch_next = self.char_at(pos)
+            ignore_newline = ch_before == b'\r' and ch_next == b'\n'  # deleting the \n of a \r\n removes no line
+            if ignore_newline:
+                line_no += 1
+            ch = ch_next
+            for i in xrange(length):
+                ch_next = self.char_at(pos + i + 1)
+                if ch == b'\r' and ch_next != b'\n':
+                    self.remove_line_state(line_no)
+                elif ch == b'\n':
+                    if ignore_newline:
+                        ignore_newline = False
                     else:
-                        state = STYLE_DEFAULT
-                        style_changer = style_changers[state]
+                        self.remove_line_state(line_no)
+                ch = ch_next
+            if ch_before == b'\r' and self.char_at(pos + length) == b'\n':
+                self.remove_line_state(line_no - 1)  # joins a \r\n
+        self.text = self.text[:pos] + self.text[pos + length:]
+        del self.styles[pos:pos + length]
+        self.end_styled = min(self.end_styled, pos)
+        return self.GetLineCount() - line_count
+
+
+def check_incremental_styling(trials=2000, edits=20, seed=1):
+    """ Makes random edits with \n, \r and \r\n line ends in a SimulatedEditor, styles parts of the text in between
+        like Scintilla asks for it and checks that the result is the same as styling the whole text at once.
+        Returns the number of trials with wrong styles """
+    import random
+
+    class StyleNeededEvent(object):
+        def __init__(self, position):
+            self.position = position
+
+        def GetPosition(self):
+            return self.position
+
+    fragments = ['X:1', 'K:G', 'w:la', 'abc', '|', ':|', '"Am"', '!trill!', '{ed}', '[K:D]', '%', ' ', 'X', ':', '"', '!', '{',
+                 '\n', '\n', '\r', '\r', '\r\n', '\nX\n']
+    rnd = random.Random(seed)
 
-                styles[count] = state
-                count += 1
+    def random_text(fragment_count):
+        return ''.join(rnd.choice(fragments) for i in xrange(fragment_count)).encode('utf-8')
 
-                if next_state is not None:
-                    state = next_state
-                    next_state = None
+    wrong = 0
+    for trial in xrange(trials):
+        editor = SimulatedEditor(random_text(rnd.randint(0, 40)))
+        styler = ABCStyler(editor)
+        styler.OnStyleNeeded(StyleNeededEvent(editor.GetTextLength()))
+        for edit in xrange(edits):
+            pos = rnd.randint(0, editor.GetTextLength())
+            if rnd.random() < 0.4:
+                lines_added = editor.delete(pos, min(editor.GetTextLength() - pos, rnd.choice([1, 2, 3, 10])))
+            else:
+                lines_added = editor.insert(pos, random_text(rnd.choice([1, 1, 2, 4])))
+            styler.text_changed(editor.LineFromPosition(pos), lines_added)
+            if rnd.random() < 0.5:
+                styler.OnStyleNeeded(StyleNeededEvent(rnd.randint(0, editor.GetTextLength())))
+        styler.OnStyleNeeded(StyleNeededEvent(editor.GetTextLength()))
+        if bytes(editor.styles) != bytes(style_text_per_char(editor.text)):
+            wrong += 1
+    print('%d of %d edited texts were styled wrong' % (wrong, trials))
+    return wrong
 
-                chPrev = ch
-                ch = chNext
 
-            set_styling(count, bytes(styles))
-            if buffer_pos >= end:
-                break
+if __name__ == '__main__':
+    # python abc_styler.py [megabytes]
+    # python abc_styler.py check
+    if sys.argv[1:2] == ['check']:
+        sys.exit(1 if check_incremental_styling() else 0)
+    benchmark_styling(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,178 @@
+import os, os.path
+import re
+import sys
+import subprocess
+import threading
+from ctypes import c_short, sizeof, string_at
+
+from abc_conversion import process_abc_for_midi, abc_to_midi
+
+creationflags = 0
+if sys.platform == 'win32':
+    creationflags = 0x08000000  # CREATE_NO_WINDOW
+
+
+class RenderSynth(object):
+    """ A synthesizer with a loaded soundfont that renders midi files faster than realtime.
+        Loading a soundfont takes a while, so one RenderSynth can render many tunes one after another.
+    """
+    def __init__(self, soundfont_path):
+        import fluidsynth as F
+        self.F = F
+        self.fs = F.Synth(gain=1.0, bsize=2048)
+        # the player should follow the rendered samples instead of the system timer
+        self.fs.setting_setstr("player.timing-source", "sample")
+        self.sfid = self.fs.sfload(soundfont_path)
+
+    @property
+    def has_soundfont(self):
+        return self.sfid >= 0  # negative when it is not a sf2 file
+
+    def create_player(self, midi_path):
+        self.fs.system_reset()  # forget the programs and controllers of the previous tune
+        self.fs.program_select(0, self.sfid, 0, 0)
+        player = self.F.Player(self.fs)
+        player.add(midi_path)
+        return player
+
+    def render_to_file(self, midi_path, output_path):
+        """ Renders a midi file to a wave file using the file renderer of FluidSynth. Returns the number of rendered frames """
+        if not self.has_soundfont:
+            return 0
+        self.fs.setting_setstr("audio.file.name", output_path)
+        player = self.create_player(midi_path)
+        try:
+            player.play()
+            return player.renderLoop()
+        finally:
+            player.delete()
+
+    def render_to_stream(self, midi_path, stream, frames_per_block=4096):
+        """ Renders a midi file as 16 bit stereo samples and writes them block by block to stream,
+            so memory use does not depend on the length of the tune. Returns the number of rendered frames """
+        if not self.has_soundfont:
+            return 0
+        frames = 0
+        buffer = (c_short * (2 * frames_per_block))()
+        player = self.create_player(midi_path)
+        try:
+            player.play()
+            while player.get_status() == 1:  # 1 = playing
+                if self.fs.write_s16_stereo(frames_per_block, buffer) != 0:
+                    break
+                stream.write(string_at(buffer, sizeof(buffer)))
+                frames += frames_per_block
+            player.stop()
+        finally:
+            player.delete()
+        return frames
+
+    def render_to_ffmpeg(self, midi_path, ffmpeg_path, output_path):
+        """ Renders a midi file and pipes the samples straight into ffmpeg, so no temporary wave file is needed.
+            Returns (success, messages) """
+        cmd = get_ffmpeg_encode_cmd(ffmpeg_path, output_path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   creationflags=creationflags, bufsize=-1)
+
+        # ffmpeg would stop reading its input when nobody reads its output
+        output = []
+        output_reader = threading.Thread(target=lambda: output.append(process.stdout.read()))
+        output_reader.daemon = True
+        output_reader.start()
+
+        frames = 0
+        try:
+            frames = self.render_to_stream(midi_path, process.stdin)
+        except (IOError, OSError):
+            pass  # ffmpeg stopped early, its output tells why
+        finally:
+            try:
+                process.stdin.close()
+            except (IOError, OSError):
+                pass
+            returncode = process.wait()
+            output_reader.join()
+
+        messages = b''.join(output).decode('utf-8', 'replace')
+        return frames > 0 and returncode == 0, ' '.join(cmd) + '\n' + messages
+
+    def delete(self):
+        self.fs.delete()
+
+
+def render_midi_to_file(soundfont_path, midi_path, output_path):
+    synth = RenderSynth(soundfont_path)
+    try:
+        return synth.render_to_file(midi_path, output_path)
+    finally:
+        synth.delete()
+
+def render_midi_to_ffmpeg(soundfont_path, midi_path, ffmpeg_path, output_path):
+    synth = RenderSynth(soundfont_path)
+    try:
+        return synth.render_to_ffmpeg(midi_path, ffmpeg_path, output_path)
+    finally:
+        synth.delete()
+
+def get_ffmpeg_encode_cmd(ffmpeg_path, output_path, sample_rate=44100):
+    """ Returns the ffmpeg command line that encodes raw 16 bit stereo samples read from stdin to output_path """
+    cmd = [ffmpeg_path, '-y', '-loglevel', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', '2', '-i', 'pipe:0']
+    if os.path.splitext(output_path)[1].lower() == '.m4a':
+        cmd += ['-c:a', 'aac', '-q:a', '0.5']
+    else:
+        cmd += ['-vn']
+    return cmd + [output_path]
+
+class AudioExporter(object):
+    """ Converts tunes to audio files for ExportPool. Every worker gets its own RenderSynth,
+        so the soundfont is loaded once per worker instead of once per tune. """
+    def __init__(self, settings, tempo_multiplier, soundfont_path):
+        self.settings = settings
+        self.tempo_multiplier = tempo_multiplier
+        self.soundfont_path = soundfont_path
+        self.synths = {}  # scratch_dir -> RenderSynth
+        self.lock = threading.Lock()
+
+    def get_synth(self, scratch_dir):
+        with self.lock:
+            synth = self.synths.get(scratch_dir)
+        if synth is None:
+            synth = RenderSynth(self.soundfont_path)
+            with self.lock:
+                self.synths[scratch_dir] = synth
+        return synth
+
+    def __call__(self, tune, filepath, scratch_dir):
+        abc_code = process_abc_for_midi(tune.abc, tune.header, scratch_dir, self.settings, self.tempo_multiplier)
+        midi_path = abc_to_midi(abc_code, self.settings, os.path.join(scratch_dir, 'temp.midi'), False)
+        if midi_path is None:
+            return False
+        try:
+            synth = self.get_synth(scratch_dir)
+            if os.path.splitext(filepath)[1].lower() == '.wav':
+                return synth.render_to_file(midi_path, filepath) > 0
+            success, messages = synth.render_to_ffmpeg(midi_path, self.settings.get('ffmpeg_path'), filepath)
+            if not success:
+                raise Exception(messages)
+            return True
+        finally:
+            if os.path.exists(midi_path):
+                os.remove(midi_path)
+
+    def estimate_cost(self, tune):
+        return estimate_tune_duration(tune)
+
+    def finish_worker(self, scratch_dir):
+        with self.lock:
+            synth = self.synths.pop(scratch_dir, None)
+        if synth is not None:
+            synth.delete()
+
+
+def estimate_tune_duration(tune):
+    """ A rough measure of how long a tune plays: the length of its music lines. Used to render the longest tunes first """
+    return sum(len(line) for line in tune.abc.splitlines() if not non_music_line_re.match(line))
+
+non_music_line_re = re.compile(r'^\s*($|%|[A-Za-z]:)')
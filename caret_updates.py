@@ -0,0 +1,97 @@
+import wx
+
+
+class CaretConsumer(object):
+    """ Work that has to be done when the caret moves, see CaretUpdateScheduler.add_consumer """
+    def __init__(self, name, callback, delay, debounce):
+        self.name = name
+        self.callback = callback
+        self.delay = delay
+        self.debounce = debounce
+        self.timer = None      # the wx.CallLater when a run is pending
+        self.last_state = None
+        self.runs = 0
+        self.coalesced = 0     # requests that were handled by an already pending run
+        self.unchanged = 0     # requests or runs that were skipped because the caret and the text did not change
+
+    @property
+    def is_pending(self):
+        return self.timer is not None
+
+
+class CaretUpdateScheduler(object):
+    """
+    Runs the work that follows the caret (selecting the tune, following the score, updating the assist panel)
+    without doing it for every EVT_STC_UPDATEUI. Holding down an arrow key or scrolling fires that event hundreds
+    of times, so request() only makes sure that each consumer runs once with the latest caret position:
+    - a pending run is never scheduled twice, a consumer with debounce waits until the caret has been still for
+      its delay, the others run at most once per delay
+    - when a consumer runs, the caret and the text are compared with its previous run, so work for a
+      position that was already handled is dropped
+
+    get_state() returns what the consumers depend on (the caret and the selection), text_changed() has to be
+    called for every modification of the text.
+    """
+    frame_delay = 16  # milliseconds
+
+    def __init__(self, get_state):
+        self.get_state = get_state
+        self.consumers = []
+        self.text_version = 0
+        self.requests = 0
+        self.max_queue_depth = 0
+
+    def add_consumer(self, name, callback, delay=frame_delay, debounce=False):
+        consumer = CaretConsumer(name, callback, delay, debounce)
+        self.consumers.append(consumer)
+        return consumer
+
+    def text_changed(self):
+        self.text_version += 1
+
+    @property
+    def queue_depth(self):
+        return sum(1 for consumer in self.consumers if consumer.is_pending)
+
+    def request(self):
+        self.requests += 1
+        state = (self.get_state(), self.text_version)
+        for consumer in self.consumers:
+            if consumer.is_pending:
+                consumer.coalesced += 1
+                if consumer.debounce:
+                    consumer.timer.Restart(consumer.delay)
+            elif state == consumer.last_state:
+                consumer.unchanged += 1
+            else:
+                consumer.timer = wx.CallLater(consumer.delay, self.run, consumer)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def run(self, consumer):
+        consumer.timer = None
+        state = (self.get_state(), self.text_version)
+        if state == consumer.last_state:
+            consumer.unchanged += 1  # the caret went back to where it was
+            return
+        consumer.last_state = state
+        consumer.runs += 1
+        consumer.callback()
+
+    def cancel(self):
+        """ drops all pending runs, for example when the window closes """
+        for consumer in self.consumers:
+            if consumer.timer is not None:
+                consumer.timer.Stop()
+                consumer.timer = None
+
+    def reset_statistics(self):
+        self.requests = 0
+        self.max_queue_depth = 0
+        for consumer in self.consumers:
+            consumer.runs = consumer.coalesced = consumer.unchanged = 0
+
+    def __str__(self):
+        lines = ['{0} caret updates requested, {1} pending, at most {2} pending'.format(self.requests, self.queue_depth, self.max_queue_depth)]
+        for consumer in self.consumers:
+            lines.append('{0}: {1} runs, {2} coalesced, {3} unchanged'.format(consumer.name, consumer.runs, consumer.coalesced, consumer.unchanged))
+        return '\n'.join(lines)
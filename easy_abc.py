@@ -40,7 +40,6 @@ if not PY3:
     print("   python3 easy_abc.py")
     exit()
 
-abcm2ps_default_encoding = 'utf-8'  ## 'latin-1'
 import codecs
 utf8_byte_order_mark = codecs.BOM_UTF8  # chr(0xef) + chr(0xbb) + chr(0xbf) #'\xef\xbb\xbf'
 
@@ -87,6 +86,7 @@ import time
 import traceback
 # import xml.etree.cElementTree as ET  # 1.3.7.4 [JWdJ] 2016-06-30
 import zipfile
+from array import array
 from datetime import datetime
 from collections import deque, namedtuple, defaultdict
 from io import StringIO
@@ -115,9 +115,13 @@ except ImportError:
 # An adaptation is done to integrate with EasyABC
 if wx.Platform == "__WXMAC__":
     from mplaysmfplayer import *
-    
+
 from xml2abc_interface import xml_to_abc, abc_to_xml
 from midi2abc import midi_to_abc, Note, duration2abc
+from tune_index import TuneIndex, tune_index_re
+from caret_updates import CaretUpdateScheduler
+from note_timeline import MidiNote, group_notes_by_time
+from midi_meta_data import scale_midi_tempo, midi_to_timeline_events, get_tempo_changes, ticks_to_milliseconds, TRACK_START, NOTE_ON, NOTE_OFF, SCORE_POSITION
 from generalmidi import general_midi_instruments
 from abc_styler import ABCStyler
 from abc_character_encoding import decode_abc, abc_text_to_unicode, get_encoding_abc
@@ -125,12 +129,15 @@ from abc_search import abc_matches_iter
 from fractions import Fraction
 from music_score_panel import MusicScorePanel
 from svgrenderer import SvgRenderer
-import itertools
+from export_pool import ExportPool, ExportJob
+from audio_export import AudioExporter
+from render_server import shutdown_render_servers
+from functools import partial
 from aligner import align_lines, extract_incipit, bar_sep, bar_sep_without_space, get_bar_length, bar_and_voice_overlay_sep
 if sys.version_info >= (3,0,0):
-    from queue import Queue # 1.3.6.2 [JWdJ] 2015-02
+    from queue import Queue, Empty # 1.3.6.2 [JWdJ] 2015-02
 else:
-    from Queue import Queue # 1.3.6.2 [JWdJ] 2015-02
+    from Queue import Queue, Empty # 1.3.6.2 [JWdJ] 2015-02
 
 application_running = True
 
@@ -165,12 +172,12 @@ def str2fraction(s):
     return Fraction(parts[0], parts[1])
 
 Tune = namedtuple('Tune', 'xnum title rythm offset_start offset_end abc header num_header_lines')
-MidiNote = namedtuple('MidiNote', 'start stop indices page svg_row')
 class AbortException(Exception): pass
-class Abcm2psException(Exception): pass
 class NWCConversionException(Exception): pass
 
 from abc_tune import *
+import abc_conversion
+from abc_conversion import *
 
 dialog_background_colour = wx.Colour(245, 244, 235)
 default_note_highlight_color = '#FF7F3F'
@@ -214,9 +221,6 @@ default_style_color = {
 }
 
 control_margin = 6
-default_midi_volume = 96
-default_midi_pan = 64
-default_midi_instrument = 0
 
 # 1.3.6.3 [JWdJ] 2015-04-22
 class MidiTune(object):
@@ -225,6 +229,22 @@ class MidiTune(object):
         self.error = error
         self.midi_file = midi_file
         self.abc_tune = abc_tune
+        self.note_timeline = None
+        self.note_timeline_key = None
+        self.cache_key = None
+
+    def change_tempo(self, tempo_multiplier, midi_file):
+        """ Returns a MidiTune for a copy of the midi file that plays tempo_multiplier times as fast """
+        scale_midi_tempo(self.midi_file, midi_file, tempo_multiplier)
+        midi_tune = MidiTune(self.abc_tune, midi_file)
+        if self.note_timeline:
+            svg_tune_id, unit_is_midi_tick = self.note_timeline_key
+            if unit_is_midi_tick:
+                midi_tune.note_timeline = self.note_timeline
+            else:
+                midi_tune.note_timeline = self.note_timeline.scaled(1.0 / tempo_multiplier)
+            midi_tune.note_timeline_key = self.note_timeline_key
+        return midi_tune
 
     def cleanup(self):
         if self.midi_file:
@@ -252,6 +272,19 @@ class SvgTune(object):
             page = renderer.empty_page
         return page
 
+    def parse_pages(self, renderer):
+        """ Parses all svg files into SvgPages without drawing them, so it can be done by a worker thread.
+            If a page can not be parsed it is left out, render_page will then try again and report the error. """
+        for page_index in range(self.page_count):
+            if page_index not in self.pages:
+                try:
+                    with open(self.svg_files[page_index], 'rb') as f:
+                        page = renderer.parse_page(f.read())
+                except Exception:
+                    continue
+                page.index = page_index
+                self.pages[page_index] = page
+
     def cleanup(self):
         for f in self.svg_files:
             if os.path.isfile(f):
@@ -293,30 +326,49 @@ class AbcTunes(object):
         self.__tunes = {}
         self.cache_size = cache_size
         self.cached_tune_ids = deque()
+        self.tune_in_use = None
 
     def get(self, tune_id):
         tune = self.__tunes.get(tune_id, None)
         return tune
 
-    def add(self, tune):
+    def add(self, tune, tune_id=None):
+        """ Adds a tune under tune_id (by default the id of its abc_tune). When the cache is full the least recently added tune
+            that is not in use is removed """
         if tune.abc_tune and self.cache_size > 0:
-            tune_id = tune.abc_tune.tune_id
-            #if tune_id in self.__tunes:
-            #    print 'tune already cached'
+            if tune_id is None:
+                tune_id = tune.abc_tune.tune_id
+            if tune_id in self.__tunes:
+                self.cached_tune_ids.remove(tune_id)
+                if self.__tunes[tune_id] is not tune:
+                    self.remove(tune_id)
             while len(self.cached_tune_ids) >= self.cache_size:
-                old_tune_id = self.cached_tune_ids.pop()
+                old_tune_id = self.cached_tune_ids.popleft()
+                if self.cache_size > 1 and self.__tunes[old_tune_id] is self.tune_in_use:
+                    self.cached_tune_ids.append(old_tune_id) # keep the tune in use, remove the next one instead
+                    continue
                 self.remove(old_tune_id)
             self.__tunes[tune_id] = tune
             self.cached_tune_ids.append(tune_id)
 
+    def set_in_use(self, tune):
+        """ The tune in use (like the tune that is playing) is not cleaned up when the cache removes it,
+            that is postponed until another tune is in use """
+        old_tune = self.tune_in_use
+        self.tune_in_use = tune
+        if old_tune is not None and old_tune is not tune and not any(t is old_tune for t in self.__tunes.values()):
+            old_tune.cleanup()
+
     def cleanup(self):
+        self.tune_in_use = None
         for tune_id in list(self.__tunes):
             self.remove(tune_id)
         self.__tunes = {}
+        self.cached_tune_ids.clear()
 
     def remove(self, tune_id):
         tune = self.__tunes[tune_id]
-        if tune is not None:
+        if tune is not None and tune is not self.tune_in_use:
             tune.cleanup()
         del self.__tunes[tune_id]
 
@@ -329,9 +381,17 @@ doremi_suffixes = 'oeiaoaioOEIAOAIOlLhH'
 
 execmessages = u''
 visible_abc_code = u''
+execmessages_lock = threading.Lock()
+
+def add_execmessage(text, clear=False):
+    global execmessages
+    with execmessages_lock:  # background threads (midi preparation, prerendering) report here too
+        if clear:
+            execmessages = text
+        else:
+            execmessages += text
 
-line_end_re = re.compile('\r\n|\r|\n')
-tune_index_re = re.compile(r'^X:\s*(\d+)')
+abc_conversion.message_listener = add_execmessage
 
 def note_to_index(abc_note):
     try:
@@ -339,22 +399,6 @@ def note_to_index(abc_note):
     except ValueError:
         return None
 
-def text_to_lines(text):
-    return line_end_re.split(text)
-
-def read_abc_file(path):
-    file_as_bytes = read_entire_file(path)
-    encoding = get_encoding_abc(file_as_bytes)
-    if encoding and encoding != 'utf-8':
-        try:
-            return file_as_bytes.decode(encoding)
-        except UnicodeError:
-            pass
-    try:
-        return file_as_bytes.decode('utf-8')
-    except UnicodeError:
-        return file_as_bytes.decode('latin-1')
-
 
 # 1.3.6.3 [JWDJ] one function to determine font size
 def get_normal_fontsize():
@@ -387,30 +431,6 @@ def start_process(cmd):
     execmessages += '\n'+stderr_value + stdout_value
     return
 
-
-def get_output_from_process(cmd, input=None, creationflags=None, cwd=None, bufsize=0, encoding='utf-8', errors='strict', output_encoding=None):
-    stdin_pipe = None
-    if input is not None:
-        stdin_pipe = subprocess.PIPE
-        if isinstance(input, basestring):
-            input = input.encode(encoding, errors)
-
-    if creationflags is None:
-        if wx.Platform == "__WXMSW__":
-            creationflags = win32process.CREATE_NO_WINDOW
-        else:
-            creationflags = 0
-
-    process = subprocess.Popen(cmd, stdin=stdin_pipe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creationflags, cwd=cwd, bufsize=bufsize)
-    stdout_value, stderr_value = process.communicate(input)
-    returncode = process.returncode
-
-    if output_encoding is None:
-        output_encoding = encoding
-    stdout_value, stderr_value = stdout_value.decode(output_encoding, errors), stderr_value.decode(output_encoding, errors)
-    return stdout_value, stderr_value, returncode
-
-
 def show_in_browser(url):
     handle = webbrowser.get()
     handle.open(url)
@@ -569,39 +589,6 @@ def copy_bar_symbols_from_first_voice(abc):
     abc = abc.replace('\n', os.linesep)
     return abc
 
-def process_MCM(abc):
-    """ Processes sticky rhythm feature of mcmusiceditor https://www.mcmusiceditor.com/download/sticky-rhythm.pdf
-    :param abc: abc possibly containing sticky rhythm
-    :return: abc-compliant
-    """
-    abc, n = re.subn(r'(?m)^(L:\s*mcm_default)', r'L:1/8', abc)
-    if n:
-        # erase non-note fragments of the text by replacing them by spaces (thereby preserving offsets)
-        repl_by_spaces = lambda m: ' ' * len(m.group(0))
-        s = abc.replace('\r', '\n')
-        s = re.sub(r'(?s)%%begin(ps|text).+?%%end(ps|text)', repl_by_spaces, s) # remove embedded text/postscript
-        s = re.sub(r'(?m)^\w:.*?$|%.*$', repl_by_spaces, s)                 # remove non-embedded fields and comments
-        s = re.sub(r'".*?"|!.+?!|\+\w+?\+|\[\w:.*?\]', repl_by_spaces, s)   # remove strings, ornaments and embedded fields
-
-        fragments = []
-        last_fragment_end = 0
-        for m in re.finditer(r"(?P<note>([_=^]?[A-Ga-gxz](,+|'+)?))(?P<len>\d{0,2})(?P<dot>\.?)", s):
-            if m.group('len') == '':
-                length = 0
-            else:
-                length = Fraction(8, int(m.group('len')))
-                if m.group('dot'):
-                    length = length * 3 / 2
-
-            start, end = m.start(0), m.end(0)
-            fragments.append((False, abc[last_fragment_end:start]))
-            fragments.append((True, m.group('note') + str(length)))
-            last_fragment_end = end
-        fragments.append((False, abc[last_fragment_end:]))
-        abc = ''.join((text for is_note, text in fragments))
-    return abc
-
-
 
 def get_hash_code(*args):
     hash = hashlib.md5()
@@ -615,38 +602,6 @@ def get_hash_code(*args):
             hash.update(program_name)
     return hash.hexdigest()[:10]
 
-def change_abc_tempo(abc_code, tempo_multiplier):
-    ''' multiples all Q: fields in the abc code by the given multiplier and returns the modified abc code '''
-
-    def subfunc(m, multiplier):
-        try:
-            if '=' in m.group(0):
-                parts = m.group(0).split('=')
-                parts[1] = str(int(int(parts[1])*multiplier))
-                return '='.join(parts)
-
-            q = int(int(m.group(1))*multiplier)
-            if '[' in m.group(0):
-                return '[Q: %d]' % q
-            else:
-                return 'Q: %d' % q
-        except:
-            return m.group(0)
-
-    abc_code, n1 = re.subn(r'(?m)^Q: *(.+)', lambda m, mul=tempo_multiplier: subfunc(m, mul), abc_code)
-    abc_code, _ = re.subn(r'\[Q: *(.+)\]', lambda m, mul=tempo_multiplier: subfunc(m, mul), abc_code)
-    # if no Q: field that is not inline add a new Q: field after the X: line
-    # (it seems to be ignored by abcmidi if added earlier in the code)
-    if n1 == 0:
-        default_tempo = 120
-        extra_line = 'Q:%d' % int(default_tempo * tempo_multiplier)
-        lines = text_to_lines(abc_code)
-        for i in range(len(lines)):
-            if lines[i].startswith('X:'):
-                lines.insert(i+1, extra_line)
-                break
-        abc_code = os.linesep.join(lines)
-    return abc_code
 
 def add_table_of_contents_to_postscript_file(filepath):
     def to_ps_string(s):  # handle unicode strings
@@ -734,99 +689,6 @@ def sort_abc_tunes(abc_code, sort_fields, keep_free_text=True):
         result.extend(L)
     return os.linesep.join(result)
 
-# 1.3.6 [SS] 2014-12-17
-def process_abc_code(settings, abc_code, header, minimal_processing=False, tempo_multiplier=None, landscape=False):
-    ''' adds file header and possibly some extra fields, and may also change the Q: field '''
-
-    #print traceback.extract_stack(None, 3)
-    extra_lines = \
-    '%%leftmargin 0.5cm\n' \
-    '%%rightmargin 0.5cm\n' \
-    '%%botmargin 0cm\n'  \
-    '%%topmargin 0cm\n'
-
-    if minimal_processing or settings['abcm2ps_clean']:
-        extra_lines = ''
-
-    if settings['abcm2ps_number_bars']:
-        extra_lines += '%%barnumbers 1\n'
-    if settings['abcm2ps_no_lyrics']:
-        extra_lines += '%%musiconly 1\n'
-    if settings['abcm2ps_refnumbers']:
-        extra_lines += '%%withxrefs 1\n'
-    if settings['abcm2ps_ignore_ends']:
-        extra_lines += '%%continueall 1\n'
-    if settings['abcm2ps_clean'] == False and settings['abcm2ps_defaults'] == False:
-        extra_lines += '%%leftmargin ' + settings['abcm2ps_leftmargin'] + 'cm \n'
-        extra_lines += '%%rightmargin ' + settings['abcm2ps_rightmargin'] + 'cm \n'
-        extra_lines += '%%topmargin ' + settings['abcm2ps_topmargin'] + 'cm \n'
-        extra_lines += '%%botmargin ' + settings['abcm2ps_botmargin'] + 'cm \n'
-        extra_lines += '%%pagewidth ' + settings['abcm2ps_pagewidth'] + 'cm \n'
-        extra_lines += '%%pageheight ' + settings['abcm2ps_pageheight'] + 'cm \n'
-
-        extra_lines += '%%scale ' + settings['abcm2ps_scale'] + ' \n'
-    parts = []
-    if landscape and not minimal_processing:
-        parts.append('%%landscape 1\n')
-    if header:
-        parts.append(header.rstrip() + os.linesep)
-    if extra_lines:
-        parts.append(extra_lines)
-    parts.append(abc_code)
-    abc_code = ''.join(parts)
-
-    abc_code = re.sub(r'\[\[(.*/)(.+?)\]\]', r'\2', abc_code)  # strip PmWiki links and just include the link text
-    if tempo_multiplier:
-        abc_code = change_abc_tempo(abc_code, tempo_multiplier)
-
-    abc_code = process_MCM(abc_code)
-
-    # 1.3.6.3 [JWdJ] 2015-04-22 fixing newlines to part of process_abc_code
-    abc_code = re.sub(r'\r\n|\r', '\n', abc_code)  ## TEST
-
-    return abc_code
-
-def AbcToPS(abc_code, cache_dir, extra_params='', abcm2ps_path=None, abcm2ps_format_path=None):
-    ''' converts from abc to postscript. Returns (ps_file, error_message) tuple, where ps_file is None if the creation was not successful '''
-    global execmessages
-    # hash_code = get_hash_code(abc_code, read_text_if_file_exists(abcm2ps_format_path))
-    ps_file = os.path.abspath(os.path.join(cache_dir, 'temp.ps'))
-
-    # determine parameters
-    cmd1 = [abcm2ps_path, '-', '-O', '%s' % ps_file]
-    if extra_params:
-        # split extra_params on spaces, but treat quoted strings as one element even if they contain spaces
-        cmd1 = cmd1 + [x or y for (x, y) in re.findall(r'"(.+?)"|(\S+)', extra_params)]
-    if abcm2ps_format_path and not '-F' in cmd1:
-        # strip .fmt file ending
-        if abcm2ps_format_path.lower().endswith('.fmt'):
-            abcm2ps_format_path = abcm2ps_format_path[:-4]
-        cmd1 = cmd1 + ['-F', abcm2ps_format_path]
-
-    if os.path.exists(ps_file):
-        os.remove(ps_file)
-
-    input_abc = abc_code + os.linesep * 2
-    stdout_value, stderr_value, returncode = get_output_from_process(cmd1, input=input_abc, encoding=abcm2ps_default_encoding)
-    stderr_value = os.linesep.join([x for x in stderr_value.split('\n')
-                                    if not x.startswith('abcm2ps-') and not x.startswith('File ') and not x.startswith('Output written on ')])
-    stderr_value = stderr_value.strip()
-    execmessages += '\nAbcToPs\n' + " ".join(cmd1) + '\n' + stdout_value + stderr_value
-    if not os.path.exists(ps_file):
-        ps_file = None
-    return (ps_file, stderr_value)
-
-def GetSvgFileList(first_page_file_path):
-    ''' given 'file001.svg' this function will return all existing files in the series, eg. ['file001.svg', 'file002.svg'] '''
-    result = []
-    for i in range(1, 1000):
-        fn = first_page_file_path.replace('001.svg', '%.3d.svg' % i)
-        if os.path.exists(fn):
-            result.append(fn)
-        else:
-            break
-    return result
-
 # 1.3.6 [SS] 2014-12-02 2014-12-07
 def AbcToSvg(abc_code, header, cache_dir, settings, target_file_name=None, with_annotations=True, minimal_processing=False, landscape=False, one_file_per_page=True):
     global visible_abc_code
@@ -836,82 +698,6 @@ def AbcToSvg(abc_code, header, cache_dir, settings, target_file_name=None, with_
     visible_abc_code = abc_code
     return abc_to_svg(abc_code, cache_dir, settings, target_file_name, with_annotations, one_file_per_page)
 
-# 1.3.6.3 [JWDJ] 2015-04-21 splitted AbcToSvg up into 2 functions (abc_to_svg does not do preprocessing)
-def abc_to_svg(abc_code, cache_dir, settings, target_file_name=None, with_annotations=True, one_file_per_page=True):
-    """ converts from abc to postscript. Returns (svg_files, error_message) tuple, where svg_files is an empty list if the creation was not successful """
-    global execmessages
-    # 1.3.6.3 [SS] 2015-05-01
-    global visible_abc_code
-    abcm2ps_path = settings.get('abcm2ps_path', '')
-    abcm2ps_format_path = settings.get('abcm2ps_format_path', '')
-    extra_params = settings.get('abcm2ps_extra_params', '')
-    # 1.3.6.3 [SS] 2015-05-01
-    visible_abc_code = abc_code
-
-    if target_file_name:
-        svg_file = target_file_name
-        svg_file_first = svg_file.replace('.svg', '001.svg')
-    else:
-        #grab svg file from cache if it exists
-        #svg_file = os.path.abspath(os.path.join(cache_dir, 'temp_%s.svg' % hash)) # 1.3.6 [SS] 2014-11-13
-        svg_file = os.path.abspath(os.path.join(cache_dir, 'temp.svg')) # 1.3.6 [SS] 2014-11-13
-        svg_file_first = svg_file.replace('.svg', '001.svg')
-
-        #if os.path.exists(svg_file_first):  p09 disable cache
-            #return (GetSvgFileList(svg_file_first), '')
-
-        # 1.3.6 [SS] 2014-11-16
-        # clear out all 001.svg, 002.svg and etc. so the old files
-        # do not appear accidently
-        files_to_be_deleted = GetSvgFileList(svg_file_first)
-        for f in files_to_be_deleted:
-            os.remove(f)
-
-    # determine parameters
-    cmd1 = [abcm2ps_path, '-', '-O', '%s' % os.path.basename(svg_file)]
-    if one_file_per_page:
-        cmd1 = cmd1 + ['-v']
-    else:
-        cmd1 = cmd1 + ['-g']
-
-    if with_annotations:
-        cmd1 = cmd1 + ['-A']
-
-
-    if extra_params:
-        # split extra_params on spaces, but treat quoted strings as one element even if they contain spaces
-        cmd1 = cmd1 + [x or y for (x, y) in re.findall(r'"(.+?)"|(\S+)', extra_params)]
-    if abcm2ps_format_path and not '-F' in cmd1:
-        # strip .fmt file ending
-        if abcm2ps_format_path.lower().endswith('.fmt'):
-            abcm2ps_format_path = abcm2ps_format_path[:-4]
-        cmd1 = cmd1 + ['-F', abcm2ps_format_path]
-
-
-    if os.path.exists(svg_file_first):
-        os.remove(svg_file_first)
-
-    #fse = sys.getfilesystemencoding()
-    #cmd1 = [arg.encode(fse) if isinstance(arg,unicode) else arg for arg in cmd1]
-
-    # clear execmessages any time the music panel is refreshed
-    execmessages = u'\nAbcToSvg\n' + " ".join(cmd1)
-    input_abc = abc_code + os.linesep * 2
-    stdout_value, stderr_value, returncode = get_output_from_process(cmd1, input=input_abc, encoding=abcm2ps_default_encoding, bufsize=-1, cwd=os.path.dirname(svg_file))
-    execmessages += '\n' + stdout_value + stderr_value
-
-    if returncode < 0:
-        execmessages += '\n' + _('%(program)s exited abnormally (errorcode %(error)#8x)') % {'program': 'Abcm2ps', 'error': returncode & 0xffffffff}
-        raise Abcm2psException('Unknown error - abcm2ps may have crashed')
-    stderr_value = os.linesep.join([x for x in stderr_value.splitlines()
-                                    if not x.startswith('abcm2ps-') and not x.startswith('File ') and not x.startswith('Output written on ')])
-    stderr_value = stderr_value.strip()
-    if os.path.exists(svg_file_first):
-        return (GetSvgFileList(svg_file_first), stderr_value)
-    else:
-        return ([], stderr_value)
-
-
 def AbcToAbc(abc_code, cache_dir, params, abc2abc_path=None):
     ' converts from abc to abc. Returns (abc_code, error_message) tuple, where abc_code is None if abc2abc was not successful'
     global execmessages
@@ -953,206 +739,25 @@ def MidiToMftext(midi2abc_path, midifile):
     else:
         wx.MessageBox(_("Cannot find the executable midi2abc. Be sure it is in your bin folder and its path is defined in ABC Setup/File Settings."), _("Error"), wx.ICON_ERROR | wx.OK)
 
-def get_midi_structure_as_text(midi2abc_path, midi_file):
-    result = u''
-    if os.path.exists(midi2abc_path):
-        cmd = [midi2abc_path, midi_file, '-mftext']
-        result, stderr_value, returncode = get_output_from_process(cmd, bufsize=-1)
-    return result
-
-# p09 2014-10-14 2014-12-17 2015-01-28 [SS]
-def AbcToPDF(settings, abc_code, header, cache_dir, extra_params='', abcm2ps_path=None, gs_path=None, abcm2ps_format_path=None, generate_toc=False):
-    global execmessages, visible_abc_code # 1.3.6.1 [SS] 2015-01-13
-    pdf_file = os.path.abspath(os.path.join(cache_dir, 'temp.pdf'))
-    # 1.3.6 [SS] 2014-12-17
-    abc_code = process_abc_code(settings, abc_code, header, minimal_processing=True)
-    (ps_file, error) = AbcToPS(abc_code, cache_dir, extra_params, abcm2ps_path, abcm2ps_format_path)
-    if not ps_file:
-        return None
-
-    #if generate_toc:
-    #    add_table_of_contents_to_postscript_file(ps_file)
-
-    gs_path = unicode(gs_path)
-
-    # convert ps to pdf
-    # p09 we already checked for gs_path in restore_settings() 2014-10-14
-    cmd2 = [gs_path, '-sDEVICE=pdfwrite', '-sOutputFile=%s' % pdf_file, '-dBATCH', '-dNOPAUSE', ps_file]
-    #FAU:PDF:Manage the case where one put ps2pdf from ghostscript instead of gs directly
-    if 'ps2pdf' in gs_path:
-        cmd2 = [gs_path, ps_file, pdf_file]
-    elif wx.Platform == "__WXMAC__" and int(platform.mac_ver()[0].split('.')[0]) <= 13 and gs_path == '/usr/bin/pstopdf':
-        cmd2 = [gs_path, ps_file, '-o', pdf_file]
-    if os.path.exists(pdf_file):
-        os.remove(pdf_file)
-
-    # 1.3.6.1 [SS] 2015-01-13
-    execmessages += '\nAbcToPDF\n' + " ".join(cmd2)
-    stdout_value, stderr_value, returncode = get_output_from_process(cmd2)
-    # 1.3.6.1 [SS] 2015-01-13
-    execmessages += '\n' + stderr_value
-    if os.path.exists(pdf_file):
-        return pdf_file
-
-# 1.3.6.4 [SS] 2015-07-10
-gchordpat = re.compile('\"[^\"]+\"')
-keypat = re.compile('([A-G]|[a-g]|)(#|b?)')
-def test_for_guitar_chords(abccode):
-    ''' The function returns False if there are no guitar chords
-        in the tune abccode; otherwise it returns True. It is
-        not sufficient to just find a token with enclosed by
-        double quotes. The token must begin with a letter between
-        A-G or a-g. We try up to 5 times in case, the token is
-        used to present other information above the staff.
-
-        The function is used to create a cleaner processed file
-        for MIDI by eliminating unnecessary %%MIDI commands.
-    '''
-    i = 0
-    k = 0
-    found = False
-    while k < 5:
-        m = gchordpat.search(abccode, i)
-        if m:
-            token = m.group(0)
-            i = m.end() + 1
-            if keypat.match(token[1:-1]):
-                found = True
-                break
-        else:
-            break
-        k = k + 1
-    return found
-
-
-# 1.3.6.4 [SS] 2015-07-03
-def list_voices_in(abccode):
-    ''' The function scans the entire abccode searching for V:
-        and extracts the voice identifier (assuming it is not
-        too long). A list of all the unique identifiers are
-        returned.
-    '''
-    voices = []
-    [voices.append(v) for v in [m.group('voice_id') or m.group('inline_voice_id') for m in voice_re.finditer(abccode)] if v not in voices]
-    return voices
-
-
-# 1.3.6.4 [SS] 2015-07-03
-def grab_time_signature(abccode):
-    ''' The function detects the first time signature M: n/m in
-        abccode and returns [n, m].
-    '''
-    fracpat = re.compile(r'(\d+)/(\d+)')
-    loc = abccode.find('M:')
-    meter = abccode[loc+2:loc+10]
-    meter = meter.lstrip()
-    if meter.find('C') >= 0:
-        return [4, 4]
-    m = fracpat.match(meter)
-    if m:
-        num = int(m.group(1))
-        den = int(m.group(2))
-    else:  #no M: in tune
-        num = 4
-        den = 4
-    return [num, den]
-
-
-# 1.3.6.4 [SS] 2015-07-03
-def drum_intro(timesig):
-    ''' Depending on the numerator of the time signature, the function
-        returns a MIDI drum command which produces a sequence of clicks.
-    '''
-    n = timesig[0]
-    if n == 2:
-        d = '%%MIDI drum dd 77 76'
-    elif n == 3:
-        # 1.3.6.4 [SS] 2015-09-06
-        d = '%%MIDI drum ddd 77 76 76'
-    elif n == 4:
-        d = '%%MIDI drum dddd 77 76 77 76 110 50 60 50'
-    elif n == 6:
-        d = '%%MIDI drum dddddd 77 76 76 77 76 76 110 50 50 60 50 50'
-    elif n == 9:
-        d = '%%MIDI drum ddddddddd 77 76 76 77 76 76 77 76 76 110 50 50 60 50 50 60 50 50'
-    else:
-        d = '%%MIDI drum d 77'
-    return d
-
-
-#1.3.6.4 [SS] 2015-07-05
-def need_left_repeat(abccode):
-    ''' Determine whether a left repeat |: is missing. If there
-        are no right repeats (either :| or ::) then we do not need
-        a left repeat. If a right repeat is found then we need
-        to find a left repeat that appears before the first right
-        repeat. Otherwise it is missing.
-     '''
-    loc1 = abccode.find(r':|')
-    loc2 = abccode.find(r'::')
-    if loc1 != -1 and loc2 != -1:
-        loc = min(loc1, loc2)
-    elif loc1 != -1:
-        loc = loc1
-    elif loc2 != -1:
-        loc = loc2
-    else:
-        # no right repeat found
-        return False
-
-    loc1 = abccode.find(r'|:')
-    if loc1 == -1:
-        # left repeat missing but right repeat found
-        return True
-    if loc1 < loc:
-        return False
-    # left repeat found after right repeat. (Left repeat
-    # missing for first repeat block.)
-    return True
-
-
-
-# 1.3.6.4 [SS] 2015-07-03
-def make_abc_introduction(abccode, voicelist):
-    ''' Given the music in abc notation, the function creates a sequence
-        of clicks which counts in the tune. The function needs to determine
-        the time signature and a list of all the voice names in the tune.
-        If there are no voices, the sequence is in inserted after the first K:;
-        otherwise, the sequence is inserted into the first voice and the
-        other voices are padded with silent measures. Frequently, the
-        left repeat symbol is omitted. We need to put a left repeat after
-        the clicking sequence so that clicking sequence is not repeated.
-    '''
-    intro = []
-    meter = grab_time_signature(abccode)
-
-    if voicelist:
-        intro.append("V: {0}".format(voicelist[0]))
-    intro.append(drum_intro(meter))
-    intro.append("%%MIDI drumon")
-    if need_left_repeat(abccode):
-        intro.append("Z|Z|:\\")
-    else:
-        intro.append("Z|Z|\\")
-    intro.append("%%MIDI drumoff")
-
-    if voicelist:
-        for v in voicelist[1:]:
-            intro.append("V: {0}".format(v))
-            if need_left_repeat(abccode):
-                intro.append("Z|Z|:\\")
-            else:
-                intro.append("Z|Z|\\")
-    return intro
-
 
 # 1.3.6  [SS] simplified the calling sequence 2014-11-15
-def AbcToMidi(abc_code, header, cache_dir, settings, statusbar, tempo_multiplier, midi_file_name=None, add_follow_score_markers=False):
+def AbcToMidi(abc_code, header, cache_dir, settings, statusbar, tempo_multiplier, midi_file_name=None, add_follow_score_markers=False, midi_tunes=None):
+    ''' when midi_tunes is given, a midi file that was created earlier for the same abc code and settings is reused
+        and a newly created one is added to midi_tunes '''
     global execmessages, visible_abc_code
 
     abc_code = process_abc_for_midi(abc_code, header, cache_dir, settings, tempo_multiplier)
     visible_abc_code = abc_code #p09 2014-10-22 [SS]
 
+    cache_key = None
+    if midi_tunes is not None and midi_file_name is None:
+        cache_key = get_midi_cache_key(abc_code, settings, tempo_multiplier, add_follow_score_markers)
+        midi_tune = midi_tunes.get(cache_key)
+        if midi_tune is not None and midi_tune.midi_file and os.path.isfile(midi_tune.midi_file):
+            midi_tunes.add(midi_tune, cache_key)
+            execmessages += '\n' + _('(taken from cache)')
+            return midi_tune
+
     abc_tune = AbcTune(abc_code)
     if midi_file_name is None:
         midi_file_name = os.path.abspath(os.path.join(cache_dir, 'temp%s.midi' % abc_tune.tune_id))
@@ -1173,305 +778,14 @@ def AbcToMidi(abc_code, header, cache_dir, settings, statusbar, tempo_multiplier
         statusbar.SetStatusText('')
 
     if midi_file:
-        return MidiTune(abc_tune, midi_file)
+        midi_tune = MidiTune(abc_tune, midi_file)
+        if cache_key is not None:
+            midi_tune.cache_key = cache_key
+            midi_tunes.add(midi_tune, cache_key)
+        return midi_tune
     else:
         return None
 
-# 1.3.6.3 [JWDJ] 2015-04-21 split up AbcToMidi into 2 functions: preprocessing (process_abc_for_midi) and actual midi generation (abc_to_midi)
-def process_abc_for_midi(abc_code, header, cache_dir, settings, tempo_multiplier):
-    ''' This function inserts extra lines in the abc tune controlling the assignment of musical instruments to the different voices
-        per the instructions in the ABC Settings/abc2midi and voices. If the tune already contains these instructions, eg. %%MIDI program,
-        %%MIDI chordprog, etc. then the function avoids changing these assignments by suppressing the output of the additional commands.
-        Note that these assignments can also be embedded in the body of the tune using the instruction [I: MIDI = program 10] for
-        examples see https://abcmidi.sourceforge.io/ and click link [I:MIDI=...].
-    '''
-    global execmessages
-    ####   set all the control flags which determine which %%MIDI commands are written
-
-    play_chords = settings.get('play_chords')
-    default_midi_program = settings.get('midi_program')
-    default_midi_chordprog = settings.get('midi_chord_program')
-    default_midi_bassprog = settings.get('midi_bass_program')
-    # 1.3.6.4 [SS] 2015-06-07
-    default_midi_melodyvol = settings.get('melodyvol')
-    default_midi_chordvol = settings.get('chordvol')
-    default_midi_bassvol = settings.get('bassvol')
-    # 1.3.6.3 [SS] 2015-05-04
-    default_tempo = settings.get('bpmtempo')
-    # build the list of midi program to be used for each voice
-    midi_program_ch_list = ['midi_program_ch%d' % ch for ch in range(1, 16 + 1)]
-
-    # this flag is added just in case none would have been set but shouldn't be the case.
-    if not default_midi_bassprog:
-        default_midi_bassprog = default_midi_chordprog
-
-    # verify if MIDI instructions are already present if yes, no extra command should be added
-
-    add_midi_program_extra_line = True
-    add_midi_volume_extra_line = True # 1.3.6.3 [JWDJ] 2015-04-21 added so that when abc contains instrument selection, the volume from the settings can still be used
-    add_midi_gchord_extra_line = True
-    add_midi_chordprog_extra_line = True
-    add_midi_introduction = settings.get('midi_intro')  # 1.3.6.4 [SS] 2015-07-05
-
-    if not test_for_guitar_chords(abc_code):
-        add_midi_chordprog_extra_line = False
-        add_midi_gchord_extra_line = False
-
-    # 1.3.6.3 [JWDJ] 2015-04-17 header was forgotten when checking for MIDI directives
-    abclines = text_to_lines(header + abc_code)
-    for line in abclines:
-        if line.startswith('%%MIDI program'):
-            add_midi_program_extra_line = False
-        elif line.startswith('%%MIDI control 7 '):
-            add_midi_volume_extra_line = False
-        elif line.startswith('%%MIDI gchord'):
-            add_midi_gchord_extra_line = False
-        elif line.startswith('%%MIDI chordprog') or line.startswith('%%MIDI bassprog'):
-            add_midi_chordprog_extra_line = False
-        if not (add_midi_program_extra_line or add_midi_volume_extra_line or add_midi_gchord_extra_line or add_midi_chordprog_extra_line):
-            break
-
-    #### create the abc_header which will be placed in front of the processed abc file
-    # extra_lines is a list of all the MIDI commands to be put in abcheader
-
-    #FAU: enforce at least one extra_lines to avoid to introduce a blank line
-    extra_lines = ['%']
-
-    # build default list of midi_program
-    # this is needed in case no instrument per voices where defined or in case option "separate defaults per voice" is not checked
-
-    midi_program_ch = []
-    for channel in range(16):
-        midi_program_ch.append([default_midi_program, default_midi_volume, default_midi_pan])
-
-    separate_defaults_per_voice = settings.get('separate_defaults_per_voice', False)
-    if separate_defaults_per_voice:
-        for channel in range(16):
-            program_vol_pan = settings.get(midi_program_ch_list[channel])
-            if program_vol_pan:
-                midi_program_ch[channel] = program_vol_pan
-
-    # Though these instructions shouldn't be needed (they are added for each voice afterwards),
-    # there is a problem with QuickTime on the Mac and these lines ensure that the MIDI file is
-    # played correctly.
-    if wx.Platform == "__WXMAC__":
-        for channel in range(16):
-            extra_lines.append('%%MIDI program {0} {1}'.format(channel+1, midi_program_ch[channel][0]))
-        extra_lines.append('%%MIDI program {0}'.format(default_midi_program)) # 1.3.6 [SS] 2014-11-16
-    if add_midi_volume_extra_line:
-        extra_lines.append('%%MIDI control 7 {0}'.format(midi_program_ch[0][1]))
-        extra_lines.append('%%MIDI control 10 {0}'.format(midi_program_ch[0][2]))
-
-    # add extra instruction to play guitar chords
-    if add_midi_gchord_extra_line:
-        if play_chords:
-            extra_lines.append('%%MIDI gchordon')
-            # 1.3.6 [SS] 2014-11-26
-            gchord = settings.get('gchord')
-            if gchord and gchord != 'default':
-                extra_lines.append('%%MIDI gchord '+ gchord)
-
-        else:
-            extra_lines.append('%%MIDI gchordoff')
-    # add extra instruction to define instrument for guitar chords and bass
-    # These lines should be added to only the voices that have guitar chords. However,
-    # unless we scan the voice in advance, we do not know whether it does have guitar
-    # chords. There is nothing wrong in including these commands in every voice since
-    # they will be ignored if nonapplicable; but it makes a rather messy processed for
-    # midi file which is harder to interpret.
-
-    # The extra_lines are added after X:1 in case the tune is not multivoice but
-    # has guitar chords embedded. If it is a multivoice tune or the tune does not
-    # have guitar chords, these lines are not necessary but do not do any harm.
-    #
-    # 1.3.6.4 [SS] 2015-06-29
-    if add_midi_program_extra_line:
-        extra_lines.append('%%MIDI program {0}'.format(default_midi_program))
-
-    if add_midi_chordprog_extra_line:
-        extra_lines.append('%%MIDI chordprog {0}'.format(default_midi_chordprog))
-        extra_lines.append('%%MIDI bassprog {0}'.format(default_midi_bassprog))
-        # 1.3.6.4 [SS] 2015-06-07
-        extra_lines.append('%%MIDI chordvol {0}'.format(default_midi_chordvol))
-        extra_lines.append('%%MIDI bassvol {0}'.format(default_midi_bassvol))
-
-    # 1.3.6.3 [SS] 2015-03-19
-    if int(settings.get('transposition', 0)) != 0:
-        extra_lines.append('%%MIDI transpose {0}'.format(settings['transposition']))
-
-    # 1.3.6.3 [SS] 2015-05-04
-    if default_tempo != 120:
-        extra_lines.append('Q:1/4 = %s' % default_tempo)
-
-    abcheader = os.linesep.join(extra_lines + [header.strip()])
-
-    # 1.3.6.4 [SS] 2015-07-07
-    voicelist = list_voices_in(abc_code)
-    # 1.3.6.4 [SS] 2015-07-03
-    if add_midi_introduction:
-        midi_introduction = make_abc_introduction(abc_code, voicelist)
-
-    ####  modify abc_code to add MIDI instruction just after voice definition
-    # (because using channel only in header doesn't seem to allow association with voice
-
-    abclines = text_to_lines(abc_code) # 1.3.6.3 [JWDJ] 2015-04-17 split abc_code without header
-
-    # 1.3.7.0 [SS] 2016-01-05
-    # always add %%MIDI control 7 so user can control volume of melody
-    #if add_midi_program_extra_line or add_midi_gchord_extra_line or add_midi_introduction:
-    if True:  # 1.3.7.0 [SS] 2016-01-05
-        list_voice = [] # keeps track of the voices we have already seen
-        new_abc_lines = [] # contains the new processed abc tune
-        voice = 0
-        header_finished = False
-        for line in abclines:
-            new_abc_lines.append(line)
-            # do not take into account the definition present in the header (maybe it would be better... to be further analysed)
-            if line.startswith('K:'):
-                if not header_finished:
-                    # 1.3.6.4 [SS] 2015-07-09
-                    if len(voicelist) == 0:
-                        new_abc_lines.append('%%MIDI control 7 {0}'.format(int(default_midi_melodyvol)))
-                    # 1.3.6.4 [SS] 2015-07-03
-                    if add_midi_introduction:
-                        new_abc_lines.extend(midi_introduction)
-                header_finished = True
-            if header_finished:
-                match = voice_re.match(line)
-                if match:
-                    inline_voice_id = match.group('inline_voice_id')
-                    voice_ID = inline_voice_id or match.group('voice_id')
-                    if voice_ID not in list_voice:
-                        # 1.3.6.4 [SS] 2015-07-08
-                        # if it is an inline voice, we are not want to include the following notes before
-                        # specifying the %%MIDI parameters
-                        if inline_voice_id:
-                            # remove last line in new_abc and put it back afterwards
-                            removedline = new_abc_lines.pop()
-                            new_abc_lines.append('V: {0}'.format(voice_ID))
-
-                        # 1.3.6.4 [SS] 2015-06-19
-                        # ideally you should determine whether gchords are present in this voice
-                        voice_has_gchords = True
-
-                        #as it's a new voice, add MIDI program instruction
-                        list_voice.append(voice_ID)
-                        if add_midi_program_extra_line:
-                            new_abc_lines.append('%%MIDI program {0}'.format(midi_program_ch[voice][0]))
-                        if add_midi_volume_extra_line:
-                            new_abc_lines.append('%%MIDI control 7 {0}'.format(midi_program_ch[voice][1]))
-                            new_abc_lines.append('%%MIDI control 10 {0}'.format(midi_program_ch[voice][2]))
-
-                        if voice_has_gchords:
-                            if add_midi_gchord_extra_line:
-                                if play_chords:
-                                    new_abc_lines.append('%%MIDI gchordon')
-                                else:
-                                    new_abc_lines.append('%%MIDI gchordoff')
-                            if add_midi_chordprog_extra_line:
-                                new_abc_lines.append('%%MIDI chordprog {0}'.format(default_midi_chordprog))
-                                new_abc_lines.append('%%MIDI bassprog {0}'.format(default_midi_bassprog))
-                                # 1.3.6.4 [SS] 2015-06-19
-                                new_abc_lines.append('%%MIDI chordvol {0}'.format(default_midi_chordvol))
-                                new_abc_lines.append('%%MIDI bassvol {0}'.format(default_midi_bassvol))
-                        if inline_voice_id:
-                            new_abc_lines.append(removedline)
-                        voice += 1
-                        if voice == 16:
-                            voice = 0
-
-        abc_code = os.linesep.join(new_abc_lines)
-
-    #### assemble everything together
-
-    # 1.3.6.4 [SS] 2014-07-07 replacement for process_abc_code
-    # we do not want any abcm2ps options added
-    sections = [abcheader.rstrip() + os.linesep, abc_code]
-    abc_code = ''.join(sections) # put it together
-    abc_code = re.sub(r'\[\[(.*/)(.+?)\]\]', r'\2', abc_code)  # strip PmWiki links and just include the link text
-    if tempo_multiplier:
-        abc_code = change_abc_tempo(abc_code, tempo_multiplier)
-    abc_code = process_MCM(abc_code)
-    # 1.3.6.3 [JWdJ] 2015-04-22 fixing newlines to part of process_abc_code
-    abc_code = re.sub(r'\r\n|\r', '\n', abc_code)  ## TEST
-    # 1.3.6 [SS] 2014-12-17
-    #abc_code = process_abc_code(settings,abc_code, abcheader, tempo_multiplier=tempo_multiplier, minimal_processing=True)
-
-    abc_code = abc_code.replace(r'\"', ' ')  # replace escaped " characters with space since abc2midi doesn't understand them
-
-    # make sure that X field is on the first line since abc2midi doesn't seem to support
-    # fields and instructions that come before the X field
-    if not abc_code.startswith('X:'):
-        abclines = text_to_lines(abc_code) # take it apart again
-        for i in range(len(abclines)):
-            if abclines[i].startswith('X:'):
-                line = abclines[i]
-                del abclines[i]
-                abclines.insert(0, line)
-                break
-        abc_code = os.linesep.join(abclines) # put it back together
-
-    #### for debugging
-    #Write temporary abc_file (for debug purpose)
-    #temp_abc_file =  os.path.abspath(os.path.join(cache_dir, 'temp_%s.abc' % hash)) 1.3.6 [SS] 2014-11-13
-    temp_abc_file = os.path.abspath(os.path.join(cache_dir, 'temp.abc')) # 1.3.6 [SS] 2014-11-13
-    f = codecs.open(temp_abc_file, 'wb', 'UTF-8') #p08 patch
-    f.write(abc_code)
-    f.close()
-
-    return abc_code
-
-
-
-# 1.3.6.3 [JWDJ] 2015-04-21 split up AbcToMidi into 2 functions: preprocessing (process_abc_for_midi) and actual midi generation (abc_to_midi)
-def abc_to_midi(abc_code, settings, midi_file_name, add_follow_score_markers):
-    global execmessages
-
-    abc2midi_path = settings.get('abc2midi_path')
-    cmd = [abc2midi_path, '-', '-o', midi_file_name]
-    cmd = add_abc2midi_options(cmd, settings, add_follow_score_markers)
-    execmessages += '\nAbcToMidi\n' + " ".join(cmd)
-    input_abc = abc_code + os.linesep * 2
-    stdout_value, stderr_value, returncode = get_output_from_process(cmd, input=input_abc)
-    execmessages += '\n' + stdout_value + stderr_value
-    if stdout_value:
-        stdout_value = re.sub(r'(?m)(writing MIDI file .*\r?\n?)', '', stdout_value)
-    if returncode != 0:
-        # 1.3.7.0 [SS] 2016-01-06
-        execmessages += '\n' + _('%(program)s exited abnormally (errorcode %(error)#8x)') % { 'program': 'AbcToMidi', 'error': returncode & 0xffffffff }
-        return None
-
-    return midi_file_name
-
-# 1.3.6 [SS] 2014-11-24
-def add_abc2midi_options(cmd, settings, add_follow_score_markers):
-    #Force BF option flag to be at the last position according to jwdj/EasyABC#86 and sshlien/abcmidi#8
-    #if str2bool(settings['barfly']):
-    #    cmd.append('-BF')
-    if str2bool(settings['nofermatas']):
-        cmd.append('-NFER')
-    if str2bool(settings['nograce']):
-        cmd.append('-NGRA')
-    if str2bool(settings['nodynamics']):
-        cmd.append('-NFNP')
-    # 1.3.6.3 [SS] 2015-03-20
-    if settings['tuning'] != '440':
-        cmd.append('-TT %s' % settings['tuning'])
-    # 1.3.6.4 [JWDJ] 2016-06-22
-    if add_follow_score_markers:
-        cmd.append('-EA')
-    if str2bool(settings['barfly']):
-        cmd.append('-BF')
-    return cmd
-
-
-# 1.3.6 [SS] 2014-11-24
-def str2bool(v):
-    ''' converts a string to a boolean if necessary'''
-    if type(v) == str:
-        return v.lower() in ('yes', 'true', 't', '1')
-    else:
-        return v
 
 def fix_boxmarks_texts(abc):
     ''' Some Noteworthy Composer files use a special font where some note decorations are input
@@ -1536,6 +850,16 @@ class RecordStopEvent(wx.PyCommandEvent):
     def GetValue(self):
         return self._value
 
+myRECORDPROGRESS = wx.NewEventType()
+EVT_RECORDPROGRESS = wx.PyEventBinder(myRECORDPROGRESS, 1)
+class RecordProgressEvent(wx.PyCommandEvent):
+    def __init__(self, eid, value=None):
+        wx.PyCommandEvent.__init__(self, myRECORDPROGRESS, eid)
+        self._value = value
+
+    def GetValue(self):
+        return self._value
+
 gmidi_in = []
 
 myMUSICUPDATEDONE = wx.NewEventType()
@@ -1635,19 +959,27 @@ class MusicUpdateDoneEvent(wx.PyCommandEvent):
 # 1.3.6 [SS] 2014-12-07 statusbar added
 # 1.3.6.2 [SS] 2015-03-02 statusbar removed
 class MusicUpdateThread(threading.Thread):
-    def __init__(self, notify_window, settings, cache_dir):
+    def __init__(self, notify_window, settings, cache_dir, renderer=None):
         threading.Thread.__init__(self)
         self.daemon = True # 1.3.6.3 [JWdJ] to make sure the thread does not prevent EasyABC from exiting
         self.queue = Queue(maxsize=0) # 1.3.6.2 [JWdJ]
         self.notify_window = notify_window
         self.settings = settings
         self.cache_dir = cache_dir
+        self.renderer = renderer # only used for parsing svg, drawing is done by the GUI thread
         self.want_abort = False # 1.3.6.2 [JWdJ]
+        self.__is_busy = False
+
+    def process_abc_code(self, abc_code, abc_header):
+        return process_abc_code(self.settings, abc_code, abc_header, minimal_processing=not self.settings.get('reduced_margins', True))
 
     # 1.3.6.2 [JWdJ] 2015-02 rewritten
     def run(self):
+        global visible_abc_code
         while not self.want_abort:
+            self.__is_busy = False
             task = self.queue.get()
+            self.__is_busy = True
             self.queue.task_done()
             abc_tune = None
             try:
@@ -1658,7 +990,8 @@ class MusicUpdateThread(threading.Thread):
                     raise Exception('K: field is missing')
                 else:
                     # 1.3.6.3 [JWDJ] splitted pre-processing abc and generating svg
-                    abc_code = process_abc_code(self.settings, abc_code, abc_header, minimal_processing=not self.settings.get('reduced_margins', True))
+                    abc_code = self.process_abc_code(abc_code, abc_header)
+                    visible_abc_code = abc_code
                     abc_tune = AbcTune(abc_code)
                     file_name = os.path.abspath(os.path.join(self.cache_dir, 'temp-%s-.svg' % abc_tune.tune_id))
                     # file_name = generate_temp_file_name(self.cache_dir, '-.svg', replace_ending='-001.svg')
@@ -1678,6 +1011,9 @@ class MusicUpdateThread(threading.Thread):
                 # print(error_msg)
                 pass
             svg_tune = SvgTune(abc_tune, svg_files, error)
+            if self.renderer is not None and svg_files:
+                # parsing large scores takes long, so do it here instead of in UpdateMusicPane
+                svg_tune.parse_pages(self.renderer)
             if application_running:
                 wx.PostEvent(self.notify_window, MusicUpdateDoneEvent(-1, svg_tune))
 
@@ -1696,6 +1032,180 @@ class MusicUpdateThread(threading.Thread):
     def abort(self):
         self.want_abort = True
 
+    @property
+    def is_busy(self):
+        return self.__is_busy or not self.queue.empty()
+
+
+class SvgPrerenderThread(threading.Thread):
+    """ Renders tunes the user is likely to view next into the svg cache while EasyABC is idle.
+        Only one job runs at a time and only while the MusicUpdateThread has nothing to do, so an
+        explicit request for the visible tune never has to wait for speculative work. """
+    def __init__(self, music_update_thread):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.music_update_thread = music_update_thread
+        self.settings = music_update_thread.settings
+        self.cache_dir = music_update_thread.cache_dir
+        self.condition = threading.Condition()
+        self.tasks = deque()
+        self.want_abort = False
+
+    def run(self):
+        while not self.want_abort:
+            with self.condition:
+                while not self.want_abort and (not self.tasks or self.music_update_thread.is_busy):
+                    self.condition.wait(0.2)
+                if self.want_abort:
+                    break
+                abc_code, abc_header = self.tasks.popleft()
+            try:
+                self.prerender(abc_code, abc_header)
+            except Exception:
+                pass  # a failing speculative render is not worth reporting, it is repeated when the tune is shown
+
+    def prerender(self, abc_code, abc_header):
+        if not abc_code or not 'K:' in abc_code:
+            return
+        render_cache = get_svg_render_cache(self.cache_dir, self.settings)
+        if render_cache is None:
+            return
+        abc_code = self.music_update_thread.process_abc_code(abc_code, abc_header)
+        if render_cache.contains(render_cache.get_svg_key(abc_code, self.settings)):
+            return
+        file_name = os.path.abspath(os.path.join(self.cache_dir, 'temp-prerender-.svg'))
+        svg_files, error = abc_to_svg(abc_code, self.cache_dir, self.settings, target_file_name=file_name, update_messages=False)
+        for f in svg_files:  # the render cache keeps its own copy
+            if os.path.isfile(f):
+                os.remove(f)
+
+    def set_tasks(self, tasks):
+        """ Replaces the pending speculative work. tasks is a list of (abc_code, abc_header), most likely first """
+        with self.condition:
+            self.tasks.clear()
+            self.tasks.extend(tasks)
+            self.condition.notify()
+
+    def clear(self):
+        self.set_tasks([])
+
+    def abort(self):
+        with self.condition:
+            self.want_abort = True
+            self.tasks.clear()
+            self.condition.notify()
+
+
+myMIDIPREPARED = wx.NewEventType()
+EVT_MIDI_PREPARED = wx.PyEventBinder(myMIDIPREPARED, 1)
+class MidiPreparedEvent(wx.PyCommandEvent):
+    def __init__(self, eid, value=None):
+        wx.PyCommandEvent.__init__(self, myMIDIPREPARED, eid)
+        self._value = value
+
+    def GetValue(self):
+        return self._value
+
+
+class MidiPrepareThread(threading.Thread):
+    """ Creates the midi file of the selected tune in the background, so pressing play only has to load it.
+        Only the newest request counts: a new request replaces a pending one and kills abc2midi if it is
+        still working on an older one. The finished MidiTune is posted as a MidiPreparedEvent, so the GUI
+        thread adds it to its midi cache. """
+    def __init__(self, notify_window, settings, cache_dir, midi_tunes):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.notify_window = notify_window
+        self.settings = settings
+        self.cache_dir = cache_dir
+        self.scratch_dir = os.path.join(cache_dir, 'midi_prepare')  # process_abc_for_midi writes temp.abc here
+        self.midi_tunes = midi_tunes  # only read by this thread
+        self.condition = threading.Condition()
+        self.task = None
+        self.generation = 0
+        self.process = None
+        self.want_abort = False
+
+    def run(self):
+        while not self.want_abort:
+            with self.condition:
+                while not self.want_abort and self.task is None:
+                    self.condition.wait()
+                if self.want_abort:
+                    break
+                generation, (abc_code, abc_header, add_follow_score_markers) = self.generation, self.task
+                self.task = None
+            try:
+                midi_tune = self.prepare(generation, abc_code, abc_header, add_follow_score_markers)
+            except Exception:
+                midi_tune = None  # the error is reported when the tune is played
+            if midi_tune is not None:
+                if generation == self.generation and application_running:
+                    wx.PostEvent(self.notify_window, MidiPreparedEvent(-1, midi_tune))
+                else:
+                    midi_tune.cleanup()
+
+    def prepare(self, generation, abc_code, abc_header, add_follow_score_markers):
+        if not abc_code or not 'K:' in abc_code:
+            return None
+        if not os.path.isdir(self.scratch_dir):
+            os.makedirs(self.scratch_dir)
+        abc_code = process_abc_for_midi(abc_code, abc_header, self.scratch_dir, self.settings, 1.0)
+        cache_key = get_midi_cache_key(abc_code, self.settings, 1.0, add_follow_score_markers)
+        midi_tune = self.midi_tunes.get(cache_key)
+        if midi_tune is not None and midi_tune.midi_file and os.path.isfile(midi_tune.midi_file):
+            return None
+        abc_tune = AbcTune(abc_code)
+        midi_file_name = os.path.abspath(os.path.join(self.cache_dir, 'temp%s-prepared.midi' % abc_tune.tune_id))
+        midi_file = abc_to_midi(abc_code, self.settings, midi_file_name, add_follow_score_markers,
+                                update_messages=False, process_started=lambda process: self.set_process(generation, process))
+        with self.condition:
+            self.process = None
+        if not midi_file or generation != self.generation:
+            if os.path.isfile(midi_file_name):
+                os.remove(midi_file_name)
+            return None
+        midi_tune = MidiTune(abc_tune, midi_file)
+        midi_tune.cache_key = cache_key
+        return midi_tune
+
+    def set_process(self, generation, process):
+        with self.condition:
+            self.process = process
+            if generation != self.generation:
+                self.kill_process()
+
+    def kill_process(self):
+        """ Should be called with self.condition acquired """
+        if self.process is not None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+            self.process = None
+
+    def prepare_midi(self, abc_code, abc_header, add_follow_score_markers):
+        with self.condition:
+            self.generation += 1
+            self.kill_process()
+            self.task = (abc_code, abc_header, add_follow_score_markers)
+            self.condition.notify()
+
+    def cancel(self):
+        """ Forgets the pending request and stops the one that is running """
+        with self.condition:
+            self.generation += 1
+            self.kill_process()
+            self.task = None
+
+    def abort(self):
+        with self.condition:
+            self.want_abort = True
+            self.generation += 1
+            self.kill_process()
+            self.task = None
+            self.condition.notify()
+
 
 # p09 new class for playing midi files if self.mc is not working 2014-10-14
 # 1.3.6.3 [JWdJ] midithread extended so it works the same as the svg-thread
@@ -1765,6 +1275,16 @@ class MidiThread(threading.Thread):
 
 
 class RecordThread(threading.Thread):
+    """ Records the notes played on a midi input device while a metronome ticks.
+
+        PortMidi stamps every incoming message with the time it arrived, so the thread only has to look for new
+        messages every few milliseconds instead of polling continuously. The raw messages are kept in a
+        preallocated array, from which process_events makes the notes and quantizes them while recording, so a
+        preview of what has been played can be shown (RecordProgressEvent) and stopping does not have to
+        quantize everything at once. """
+    poll_interval = 0.002  # seconds
+    event_size = 4         # time (ms), status, data1, data2
+
     def __init__(self, notify_window, midi_in_device_ID, midi_out_device_ID=None, metre_1=3, metre_2=4, bpm=70):
         global gmidi_in
         threading.Thread.__init__(self)
@@ -1780,17 +1300,20 @@ class RecordThread(threading.Thread):
             self.midi_out = pypm.Output(midi_out_device_ID, 0)
         gmidi_in.append(self.midi_in)
         gmidi_in.append(self.midi_out)
-        self.notes = []
+        self.events = array('l', [0]) * (self.event_size * 4096)  # grows when more events are recorded
+        self.event_count = 0
+        self.processed_event_count = 0  # the events before this one have been turned into notes
+        self.noteon_time = {}      # midi_note -> time (ms) of a note on without a note off yet
+        self.notes = []            # [midi_note, start, end] that are not quantized yet, times are in beats
+        self.quantized_notes = []  # (midi_note, start, end)
+        self.beat_offset = None
         self.is_running = False
         self.tick1 = wx_sound(os.path.join(cwd, 'sound', 'tick1.wav'))
         self.tick2 = wx_sound(os.path.join(cwd, 'sound', 'tick2.wav'))
 
-    def timedelta_microseconds(self, td):
-        return td.seconds*1000000 + td.microseconds
-
     @property
     def beat_duration(self):
-        return 1000000 * 60 / self.bpm  # unit is microseconds
+        return 1000.0 * 60 / self.bpm  # unit is milliseconds
 
     @property
     def midi_in_poll(self):
@@ -1799,58 +1322,90 @@ class RecordThread(threading.Thread):
         else:
             return self.midi_in.Poll()
 
+    def midi_time(self):
+        """ The PortMidi clock in milliseconds, the same clock that timestamps the incoming messages """
+        if wx.Platform == "__WXMAC__":
+            return pypm.time()
+        else:
+            return pypm.Time()
+
+    def read_midi_in(self):
+        if wx.Platform == "__WXMAC__":
+            return self.midi_in.read(64)
+        else:
+            return self.midi_in.Read(64)
+
+    def write_midi_out(self, data):
+        if wx.Platform == "__WXMAC__":
+            self.midi_out.write(data)
+        else:
+            self.midi_out.Write(data)
+
     def number_to_note(self, number):
         notes = ['c', 'c#', 'd', 'd#', 'e', 'f', 'f#', 'g', 'g#', 'a', 'a#', 'b']
         return notes[number%12]
 
+    def store_event(self, time_offset, status, data1, data2):
+        pos = self.event_count * self.event_size
+        if pos + self.event_size > len(self.events):
+            self.events.extend(array('l', [0]) * len(self.events))
+        events = self.events
+        events[pos] = time_offset
+        events[pos+1] = status
+        events[pos+2] = data1
+        events[pos+3] = data2
+        self.event_count += 1
+
+    def process_events(self):
+        """ Turns the stored events that have not been processed yet into notes. Returns True if notes were added """
+        NOTE_ON = 0x09
+        NOTE_OFF = 0x08
+        events = self.events
+        event_size = self.event_size
+        noteon_time = self.noteon_time
+        beat_duration = self.beat_duration
+        notes_added = False
+        for pos in xrange(self.processed_event_count * event_size, self.event_count * event_size, event_size):
+            time_offset, status, midi_note, midi_note_velocity = events[pos:pos+event_size]
+            cmd = status >> 4
+            if cmd == NOTE_ON and midi_note_velocity > 0:
+                noteon_time[midi_note] = time_offset
+            elif (cmd == NOTE_ON or cmd == NOTE_OFF) and midi_note in noteon_time:
+                start = noteon_time.pop(midi_note) / beat_duration
+                end = time_offset / beat_duration
+                self.add_note(midi_note, start, end)
+                notes_added = True
+        self.processed_event_count = self.event_count
+        return notes_added
 
     def run(self):
         self.is_running = True
-        NOTE_ON = 0x09
-        NOTE_OFF = 0x08
         i = 0
-        noteon_time = {}
-        start_time = datetime.now()
-        last_tick = datetime.now()
-        wx.CallAfter(self.tick1.Play)
-        time.sleep(0.002)
+        beat_duration = self.beat_duration
+        start_time = self.midi_time()
         try:
             while not self._want_abort:
-                while not self.midi_in_poll and not self._want_abort:
-                    time.sleep(0.00025)
-                    if self.timedelta_microseconds(datetime.now() - start_time) / self.beat_duration > i:
-                        last_tick = datetime.now()
-                        if i % self.metre_1 == 0:
-                            wx.CallAfter(self.tick1.Play)
-                        else:
-                            wx.CallAfter(self.tick2.Play)
-                        i += 1 #FAU: 20210102: One tick was missing the first time so incrementing i after the tick
-
-                time_offset = self.timedelta_microseconds(datetime.now() - start_time)
-                if self.midi_in_poll:
-                    if wx.Platform == "__WXMAC__":
-                        data = self.midi_in.read(1)
+                now = self.midi_time() - start_time
+                next_tick = i * beat_duration
+                if now >= next_tick:
+                    if i % self.metre_1 == 0:
+                        wx.CallAfter(self.tick1.Play)
                     else:
-                        data = self.midi_in.Read(1) # read only 1 message at a time
-                    if self.midi_out is not None:
-                        if wx.Platform == "__WXMAC__":
-                            self.midi_out.write(data)
-                        else:
-                            self.midi_out.Write(data)
-                    cmd = data[0][0][0] >> 4
-                    midi_note = data[0][0][1]
-                    midi_note_velocity = data[0][0][2]
-                    #print(self.number_to_note(midi_note), midi_note_velocity)
-                    if cmd == NOTE_ON and midi_note_velocity > 0:
-                        noteon_time[midi_note] = time_offset
-                        #print('note-on', midi_note, float(time_offset)/self.beat_duration)
-                    elif (cmd == NOTE_OFF or midi_note_velocity ==0) and midi_note in noteon_time:
-                        start = float(noteon_time[midi_note]) / self.beat_duration
-                        end = float(time_offset) / self.beat_duration
-                        self.notes.append([midi_note, start, end])
-                        #print('note-off', midi_note, float(time_offset)/self.beat_duration)
+                        wx.CallAfter(self.tick2.Play)
+                    i += 1
+                    next_tick = i * beat_duration
 
+                if not self.midi_in_poll:
+                    time.sleep(min(self.poll_interval, max(0.0, (next_tick - now) / 1000.0)))
+                    continue
 
+                data = self.read_midi_in()
+                if self.midi_out is not None:
+                    self.write_midi_out(data)
+                for (status, midi_note, midi_note_velocity, data3), timestamp in data:
+                    self.store_event(timestamp - start_time, status, midi_note, midi_note_velocity)
+                if self.process_events() and application_running:
+                    wx.PostEvent(self._notify_window, RecordProgressEvent(-1, self.get_preview_notes()))
         finally:
             if wx.Platform == "__WXMAC__":
                 self.midi_in.close()
@@ -1895,30 +1450,44 @@ class RecordThread(threading.Thread):
                 return True
         return False
 
-    def quantize(self):
-        quantized_notes = []
-
-        if self.notes:
-            distance_from_beat = frac_mod(self.notes[0][1], 1.0)
+    def add_note(self, midi_note, start, end):
+        """ Adds a played note (times in beats) and quantizes the notes that can no longer be part of a triplet """
+        if self.beat_offset is None:
+            # the first note determines how far the player is ahead or behind the metronome
+            distance_from_beat = frac_mod(start, 1.0)
             if distance_from_beat > 0.5:
                 distance_from_beat = -(1.0 - distance_from_beat)
-            for note in self.notes:
-                note[1] -= distance_from_beat/2
-
-        for n1, n2 in zip(self.notes[0:-1], self.notes[1:]):
-            n1[2] = n2[1]  # end of first is set to start of next note
-
-        while self.notes:
-            if self.quantize_triplet(self.notes):
-                quantized_notes.extend(self.notes[:3])
-                self.notes = self.notes[3:]
+            self.beat_offset = distance_from_beat / 2
+        start -= self.beat_offset
+        if self.notes:
+            self.notes[-1][2] = start  # end of previous note is set to start of this note
+        self.notes.append([midi_note, start, end])
+        self.quantize_pending_notes()
+
+    def quantize_pending_notes(self, all_notes=False):
+        # quantize_triplet looks at the next 4 notes, so a note is final once 3 more notes have been played
+        notes = self.notes
+        while len(notes) >= 4 or (all_notes and notes):
+            if self.quantize_triplet(notes):
+                self.quantized_notes.extend(notes[:3])
+                del notes[:3]
             else:
-                note, start, end = self.notes.pop(0)
+                note, start, end = notes.pop(0)
                 start = self.quantize_swinged_16th(start)
-                quantized_notes.append((note, start, end))
+                self.quantized_notes.append((note, start, end))
+
+    def get_preview_notes(self):
+        """ The notes played so far, the ones that are not final yet are quantized to 16ths """
+        preview = [Note(start, end, note) for (note, start, end) in self.quantized_notes]
+        for note, start, end in self.notes:
+            start = self.quantize_swinged_16th(start)
+            preview.append(Note(start, max(end, start + 0.25), note))
+        return preview
 
-        for n1, n2 in zip(self.notes[0:-1], self.notes[1:]):
-            n1[2] = n2[1]  # end of first is set to start of next note
+    def quantize(self):
+        self.quantize_pending_notes(all_notes=True)
+        quantized_notes = self.quantized_notes
+        self.quantized_notes = []
 
         # quantize the end of the last note so that it ends at an even bar
         if quantized_notes:
@@ -3203,7 +2772,7 @@ class ColorSettingsFrame(wx.Panel):
         self.note_highlight_follow_color_picker = wx.ColourPickerCtrl(self, wx.ID_ANY, colour=wx.Colour(note_highlight_follow_color))
 
         grid_sizer.Add(notecolors,pos=(0,0),span=(1,10), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=border)
-        
+
         grid_sizer.Add(note_highlight_color_label, pos=(1,1), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=border)
         grid_sizer.Add(self.note_highlight_color_picker, pos=(1,2), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=border)
         grid_sizer.Add(note_highlight_follow_color_label, pos=(1,4), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=border)
@@ -3234,7 +2803,7 @@ class ColorSettingsFrame(wx.Panel):
             'style_ornamentexcl_color':_("Color of ornament excl"),
             'style_grace_color':_("Color of grace notes")
         }
-        
+
         grid_sizer.Add(editorcolors,pos=(3,0),span=(1,10), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=border)
         i=4
         j=1
@@ -3251,11 +2820,11 @@ class ColorSettingsFrame(wx.Panel):
                 j=1
             else:
                 j+=3
-        
+
         self.restore_color = wx.Button(self, wx.ID_ANY, _('Restore default colors'))
         check_toolTip = _('Restore default colors')
         self.restore_color.SetToolTip(wx.ToolTip(check_toolTip))
-        
+
         grid_sizer.Add(self.restore_color, pos=(i+1,7), flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=border)
         self.restore_color.Bind(wx.EVT_BUTTON, self.OnRestoreDefaultColors, self.restore_color)
 
@@ -3289,7 +2858,7 @@ class ColorSettingsFrame(wx.Panel):
         color = wxcolor.GetAsString(flags=wx.C2S_HTML_SYNTAX)
         self.settings[settings_key] = color
         self.UpdateEditor()
-        
+
     def OnRestoreDefaultColors(self, evt):
         self.settings['note_highlight_color'] = default_note_highlight_color
         self.note_highlight_color_picker.SetColour(default_note_highlight_color)
@@ -3418,7 +2987,7 @@ class MusicXmlPage(wx.Panel):
         grid_sizer.Add(grid_sizer_abc2xml, pos=(1,0), flag=wx.ALL | wx.ALIGN_TOP, border=border)
         grid_sizer.Add(50, 40, pos=(1,1))
         grid_sizer.Add(grid_sizer_xml2abc, pos=(1,2), flag=wx.ALL | wx.ALIGN_TOP, border=border)
-        
+
         self.SetSizer(grid_sizer)
         self.SetAutoLayout(True)
         self.Fit()
@@ -4037,7 +3606,7 @@ class MainFrame(wx.Frame):
         self.current_svg_tune = None # 1.3.6.2 [JWdJ] 2015-02
         self.svg_tunes = AbcTunes()
         self.current_midi_tune = None # 1.3.6.3 [JWdJ] 2015-03
-        self.midi_tunes = AbcTunes()
+        self.midi_tunes = AbcTunes(cache_size=10)
         self.__current_page_index = 0 # 1.3.6.2 [JWdJ] 2015-02
         self.applied_tempo_multiplier = 1.0 # 1.3.6.4 [JWdJ] 2015-05
         self.is_closed = False
@@ -4060,7 +3629,6 @@ class MainFrame(wx.Frame):
         self.last_line_number_selected = -1
         self.queue_number_refresh_music = 0
         self.queue_number_follow_score = 0
-        self.queue_number_movement = 0
         self.field_reference_frame = None
         self.find_data = wx.FindReplaceData()
         self.find_dialog = None
@@ -4107,7 +3675,7 @@ class MainFrame(wx.Frame):
             except Exception as e:
                 error_msg = traceback.format_exc()
                 self.mc = None
-                
+
         #FAU:MIDIPLAY: on Mac add the ability to interface to System Midi Synth via mplay in case fluidsynth not available or not configured with soundfont
         if wx.Platform == "__WXMAC__" and self.mc is None:
             try:
@@ -4218,6 +3786,11 @@ class MainFrame(wx.Frame):
 
         self.index = 1
         self.tunes = []
+        self.tune_index = TuneIndex(self.editor.GetLine, self.editor.GetLineCount)
+        self.caret_updates = CaretUpdateScheduler(self.get_caret_state)
+        self.caret_updates.add_consumer('score', self.follow_caret_in_music_pane)
+        self.caret_updates.add_consumer('tune', self.OnMovedToDifferentLine, delay=260, debounce=True)
+        self.caret_updates.add_consumer('assist', self.update_assist_if_shown, delay=260, debounce=True)
         self.timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
         self.timer.Start(2000, wx.TIMER_CONTINUOUS)
@@ -4244,14 +3817,21 @@ class MainFrame(wx.Frame):
         self.restore_settings()
 
         self.update_controls_using_settings()
+        self.music_pane.tile_cache.max_bytes = self.settings['score_tile_cache_size_mb'] * 1024 * 1024
 
-        self.music_update_thread = MusicUpdateThread(self, self.settings, self.cache_dir)
+        self.music_update_thread = MusicUpdateThread(self, self.settings, self.cache_dir, self.renderer)
+        self.prerender_thread = SvgPrerenderThread(self.music_update_thread)
+        self.last_prerender_request = None
+        self.idle_queue_number_refresh_music = None
+        self.midi_prepare_thread = MidiPrepareThread(self, self.settings, self.cache_dir, self.midi_tunes)
 
         self.tune_list.Bind(wx.EVT_LIST_ITEM_RIGHT_CLICK, self.OnRightClickList, self.tune_list)
 
         self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.Bind(EVT_RECORDSTOP, self.OnRecordStop)
+        self.Bind(EVT_RECORDPROGRESS, self.OnRecordProgress)
         self.Bind(EVT_MUSIC_UPDATE_DONE, self.OnMusicUpdateDone)
+        self.Bind(EVT_MIDI_PREPARED, self.OnMidiPrepared)
         self.editor.Bind(wx.EVT_KEY_DOWN, self.OnUpdate)
         self.music_pane.Bind(wx.EVT_KEY_DOWN, self.OnUpdate)
         self.tune_list.Bind(wx.EVT_KEY_DOWN, self.OnUpdate)
@@ -4264,6 +3844,8 @@ class MainFrame(wx.Frame):
         self.Bind(wx.EVT_TIMER, self.OnPlayTimer, self.play_timer)
         self.play_timer.Start(50)
         self.music_update_thread.start()
+        self.prerender_thread.start()
+        self.midi_prepare_thread.start()
         self.update_multi_tunes_menu_items()
 
         self.editor.SetFocus()
@@ -4667,7 +4249,7 @@ class MainFrame(wx.Frame):
         self.UpdateTimingSliderVisibility()
         if enabled:
             if self.played_notes_timeline is None and self.current_midi_tune and self.current_svg_tune:
-                self.played_notes_timeline = self.extract_note_timings(self.current_midi_tune, self.current_svg_tune)
+                self.played_notes_timeline = self.get_note_timeline(self.current_midi_tune, self.current_svg_tune)
         else:
             self.music_pane.draw_notes_highlighted(None)
 
@@ -4799,7 +4381,7 @@ class MainFrame(wx.Frame):
         if not self.is_closed:
             if self.mc.is_playing:
                 self.started_playing = True
-                
+
                 if wx.Platform == "__WXMAC__": #FAU:MIDIPLAY: Used to give the hand to MIDI player
                     delta = self.mc.IdlePlay()
                     #print(self.mc.get_songinfo)
@@ -4808,18 +4390,18 @@ class MainFrame(wx.Frame):
                             self.mc.Seek(0)
                         else:
                             self.mc.is_play_started = False
-                
+
                 offset = self.mc.Tell()
                 if offset >= self.progress_slider.Max:
                     length = self.mc.Length()
                     self.progress_slider.SetRange(0, int(length)) #FAU:MIDIPLAY: mplay might return a float. thus forcing an int
-                
+
                 if self.settings.get('follow_score', False):
                     self.queue_number_follow_score += 1
                     queue_number = self.queue_number_follow_score
                     #wx.CallLater(1, self.FollowScore, offset, queue_number) #[EPO] 2018-11-20  first arg 0 causes exception
                     self.FollowScore(offset, queue_number)
-                
+
                 self.progress_slider.SetValue(offset)
             elif self.started_playing and not self.mc.is_paused: #and self.uses_fluidsynth 
                 self.started_playing = False
@@ -4838,17 +4420,14 @@ class MainFrame(wx.Frame):
 
         offset += self.settings.get('follow_score_timing_offset', 0)
 
+        timeline = self.played_notes_timeline
         current_time_slice = self.current_time_slice
         if current_time_slice and current_time_slice.start <= offset < current_time_slice.stop:
             return
 
-        if current_time_slice is None or offset < current_time_slice.start:  # first time or after rewind
-            self.played_notes_iter = iter(self.played_notes_timeline)
-
-        for time_slice in self.played_notes_iter:
-            if time_slice.start <= offset < time_slice.stop:
-                current_time_slice = time_slice
-                break
+        current_time_slice = timeline.slice_at(offset)
+        if current_time_slice is None:
+            return
 
         self.current_time_slice = current_time_slice
         if current_time_slice.page == self.current_page_index:
@@ -4866,15 +4445,7 @@ class MainFrame(wx.Frame):
         future_time_slice = self.future_time_slice
 
         if future_time_slice is None or not (future_time_slice.start <= future_offset < future_time_slice.stop):
-            if future_time_slice is None or future_offset < future_time_slice.start:
-                self.future_notes_iter = iter(self.played_notes_timeline)
-
-            future_time_slice = None
-            for time_slice in self.future_notes_iter:
-                if time_slice.start <= future_offset < time_slice.stop:
-                    future_time_slice = time_slice
-                    break
-
+            future_time_slice = timeline.slice_at(future_offset)
             self.future_time_slice = future_time_slice
 
         if future_time_slice is not None:
@@ -5075,9 +4646,22 @@ class MainFrame(wx.Frame):
 
     def OnRecordStop(self, evt):
         notes = evt.GetValue()
+        self.OnTuneSelected(None)  # replace the preview of the recording by the selected tune
         if notes:
             return self.handle_midi_conversion(notes=notes)
 
+    def OnRecordProgress(self, evt):
+        # shows the notes recorded so far in the music pane
+        notes = evt.GetValue()
+        if not notes or not (self.record_thread and self.record_thread.is_running):
+            return
+        metre1, metre2 = [int(x) for x in self.settings['record_metre'].split('/')]
+        try:
+            abc = midi_to_abc(notes=notes, metre=Fraction(metre1, metre2), default_len=Fraction(1, 8), title=_('Recording'))
+        except Exception:
+            return
+        self.music_update_thread.ConvertAbcToSvg(abc, '')
+
     def OnDoReMiModeChange(self, evt=None):
         if self.mni_TA_do_re_mi.IsChecked():
             self.SetStatusText(_("&Do-re-mi mode").replace('&', ''))
@@ -5331,7 +4915,8 @@ class MainFrame(wx.Frame):
 
     #Add an export all tunes to MIDI option
     def OnExportAllMidi(self, evt):
-        self.export_tunes(_('Midi file'), '.mid', self.export_midi, only_selected=False)
+        batch_convert_func = partial(export_tune_to_midi, dict(self.settings), self.get_tempo_multiplier())
+        self.export_tunes(_('Midi file'), '.mid', self.export_midi, only_selected=False, batch_convert_func=batch_convert_func)
 
     def export_midi(self, tune, filepath):
         tempo_multiplier = self.get_tempo_multiplier()
@@ -5348,22 +4933,33 @@ class MainFrame(wx.Frame):
         return False
 
     def OnExportToMP3(self, evt):
-        if self.uses_fluidsynth:
-            self.export_tunes(_('MP3 file'), '.mp3', self.export_mp3, only_selected=True)
-        else:
-            self.ReportFluidSynthIsMissing()
+        self.export_audio_tunes(_('MP3 file'), '.mp3', self.export_mp3)
 
     def OnExportToAAC(self, evt):
-        if self.uses_fluidsynth:
-            self.export_tunes(_('AAC file'), '.m4a', self.export_aac, only_selected=True)
-        else:
-            self.ReportFluidSynthIsMissing()
+        self.export_audio_tunes(_('AAC file'), '.m4a', self.export_aac)
 
     def OnExportToWave(self, evt):
-        if self.uses_fluidsynth:
-            self.export_tunes(_('Wave file'), '.wav', self.export_wave, only_selected=True)
-        else:
+        self.export_audio_tunes(_('Wave file'), '.wav', self.export_wave)
+
+    def export_audio_tunes(self, file_type, extension, convert_func):
+        ''' when many tunes are selected they are rendered concurrently, every worker loads the soundfont once in its own synthesizer '''
+        if not self.uses_fluidsynth:
             self.ReportFluidSynthIsMissing()
+            return
+        if extension != '.wav' and not self.ffmpeg_is_available():
+            self.ReportFfmpegIsMissing()
+            return
+        batch_convert_func = AudioExporter(dict(self.settings), self.get_tempo_multiplier(), self.mc.export_soundfont_path)
+        self.export_tunes(file_type, extension, convert_func, only_selected=True, batch_convert_func=batch_convert_func, ask_directory_for_selection=True)
+
+    def ffmpeg_is_available(self):
+        ffmpeg_path = self.settings['ffmpeg_path']
+        return ffmpeg_path and os.path.exists(ffmpeg_path)
+
+    def ReportFfmpegIsMissing(self):
+        dlg = wx.MessageDialog(self, _('ffmpeg was not found here. Go to settings and indicate the path'), _('Warning'), wx.OK)
+        dlg.ShowModal()
+        dlg.Destroy()
 
     def ReportFluidSynthIsMissing(self):
             wx.MessageBox(_("Both the FluidSynth library and a valid SoundFont (see menu Settings -> ABC Settings -> File settings) are required for exporting to a wave file."),
@@ -5383,41 +4979,30 @@ class MainFrame(wx.Frame):
         return False
 
     def export_mp3(self, tune, filepath):
-        self.export_ffmpeg(tune, filepath)
+        return self.export_ffmpeg(tune, filepath)
 
     def export_aac(self, tune, filepath):
-        self.export_ffmpeg(tune, filepath)
+        return self.export_ffmpeg(tune, filepath)
 
     def export_ffmpeg(self, tune, filepath):
+        ''' the rendered samples are piped straight into ffmpeg, so no temporary wave file is written '''
         global execmessages
-        ffmpeg_path = self.settings['ffmpeg_path']
-        if ffmpeg_path and os.path.exists(ffmpeg_path):
-            base_name, ext = os.path.splitext(filepath)
-            tmp_file = base_name + '.wav'
-            if not self.export_wave(tune, tmp_file):
-                return
+        if not self.ffmpeg_is_available():
+            self.ReportFfmpegIsMissing()
+            return False
 
-            if os.path.exists(tmp_file):
-                cmd = [ffmpeg_path, '-y', '-nostdin', '-i', tmp_file, '-vn', filepath]
-                if ext == '.m4a':
-                    cmd = [ffmpeg_path, '-y', '-nostdin', '-i', tmp_file, '-c:a', 'aac', '-q:a', '0.5', filepath]
-
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                execmessages += '\nffmpeg\n' + " ".join(cmd)
-                stdout_value, stderr_value, returncode = get_output_from_process(cmd)
-                if returncode != 0:
-                    execmessages += stderr_value
-                    execmessages += stdout_value
-                    print(stderr_value)
-                    print(stdout_value)
-                    print(returncode)
-
-                if os.path.exists(tmp_file):
-                    os.remove(tmp_file)
-        else:
-            dlg = wx.MessageDialog(self, _('ffmpeg was not found here. Go to settings and indicate the path'), _('Warning'), wx.OK)
-            dlg.ShowModal()
+        tempo_multiplier = self.get_tempo_multiplier()
+        midi_tune = AbcToMidi(tune.abc, tune.header, self.cache_dir, self.settings, self.statusbar, tempo_multiplier)
+        if not midi_tune:
+            return False
+        try:
+            success, messages = self.mc.render_to_ffmpeg(midi_tune.midi_file, self.settings['ffmpeg_path'], filepath)
+            execmessages += '\nffmpeg\n' + messages
+            if not success:
+                self.statusbar.SetStatusText(_('Failed to create {0}').format(filepath))
+            return success
+        finally:
+            midi_tune.cleanup()
 
     #Add an export all tunes to individual PDF option
     def OnExportAllPDFFiles(self, evt):
@@ -5454,7 +5039,8 @@ class MainFrame(wx.Frame):
             dlg.ShowModal()
             return
 
-        self.export_tunes(_('PDF file'), '.pdf', self.export_pdf, only_selected=only_selected, single_file=single_file)
+        batch_convert_func = partial(export_tune_to_pdf, dict(self.settings))
+        self.export_tunes(_('PDF file'), '.pdf', self.export_pdf, only_selected=only_selected, single_file=single_file, batch_convert_func=batch_convert_func)
 
     def OnExportSVG(self, evt):
         self.export_tunes(_('SVG file'), '.svg', self.export_svg, only_selected=True)
@@ -5702,7 +5288,10 @@ class MainFrame(wx.Frame):
             title = _('Untitled')
         return Tune('', title, '', 0, 0, abc, header, num_header_lines)
 
-    def export_tunes(self, file_type, extension, convert_func, only_selected=False, single_file=False):
+    def export_tunes(self, file_type, extension, convert_func, only_selected=False, single_file=False, batch_convert_func=None, ask_directory_for_selection=False):
+        ''' batch_convert_func(tune, filepath, scratch_dir) is a variant of convert_func that can run in a worker thread.
+            When it is given and many tunes are exported to a directory, the tunes are converted concurrently.
+            With ask_directory_for_selection a directory is asked once when more than one tune is selected '''
         if single_file:
             if only_selected:
                 selected_tunes = self.GetSelectedTunes(add_file_header=False)
@@ -5727,7 +5316,7 @@ class MainFrame(wx.Frame):
         if len(tunes) == 0:
             return
 
-        individual_save_dialog = only_selected or single_file
+        individual_save_dialog = single_file or (only_selected and not (ask_directory_for_selection and len(tunes) > 1))
 
         if self.current_file:
             path = os.path.dirname(self.current_file)
@@ -5748,6 +5337,10 @@ class MainFrame(wx.Frame):
         execmessages = u''
 
         self.statusbar.SetStatusText(_('{0} files to create').format(len(tunes)))
+        if batch_convert_func is not None and not individual_save_dialog and len(tunes) > 1:
+            self.export_tunes_concurrently(tunes, file_type, extension, batch_convert_func, path)
+            return
+
         progdialog = None
         try:
             self.SetCursor(wx.HOURGLASS_CURSOR)
@@ -5781,6 +5374,57 @@ class MainFrame(wx.Frame):
         else:
             self.statusbar.SetStatusText(_('Export failed'))
 
+    def export_tunes_concurrently(self, tunes, file_type, extension, batch_convert_func, path):
+        global execmessages
+        jobs = []
+        file_paths = set()
+        for i, tune in enumerate(tunes):
+            filepath = os.path.join(path, self.GetFileNameForTune(tune, extension))
+            filepath = ensure_file_name_does_not_exist(filepath)
+            base_path, ext = os.path.splitext(filepath)
+            n = 0
+            while filepath in file_paths:  # two tunes with the same title
+                n += 1
+                filepath = ensure_file_name_does_not_exist(u'{0}({1}){2}'.format(base_path, n, ext))
+            file_paths.add(filepath)
+            jobs.append(ExportJob(i, tune, filepath))
+
+        pool = ExportPool(batch_convert_func, self.cache_dir, self.settings.get('export_worker_count', 0),
+                          collect_messages=abc_conversion.collect_messages)
+        failed = []
+        progdialog = None
+        try:
+            self.SetCursor(wx.HOURGLASS_CURSOR)
+            progdialog = wx.ProgressDialog(_('Exporting'), _('Remaining time'), len(jobs),
+                                           style = wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME | wx.PD_AUTO_HIDE)
+            pool.start(jobs)
+            while not pool.is_done:
+                for result in pool.get_results():
+                    execmessages += result.messages
+                    if result.success:
+                        execmessages += u'creating {0} ({1:.1f} s)\n'.format(result.job.file_path, result.seconds)
+                    else:
+                        failed.append(result.job)
+                        if result.error:
+                            execmessages += result.error
+                if not pool.cancelled:
+                    running = progdialog.Update(min(pool.finished_count, len(jobs) - 1))
+                    if not running[0]:
+                        pool.cancel()
+            pool.join()
+        finally:
+            self.SetCursor(wx.STANDARD_CURSOR)
+            if progdialog:
+                progdialog.Destroy()
+
+        self.update_statusbar_and_messages()
+        if failed:
+            self.statusbar.SetStatusText(_('Export failed') + u' ({0}/{1})'.format(len(failed), len(jobs)))
+        elif pool.cancelled:
+            self.statusbar.SetStatusText(_('{0} of {1} files written').format(pool.finished_count, len(jobs)))
+        else:
+            self.statusbar.SetStatusText(_('Export completed'))
+
     def MoveTune(self, from_index, to_index):
         self.tune_list.GetItemData(from_index)
         (_, _, line_no) = self.tune_list.itemDataMap[from_index]
@@ -6838,6 +6482,9 @@ class MainFrame(wx.Frame):
                     pass
             self.svg_tunes.cleanup()
             self.midi_tunes.cleanup()
+            render_cache = get_svg_render_cache(self.cache_dir, self.settings)
+            if render_cache is not None:
+                render_cache.clear()
 
     # 1.3.6.1 [SS] 2014-12-28 2015-01-22
     def OnColdRestart(self, evt):
@@ -6848,6 +6495,9 @@ class MainFrame(wx.Frame):
             f = os.path.join(self.app_dir, 'settings1.3.dat')
             os.remove(f)
             self.music_update_thread.abort()
+            self.prerender_thread.abort()
+            self.midi_prepare_thread.abort()
+            shutdown_render_servers()
             self.is_closed = True
             self.manager.UnInit()
             self.Destroy()
@@ -6920,7 +6570,7 @@ class MainFrame(wx.Frame):
 
     def closestNoteData(self, page, row_offset, line, col):
         """Find the NoteData of the closest note to cursor position
-        
+
         Parameters
         ----------
         page : SvgPage
@@ -6931,13 +6581,13 @@ class MainFrame(wx.Frame):
             Line where the cursor or selection is in the editor
         col : int
             Col where the cursor or selection is in the editor
-            
+
         Returns
         -------
         closest_note_data : namedTuple NoteData
             closest NoteData found in the page
         """
-        
+
         closest_note_data = None
         line -= row_offset
         # Next variables initialised with a value that should be big enough to find closest
@@ -6945,7 +6595,7 @@ class MainFrame(wx.Frame):
         note_delta = 9999
         bar_start = bar_start_tmp = 0
         bar_end = 9999
-        
+
         if page.notes_in_row is not None and line in page.notes_in_row:
             for note_data in page.notes_in_row[line]:
                 # note_type B is a Bar and first listed
@@ -6960,16 +6610,16 @@ class MainFrame(wx.Frame):
                 if (note_data.note_type == "N" or note_data.note_type == "R") and bar_start<=note_data.col<=bar_end and (closest_note_data is None or col>=note_data.col) and (abs(col - note_data.col)<note_delta): 
                     note_delta=abs(col - note_data.col)
                     closest_note_data = note_data
-        
+
         return closest_note_data
 
     def FindNotesIndicesBetween2Notes(self, page, note_data_1, note_data_2):
         """Find the indices of the notes between 2 notes
-        
+
         Need to consider the various cases of selection.
         For now only single selection mode is supported with contiguous selection.
         Todo: manage multiple selections
-        
+
         Parameters
         ----------
         page : SvgPage
@@ -6978,15 +6628,15 @@ class MainFrame(wx.Frame):
             Note data of the 1st note
         note_data_2 : namedtuple note_data
             Note data of the 2nd note
-            
+
         Returns
         -------
         set_of_indices : set
             set containing all the indices of notes between two other notes (included)
         """
-        
+
         set_of_indices = set()
-        
+
         for row in page.notes_in_row:
             if row == note_data_1.row and row == note_data_2.row:
                 for note_data in page.notes_in_row[row]:
@@ -7005,12 +6655,12 @@ class MainFrame(wx.Frame):
                 for note_data in page.notes_in_row[row]:
                     if (note_data.note_type == "N" or note_data.note_type == "R") and note_data.col<=note_data_2.col:
                         set_of_indices = set_of_indices.union(page.get_indices_for_row_col(note_data.row,note_data.col))
-        
+
         return set_of_indices
-        
+
     def ScrollMusicPaneToMatchEditor(self, select_closest_note=False, select_closest_page=False):
         """Scroll the score in the Music Pane to match the editor pointer and highlight notes
-        
+
         Parameters
         ----------
         select_closest_note : bool, optional
@@ -7019,12 +6669,12 @@ class MainFrame(wx.Frame):
         select_closest_page : bool, optional
             A flag used to align score view in Music Pane to editor selection
             (default is False)
-            
+
         Returns
         -------
         Nothing to return
         """
-        
+
         tune = self.GetSelectedTune()
         if not tune or not self.current_svg_tune or (not select_closest_note and not select_closest_page):
             #FAU: No need to continue to process
@@ -7032,7 +6682,7 @@ class MainFrame(wx.Frame):
         #if len(self.music_pane.current_page.notes) == 0:
         #    #FAU: Notes were never drawn, force to draw otherwise error in multipage when switching page
         #    self.music_pane.current_page.draw()
-        
+
         # workaround for the fact the abcm2ps returns incorrect row numbers
         # check the row number of the first note and if it doesn't agree with the actual value
         # then pretend that we have more or less extra header lines
@@ -7049,19 +6699,19 @@ class MainFrame(wx.Frame):
         line_p2 = self.editor.LineFromPosition(p2)
         line_p1 = self.editor.LineFromPosition(p1)
         p1_page_index = p2_page_index = self.current_page_index
-        
+
         #FAU: This part is to find the associated svgPage.
         #     It used to exit as soon as page of the cursor is found but need to browse completely
         #     as selection can be on multiple svgPages
         #if select_closest_page or select_closest_note:
         abc_from_editor = AbcTune(self.editor.GetTextRange(tune.offset_start, tune.offset_end))
         first_note_editor = abc_from_editor.first_note_line_index
-        
+
         #if first_note_editor is not None:
         if first_note_editor is None:
             #No need to continue as no Note
             return
-        
+
         caret_body_row = caret_current_row - tune_first_line_no - first_note_editor
         p1_body_row = max(line_p1 - tune_first_line_no - first_note_editor, 0)
         p2_body_row = max(line_p2 - tune_first_line_no - first_note_editor,0)
@@ -7077,7 +6727,7 @@ class MainFrame(wx.Frame):
             new_page_index = None
             for page_index in page_indices:
                 page = self.current_svg_tune.render_page(page_index, self.renderer)
-                page.draw()
+                page.layout()
                 if page and page.notes_in_row and caret_svg_row in page.notes_in_row:
                     new_page_index = page_index
                     #FAU: Do not break anymore to find other pages for selection 
@@ -7099,15 +6749,15 @@ class MainFrame(wx.Frame):
                 self.select_page(new_page_index)
         else:
             select_closest_note=False
-            
+
         musicpane_current_page = self.music_pane.current_page # 1.3.6.2 [JWdJ]
         if len(musicpane_current_page.notes) == 0:
             #FAU: at this point in time notes should be drawn already thus if no notes then remove flag select
             select_closest_note=False
-        
+
         #FAU: This is to track for the current page shown in the musicpane.
         current_page_index = self.current_page_index
-        
+
         #FAU: To search for the closest note, value initialised corresponding to a long distance
         closest_xy = None
         #closest_col = -9999
@@ -7116,7 +6766,7 @@ class MainFrame(wx.Frame):
         closest_note_indice_p2 = None
         closest_note_data_p1 = None
         closest_note_data_p2 = None
-        
+
         selection_multi_notes = False
         current_position_is_p1 = False
         if p1!=p2 and select_closest_note:
@@ -7127,10 +6777,10 @@ class MainFrame(wx.Frame):
             #     from left to right (False) or right to left (True).
             if p1 == caret_current_pos:
                 current_position_is_p1 = True
-        
+
         # 1.3.6.2 [JWdJ] 2015-02
         row_offset = tune_first_line_no - 1 - num_header_lines
-        
+
         if select_closest_note:
             #FAU: This is to manage the case with selection not completely in the current page or even not at all comprised
             if p2_page_index != current_page_index or p1_page_index != current_page_index:                
@@ -7146,7 +6796,7 @@ class MainFrame(wx.Frame):
                         closest_note_indice_p2 = p2_page.get_indices_for_row_col(closest_note_data_p2.row,closest_note_data_p2.col)
                     if p1_page_index < current_page_index:
                         closest_note_data_p1 = self.closestNoteData(p1_page,row_offset,line_p1,col = p1 - self.editor.PositionFromLine(line_p1))
-            
+
             #FAU: search note data corresponding to selection
             if closest_note_data_p2 is None:
                 col = p2 - self.editor.PositionFromLine(line_p2)
@@ -7162,7 +6812,7 @@ class MainFrame(wx.Frame):
                     selected_indices = self.FindNotesIndicesBetween2Notes(musicpane_current_page, closest_note_data_p1, closest_note_data_p2)
             else:
                 selection_multi_notes = False
-        
+
         ## 1.3.6.2 [JWdJ] 2015-02
         #for i, (x, y, abc_row, abc_col, desc) in enumerate(page.notes):
         #    abc_row += row_offset
@@ -7182,7 +6832,7 @@ class MainFrame(wx.Frame):
         #            #    page.add_note_to_selection(i)
         #            #    self.selected_note_indices = [i]
         #            #    self.selected_note_descs = [page.notes[i] for i in self.selected_note_indices]
-        
+
         if closest_note_data_p2 is not None:
             if closest_note_indice_p2 is None:
                 closest_note_indice_p2 = musicpane_current_page.get_indices_for_row_col(closest_note_data_p2.row,closest_note_data_p2.col)
@@ -7197,19 +6847,19 @@ class MainFrame(wx.Frame):
                 for i in closest_note_indice_p2:
                     musicpane_current_page.add_note_to_selection(i)
                     self.selected_note_indices = [i]
-                
+
             self.selected_note_descs = [musicpane_current_page.notes[i] for i in self.selected_note_indices]
         elif select_closest_note:
             musicpane_current_page.clear_note_selection()
             if select_closest_note:
                 wx.CallAfter(self.music_pane.redraw)
-        
+
         if closest_note_data_p1 is not None and ((current_position_is_p1 and 
                     closest_note_data_p1.row in musicpane_current_page.notes_in_row)
                     or
                     (p1_page_index == current_page_index and p2_page_index != current_page_index)):
             closest_xy = (closest_note_data_p1.x,closest_note_data_p1.y)
-        
+
         if closest_xy is not None:
             if select_closest_note:
                 wx.CallAfter(self.music_pane.redraw)
@@ -7234,7 +6884,7 @@ class MainFrame(wx.Frame):
             ux, uy = self.music_pane.GetScrollPixelsPerUnit()
             self.music_pane.Scroll(int(sx/ux), int(sy/uy))
 
-    def select_tune_at_current_pos(self):
+    def select_tune_at_current_pos(self, update_assist=True):
         line_no = self.editor.LineFromPosition(self.editor.GetCurrentPos())
         total_tunes = self.tune_list.GetItemCount()
         found_index = next((i for i, (index, title, startline) in enumerate(self.tunes) if startline > line_no), total_tunes) - 1
@@ -7254,13 +6904,15 @@ class MainFrame(wx.Frame):
                     tune_list.EnsureVisible(index)
                     self.music_pane.Scroll(0, 0)
 
+        if update_assist:
+            self.update_assist_if_shown()
+
+    def update_assist_if_shown(self):
         if self.abc_assist_panel.IsShown():
             self.abc_assist_panel.update_assist()
 
-    def OnMovedToDifferentLine(self, queue_number_movement):
-        if self.queue_number_movement != queue_number_movement:
-            return
-        self.select_tune_at_current_pos()
+    def OnMovedToDifferentLine(self):
+        self.select_tune_at_current_pos(update_assist=False)  # the assist panel has its own caret update
 
     def AutoInsertXNum(self):
         xNum = 0
@@ -7763,24 +7415,22 @@ class MainFrame(wx.Frame):
         else:
             self.ScrollMusicPaneToMatchEditor(select_closest_note=True, select_closest_page=False)
 
-    # p09 This function needs more work, see comments below.
     def OnPosChanged(self, evt):
         # This function is called by the interrupt stc.EVT_STC_UPDATEUI
         # which occurs whenever the edit window is updated. This can
-        # occur many times. To view who initializes the interrupt,
-        # print traceback.extract_stack(None, n) where n is the
-        # depth of the stack to view.
-        #print traceback.extract_stack(None, 5)
-        self.queue_number_movement += 1
+        # occur many times, so the work that follows the caret is left to
+        # self.caret_updates, which runs each part once with the latest position.
         position = self.editor.GetCurrentPos()
         line_no = self.editor.LineFromPosition(position)
-        #print '*****OnPosChanged***** : position =    ',position,'  ',line_no
         if line_no != self.last_line_number_selected:
             self.last_line_number_selected = line_no
-            # 1.3.6 [SS] 2014-12-02
-            #wx.CallLater(260, self.OnMovedToDifferentLine, self.queue_number_movement)
-        # 1.3.6 [SS] 2014-12-02
-        wx.CallLater(260, self.OnMovedToDifferentLine, self.queue_number_movement)
+        self.caret_updates.request()  # str(self.caret_updates) shows how much work was skipped
+
+    def get_caret_state(self):
+        return self.editor.GetCurrentPos(), self.editor.GetSelection()
+
+    # p09 This function needs more work, see comments below.
+    def follow_caret_in_music_pane(self):
         # if you remove the comment from ScrollMusicToMatchEditor, you will
         # not be able to select a group of notes in the MusicPane. On the
         # otherhand, the following function allows the highlighted note
@@ -7792,8 +7442,13 @@ class MainFrame(wx.Frame):
         if not self.music_pane.mouse_select_ongoing:
             self.ScrollMusicPaneToMatchEditor(select_closest_note=True, select_closest_page=True) #patch p08
 
-
     def OnModified(self, evt):
+        if evt.GetModificationType() & (stc.STC_MOD_INSERTTEXT | stc.STC_MOD_DELETETEXT):
+            first_line = self.editor.LineFromPosition(evt.GetPosition())
+            self.tune_index.lines_changed(first_line, evt.GetLinesAdded())
+            self.styler.text_changed(first_line, evt.GetLinesAdded())
+            self.abc_assist_panel.document.text_changed()
+            self.caret_updates.text_changed()
         if self.updating_text:
             return
         if evt.GetLinesAdded() != 0:
@@ -7808,6 +7463,7 @@ class MainFrame(wx.Frame):
         if self.updating_text:
             return
         self.GrayUngray()
+        self.midi_prepare_thread.cancel()  # the midi it is working on is outdated
         # if auto-refresh is on
         if self.mni_auto_refresh.IsChecked():
             self.queue_number_refresh_music += 1
@@ -7847,12 +7503,16 @@ class MainFrame(wx.Frame):
         '''FAU 20201229: Need to stop the timer otherwise they could call back a routine that was destroyed and cause a segmentation fault on Mac'''
         self.play_timer.Stop()
         self.timer.Stop()
+        self.caret_updates.cancel()
         '''FAU 20201228: TODO: is it really what we want to do when multiple window?'''
         if wx.TheClipboard.Open():
             wx.TheClipboard.Flush()  # the text on the clipboard should be available after the app has closed
             wx.TheClipboard.Close()
 
         self.music_update_thread.abort()
+        self.prerender_thread.abort()
+        self.midi_prepare_thread.abort()
+        shutdown_render_servers()
         if self.play_music_thread != None:
             self.play_music_thread.abort()
             self.play_music_thread = None
@@ -7885,13 +7545,12 @@ class MainFrame(wx.Frame):
 
         follow_score = not self.settings['midiplayer_path']
         # 1.3.6 [SS] 2014-11-15 2014-12-08
-        self.current_midi_tune = AbcToMidi(abc, tune.header, self.cache_dir, self.settings, self.statusbar, tempo_multiplier, \
-            add_follow_score_markers=follow_score)
+        self.current_midi_tune = self.get_midi_tune(abc, tune.header, tempo_multiplier, follow_score)
+        self.midi_tunes.set_in_use(self.current_midi_tune) # browsing other tunes while playing should not delete its midi file
         self.applied_tempo_multiplier = tempo_multiplier
         # 1.3.7 [SS] 2016-01-05 in case abc2midi crashes
         midi_file = None
         if self.current_midi_tune:
-            self.midi_tunes.add(self.current_midi_tune)
             midi_file = self.current_midi_tune.midi_file
 
         if midi_file:
@@ -7904,23 +7563,52 @@ class MainFrame(wx.Frame):
                 self.started_playing = False
                 if self.settings.get('follow_score', False):
                     try:
-                        self.played_notes_timeline = self.extract_note_timings(self.current_midi_tune, self.current_svg_tune)
+                        self.played_notes_timeline = self.get_note_timeline(self.current_midi_tune, self.current_svg_tune)
                     except Exception as e:
                         error_msg = traceback.format_exc()
                         execmessages += error_msg
                 self.do_load_media_file(midi_file)
 
+    def get_midi_tune(self, abc, header, tempo_multiplier, add_follow_score_markers):
+        """ Creates the midi file for the normal tempo (or takes it from the cache) and derives the requested tempo from it
+            by changing only its tempo events, so a different tempo does not need another run of abc2midi """
+        global execmessages
+        midi_tune = AbcToMidi(abc, header, self.cache_dir, self.settings, self.statusbar, 1.0,
+                              add_follow_score_markers=add_follow_score_markers, midi_tunes=self.midi_tunes)
+        if midi_tune is None or tempo_multiplier == 1.0:
+            return midi_tune
+
+        tune_id = (midi_tune.cache_key, tempo_multiplier)
+        scaled_midi_tune = self.midi_tunes.get(tune_id)
+        if scaled_midi_tune is None or not scaled_midi_tune.midi_file or not os.path.isfile(scaled_midi_tune.midi_file):
+            midi_file = os.path.splitext(midi_tune.midi_file)[0] + '_%d.midi' % int(round(tempo_multiplier * 1000))
+            try:
+                scaled_midi_tune = midi_tune.change_tempo(tempo_multiplier, midi_file)
+            except Exception as e:
+                execmessages += u'\ncould not change the tempo of {0}, running abc2midi again ({1})'.format(midi_tune.midi_file, e)
+                return AbcToMidi(abc, header, self.cache_dir, self.settings, self.statusbar, tempo_multiplier,
+                                 add_follow_score_markers=add_follow_score_markers, midi_tunes=self.midi_tunes)
+        self.midi_tunes.add(scaled_midi_tune, tune_id)
+        return scaled_midi_tune
+
+    def get_note_timeline(self, midi_tune, svg_tune):
+        """ Returns the follow score timeline of midi_tune, which is kept with midi_tune so a replay does not need to extract it again """
+        timeline_key = (svg_tune.abc_tune.tune_id if svg_tune else None, self.mc.unit_is_midi_tick)
+        if midi_tune.note_timeline is None or midi_tune.note_timeline_key != timeline_key:
+            midi_tune.note_timeline = self.extract_note_timings(midi_tune, svg_tune)
+            midi_tune.note_timeline_key = timeline_key
+        return midi_tune.note_timeline
+
     def extract_note_timings(self, midi_tune, svg_tune):
-        midi2abc_path = self.settings['midi2abc_path']
-        if not svg_tune or not midi2abc_path or svg_tune.abc_tune.x_number != midi_tune.abc_tune.x_number:
+        if not svg_tune or svg_tune.abc_tune.x_number != midi_tune.abc_tune.x_number:
             return []
 
         page_count = svg_tune.page_count
         if page_count == 0:
             return []
 
-        lines = get_midi_structure_as_text(midi2abc_path, midi_tune.midi_file).splitlines()
-        if not lines:
+        division, events = midi_to_timeline_events(midi_tune.midi_file)
+        if not events:
             return []
 
         pages = [svg_tune.render_page(p, self.renderer) for p in range(page_count)]
@@ -7951,111 +7639,52 @@ class MainFrame(wx.Frame):
         midi_rows = [i + 1 for i in midi_rows]
 
         errors = defaultdict(lambda: defaultdict(int))
-        #FAU: jwdj/EasyABC#99 Starting from commit sshlien/abcmidi@705d9e1f737a2db9fdc615b622bc75204b1bcbee of midi2abc, Follow_score not working
-        #FAU: This commit of midi2abc changed the format of CntlParm.
-        #FAU: it used to be printf("CntlParm %2d %s = %d\n",chan+1, ctype[control],value);
-        #FAU: it is now printf("CntlParm %2d %s = %d %d\n",chan+1, ctype[control],control,value);
-        #FAU: Following regex is expecting only one decimal however an extra one is now present
-        #FAU: To have a regex working for both version, \s*\d* is added
-        #FAU: might need some further check
-        #pos_re = re.compile(r'^\s*(\d+\.\d+)\s+CntlParm\s+1\s+unknown\s+=\s+(\d+)')
-        pos_re = re.compile(r'^\s*(\d+\.\d+)\s+CntlParm\s+1\s+unknown\s+=\s*\d*\s+(\d+)')
-        note_re = re.compile(r'^\s*(\d+\.\d+)\s+Note (on|off)\s+(\d+)\s+(\d+)')
-        tempo_re = re.compile(r'^\s*(\d+\.\d+)\s+Metatext\s+tempo\s+=\s+(\d+\.\d+)\s+bpm')
-        new_track_re = re.compile(r'^Track \d+ contains')
-
-        def timediff_in_seconds(first, last, bpm):
-            return (last - first) * 60 / bpm
-
-        def time_value_to_milliseconds(value, tempos):
-            tempos = [t for t in tempos if t[0] <= value]
-            time_start, bpm, sec_until_time_start = tempos[-1]
-            sec = sec_until_time_start + timediff_in_seconds(time_start, value, bpm)
-            return int(sec * 1000)
-
-        def append_tempo(tempos, time_start, tempo):
-            sec_until_time_start = 0.0
-            if tempos:
-                later_start = [t for t in tempos if t[0] > time_start]
-                if later_start:
-                    raise Exception('Cannot insert tempo at {0}'.format(time_start))
-                prev_start, prev_bpm, prev_sec_until_time_start = tempos[-1]
-                sec_until_time_start = prev_sec_until_time_start + timediff_in_seconds(prev_start, time_start, prev_bpm)
-            tempos.append((time_start, tempo, sec_until_time_start))
-
         ticks_per_quarter = 480
-        tempos = []
+        tempo_changes = get_tempo_changes(events, division)
         notes = []
         svg_row = None
         row_col_midi_notes = defaultdict(lambda: defaultdict(int))
-        last_line_was_pos = False
-        for line in lines:
-            m = new_track_re.match(line)
-            if m is not None:
+        for event in events:
+            kind = event.kind
+            if kind == TRACK_START:
                 page_index = 0
                 page = pages[page_index]
                 active_notes = {}
                 indices = set()
-                continue
+            elif kind == SCORE_POSITION:
+                row, col = event.value1, event.value2
+                indices = set()
+                row_col_midi_notes[row][col] += 1
+                svg_row = svg_rows[midi_rows.index(row)]
+                svg_col = midi_col_to_svg_col(row, col)
+                if svg_col is not None:
+                    for i in range(page_count):
+                        indices = page.get_indices_for_row_col(svg_row, svg_col)
+                        if indices:
+                            break
+                        # wrong page perhaps
+                        page_index += 1
+                        page_index %= page_count
+                        page = pages[page_index]
+
+                    if not indices:
+                        errors[row][col] += 1
+            elif kind == NOTE_ON or kind == NOTE_OFF:
+                if self.mc.unit_is_midi_tick:
+                    converted_time = event.ticks * ticks_per_quarter / division
+                else:
+                    converted_time = ticks_to_milliseconds(event.ticks, tempo_changes, division)
 
-            m = pos_re.match(line)
-            if m is not None:
-                value = int(m.group(2))
-                if not last_line_was_pos:
-                    note_info = [value]
-                    indices = set()
-                    last_line_was_pos = True
+                note_key = (event.channel, event.value1)
+                if kind == NOTE_ON:
+                    active_notes[note_key] = MidiNote(converted_time, None, indices, page_index, svg_row or 0)
                 else:
-                    note_info.append(value)
-                    if len(note_info) == 5:
-                        row = (note_info[0] << 14) + (note_info[1] << 7) + note_info[2]
-                        col = (note_info[3] << 7) + note_info[4]
-
-                        row_col_midi_notes[row][col] += 1
-                        svg_row = svg_rows[midi_rows.index(row)]
-                        svg_col = midi_col_to_svg_col(row, col)
-                        if svg_col is not None:
-                            for i in range(page_count):
-                                indices = page.get_indices_for_row_col(svg_row, svg_col)
-                                if indices:
-                                    break
-                                # wrong page perhaps
-                                page_index += 1
-                                page_index %= page_count
-                                page = pages[page_index]
-
-                            if not indices:
-                                errors[row][col] += 1
-            else:
-                last_line_was_pos = False
-                m = note_re.match(line)
-                if m is not None:
-                    time_value = float(m.group(1))
-                    if self.mc.unit_is_midi_tick:
-                        converted_time = time_value * ticks_per_quarter
-                    else:
-                        converted_time = time_value_to_milliseconds(time_value, tempos)
-
-                    on_off = m.group(2)
-                    channel = int(m.group(3))
-                    note_num = int(m.group(4))
-                    if on_off == 'on':
-                        note_start = converted_time
-                        active_notes[(channel, note_num)] = MidiNote(note_start, None, indices, page_index, svg_row or 0)
-                    elif on_off == 'off':
-                        note_stop = converted_time
-                        note_on = active_notes.pop((channel, note_num), None)
-                        if note_on is not None:
-                            if page_index == note_on.page:
-                                notes.append(MidiNote(note_on.start, note_stop, indices.union(note_on.indices), page_index, svg_row or 0))
-                            else:
-                                notes.append(MidiNote(note_on.start, note_stop, note_on.indices, note_on.page, note_on.svg_row))
-                elif not self.mc.unit_is_midi_tick:
-                    m = tempo_re.match(line)
-                    if m is not None:
-                        tempo_start = float(m.group(1))
-                        tempo = float(m.group(2))
-                        append_tempo(tempos, tempo_start, tempo)
+                    note_on = active_notes.pop(note_key, None)
+                    if note_on is not None:
+                        if page_index == note_on.page:
+                            notes.append(MidiNote(note_on.start, converted_time, indices.union(note_on.indices), page_index, svg_row or 0))
+                        else:
+                            notes.append(MidiNote(note_on.start, converted_time, note_on.indices, note_on.page, note_on.svg_row))
 
         row_col_svg_notes = defaultdict(lambda: defaultdict(int))
         for page in pages:
@@ -8141,60 +7770,7 @@ class MainFrame(wx.Frame):
             execmessages += '\n\n=== follow score ===\n\n'
             execmessages += os.linesep.join(lines)
 
-        return self.group_notes_by_time(notes)
-
-    def fill_time_gaps(self, time_slices):
-        gaps = []
-        last_stop = 0
-        for time_slice in time_slices:
-            if time_slice.start > last_stop:
-                gaps.append(MidiNote(last_stop, time_slice.start, set(), time_slice.page, time_slice.svg_row))
-            last_stop = time_slice.stop
-
-        if gaps:
-            time_slices += gaps
-            time_slices.sort(key=lambda n: n.start)
-
-        time_slices.insert(0, MidiNote(-max_int, 0, set(), 0, 0))
-        last_page = time_slices[-1].page
-        svg_row = time_slices[-1].svg_row
-        time_slices.append(MidiNote(last_stop, max_int, set(), last_page, svg_row))
-        return time_slices
-
-    def group_notes_by_time(self, notes):
-        takewhile = itertools.takewhile
-        notes.sort(key=lambda n: n.start)
-        time_slices = []
-        active_notes = []
-        time_stop = max_int
-        page = 0
-        while notes or active_notes:
-            time_start = notes[0].start if notes else max_int
-            if time_start <= time_stop:
-                same_note_start = list(takewhile(lambda n: n.start == time_start, notes))
-                notes = notes[len(same_note_start):]
-                active_notes += same_note_start
-                active_notes.sort(key=lambda n: n.stop)
-                time_stop = min(active_notes[0].stop if active_notes else max_int, notes[0].start if notes else max_int)
-            else:
-                # a note stops before the next note starts
-                time_start, time_stop = time_stop, time_start
-                time_stop = min(time_stop, active_notes[0].stop if active_notes else max_int)
-
-            # adding a new slice
-            if active_notes:
-                page = max([n.page for n in active_notes])
-                active_notes = [n for n in active_notes if n.page == page] # prevent mingling of indices from different pages
-
-            all_indices_for_time_slice = set().union(*[n.indices for n in active_notes])
-            svg_row = min([n.svg_row for n in active_notes]) if active_notes else 0
-            time_slices.append(MidiNote(time_start, time_stop, all_indices_for_time_slice, page, svg_row))
-
-            # removing stopped notes
-            stopped_notes = list(takewhile(lambda n: n.stop <= time_stop, active_notes))
-            active_notes = active_notes[len(stopped_notes):]
-
-        return self.fill_time_gaps(time_slices)
+        return group_notes_by_time(notes)
 
     def GetTextPositionOfTune(self, tune_index):
         position = self.editor.FindText(0, self.editor.GetTextLength(), 'X:%s' % tune_index, 0)
@@ -8282,15 +7858,20 @@ class MainFrame(wx.Frame):
         self.svg_tunes.add(tune) # 1.3.6.3 [JWDJ] for proper disposable of svg files
         self.UpdateMusicPane()
 
+    def OnMidiPrepared(self, evt): # MidiPreparedEvent
+        # MidiPrepareThread.run posts an event MidiPreparedEvent with the midi tune of the selected tune
+        midi_tune = evt.GetValue()
+        cached_midi_tune = self.midi_tunes.get(midi_tune.cache_key)
+        if cached_midi_tune is not None and cached_midi_tune.midi_file and os.path.isfile(cached_midi_tune.midi_file):
+            midi_tune.cleanup()  # play was pressed before it was ready, the cached one might be playing
+        else:
+            self.midi_tunes.add(midi_tune, midi_tune.cache_key)
+
     def GetTextRangeOfTune(self, offset):
         position = offset
         editor = self.editor
         start_line = editor.LineFromPosition(position)
-        line_count = editor.GetLineCount()
-        get_line = editor.GetLine
-        end_line = start_line + 1
-        while end_line < line_count and not get_line(end_line).startswith('X:'):
-            end_line += 1
+        _, _, end_line = self.tune_index.get_tune_lines(start_line)
         end_position = editor.PositionFromLine(end_line)
         return (position, end_position)
 
@@ -8349,14 +7930,19 @@ class MainFrame(wx.Frame):
 
     def GetTune(self, listbox_index, add_file_header=True):
         index = self.tune_list.GetItemData(listbox_index)  # remap index in case items are sorted
+        if add_file_header:
+            file_header = self.GetFileHeaderBlock()
+        else:
+            file_header = ('', 0)
+        return self.GetTuneByIndex(index, file_header)
+
+    def GetTuneByIndex(self, index, file_header):
+        """ index is the position of the tune in the file, file_header is a (header, num_header_lines) tuple """
         if index in self.tune_list.itemDataMap:
             (xnum, title, line_no) = self.tune_list.itemDataMap[index]
             offset_start = self.editor.PositionFromLine(line_no)
             offset_start, offset_end = self.GetTextRangeOfTune(offset_start)
-            if add_file_header:
-                header, num_header_lines = self.GetFileHeaderBlock()
-            else:
-                header, num_header_lines = '', 0
+            header, num_header_lines = file_header
             abc = self.editor.GetTextRange(offset_start, offset_end)
             return Tune(xnum, title, '', offset_start, offset_end, abc, header, num_header_lines)
         else:
@@ -8396,6 +7982,7 @@ class MainFrame(wx.Frame):
         tune = self.GetSelectedTune()
         if tune:
             self.music_update_thread.ConvertAbcToSvg(tune.abc, tune.header)
+            self.midi_prepare_thread.prepare_midi(tune.abc, tune.header, not self.settings['midiplayer_path'])
             if evt and (wx.Window.FindFocus() != self.editor and not (self.find_dialog and self.find_dialog.IsActive() or self.replace_dialog and self.replace_dialog.IsActive())):
                 # 1.3.6.2 [JWdJ] 2015-02
                 self.music_pane.current_page.clear_note_selection()
@@ -8430,46 +8017,135 @@ class MainFrame(wx.Frame):
         tunes = self.GetTunes()
         tune_list.itemDataMap = dict(enumerate(tunes))
 
-        different = (len(tunes) != len(self.tunes))
-        if not different:
-            for tune1, tune2 in zip(tunes, self.tunes):
-                different = different or (tune1[:-1] != tune2[:-1])    # compare xnum, title but not line_no
-        if different:
-            top_item = tune_list.GetTopItem()
-            tune_list.Freeze()
-            tune_list.DeleteAllItems()
-            set_item = tune_list.SetStringItem
-            insert_item = tune_list.InsertStringItem
-            set_item_data = tune_list.SetItemData
-            get_item_count = tune_list.GetItemCount
-            if WX4:
-                insert_item = tune_list.InsertItem
-                set_item = tune_list.SetItem
-            for xnum, title, line_no in tunes:
-                index = insert_item(get_item_count(), str(xnum))
-                set_item(index, 1, title)
-                set_item_data(index, index)
-
-            last_index = get_item_count() - 1
-            if selected_tune_index is not None and selected_tune_index <= last_index:
-                tune_list.Select(selected_tune_index)
-
-            # try to restore scroll state
-            if tunes and top_item >= 0:
-                last_visible_index = top_item + tune_list.GetCountPerPage() - 1
-                if last_visible_index > last_index:
-                    last_visible_index = last_index
-                tune_list.EnsureVisible(last_visible_index)
-
-            tune_list.Thaw()
+        # compare xnum, title but not line_no
+        old_rows = [tune[:-1] for tune in self.tunes]
+        new_rows = [tune[:-1] for tune in tunes]
+        if old_rows != new_rows:
+            sort_column = tune_list.GetSortState()[0]
+            if sort_column < 0 and tune_list.GetItemCount() == len(old_rows):
+                # the rows are in file order, so only the rows that changed need an update
+                self.update_changed_tune_list_rows(old_rows, new_rows)
+            else:
+                self.fill_tune_list(tunes, selected_tune_index)
 
         self.tunes = tunes
 
         self.SelectOnlyTuneIfTuneNotSelected()
 
 
+    def fill_tune_list(self, tunes, selected_tune_index=None):
+        tune_list = self.tune_list
+        top_item = tune_list.GetTopItem()
+        tune_list.Freeze()
+        tune_list.DeleteAllItems()
+        set_item = tune_list.SetStringItem
+        insert_item = tune_list.InsertStringItem
+        set_item_data = tune_list.SetItemData
+        get_item_count = tune_list.GetItemCount
+        if WX4:
+            insert_item = tune_list.InsertItem
+            set_item = tune_list.SetItem
+        for xnum, title, line_no in tunes:
+            index = insert_item(get_item_count(), str(xnum))
+            set_item(index, 1, title)
+            set_item_data(index, index)
+
+        last_index = get_item_count() - 1
+        if selected_tune_index is not None and selected_tune_index <= last_index:
+            tune_list.Select(selected_tune_index)
+
+        # try to restore scroll state
+        if tunes and top_item >= 0:
+            last_visible_index = top_item + tune_list.GetCountPerPage() - 1
+            if last_visible_index > last_index:
+                last_visible_index = last_index
+            tune_list.EnsureVisible(last_visible_index)
+
+        tune_list.Thaw()
+
+    def update_changed_tune_list_rows(self, old_rows, new_rows):
+        """ old_rows and new_rows are lists of (xnum, title). Only the rows between the unchanged first and last rows are updated """
+        tune_list = self.tune_list
+        common_count = min(len(old_rows), len(new_rows))
+        first = 0
+        while first < common_count and old_rows[first] == new_rows[first]:
+            first += 1
+        last_old, last_new = len(old_rows), len(new_rows)
+        while last_old > first and last_new > first and old_rows[last_old-1] == new_rows[last_new-1]:
+            last_old -= 1
+            last_new -= 1
+
+        set_item = tune_list.SetStringItem
+        insert_item = tune_list.InsertStringItem
+        if WX4:
+            insert_item = tune_list.InsertItem
+            set_item = tune_list.SetItem
+        tune_list.Freeze()
+        try:
+            for index in range(first, min(last_old, last_new)):
+                xnum, title = new_rows[index]
+                set_item(index, 0, str(xnum))
+                set_item(index, 1, title)
+            for index in range(last_old - 1, last_new - 1, -1):
+                tune_list.DeleteItem(index)
+            for index in range(last_old, last_new):
+                xnum, title = new_rows[index]
+                insert_item(index, str(xnum))
+                set_item(index, 1, title)
+            if last_old != last_new:
+                # the item data of a row is its tune index, which changed for all rows after the change
+                set_item_data = tune_list.SetItemData
+                for index in range(min(last_old, last_new), len(new_rows)):
+                    set_item_data(index, index)
+        finally:
+            tune_list.Thaw()
+
     def OnTimer(self, evt):
         self.SelectOnlyTuneIfTuneNotSelected()
+        self.prerender_neighbouring_tunes()
+
+    def prerender_neighbouring_tunes(self):
+        """ When the user has not typed since the previous timer tick, let the prerender thread render the tunes
+            around the selected tune (in list order) and around the caret (in file order) into the svg cache """
+        idle = self.idle_queue_number_refresh_music == self.queue_number_refresh_music
+        self.idle_queue_number_refresh_music = self.queue_number_refresh_music
+        try:
+            depth = int(self.settings.get('prerender_tune_count', 2))
+        except ValueError:
+            depth = 0
+        if not idle or depth <= 0 or not self.tunes:
+            return
+
+        tune_list = self.tune_list
+        list_count = tune_list.GetItemCount()
+        selected = tune_list.GetFirstSelected()
+        line_no = self.editor.GetCurrentLine()
+        caret_index = next((i for i, (index, title, startline) in enumerate(self.tunes) if startline > line_no), len(self.tunes)) - 1
+        request = (self.queue_number_refresh_music, selected, caret_index, depth)
+        if request == self.last_prerender_request:
+            return
+        self.last_prerender_request = request
+
+        indices = []
+        for distance in range(1, depth + 1):
+            for direction in (distance, -distance):  # next tune is more likely than previous tune
+                if 0 <= selected + direction < list_count:
+                    indices.append(tune_list.GetItemData(selected + direction))
+                if caret_index >= 0:
+                    indices.append(caret_index + direction)
+        if caret_index >= 0:
+            indices.insert(0, caret_index)
+
+        file_header = self.GetFileHeaderBlock()
+        tasks = []
+        done = set()
+        for index in indices:
+            if index not in done:
+                done.add(index)
+                tune = self.GetTuneByIndex(index, file_header)
+                if tune is not None:
+                    tasks.append((tune.abc, tune.header))
+        self.prerender_thread.set_tasks(tasks)
 
     def SelectOnlyTuneIfTuneNotSelected(self):
         if len(self.tunes) == 1 and self.tune_list.GetFirstSelected() == -1:
@@ -8477,41 +8153,7 @@ class MainFrame(wx.Frame):
             self.OnTuneSelected(None)
 
     def GetTunes(self):
-        editor = self.editor
-        pos_from_line = editor.PositionFromLine
-        get_text_range = editor.GetTextRange
-        get_line = editor.GetLine
-        search_tune_index = tune_index_re.search
-        cur_index = None
-        cur_startline = None
-        cur_title = u''
-        titles_found = 0
-        tunes = []
-        tunes_append = tunes.append
-        n = editor.GetLineCount()
-        for i in xrange(n):
-            p = pos_from_line(i)
-            try:
-                t = get_text_range(p, p+2)
-            except:
-                t = ''
-            if t == 'X:':
-                if cur_index is not None:
-                    tunes_append((cur_index, cur_title, cur_startline))
-                    cur_index = None
-                m = search_tune_index(get_line(i))
-                if m:
-                    cur_index = int(m.group(1))
-                    cur_startline = i
-                cur_title = u''
-                titles_found = 0
-            elif t == 'T:' and titles_found < 2 and cur_index is not None:
-                title = decode_abc(strip_comments(get_line(i)[2:]).strip())
-                cur_title = ' - '.join(filter(None, (cur_title, title)))
-
-        if cur_index is not None:
-            tunes_append((cur_index, cur_title, cur_startline))
-        return tunes
+        return list(self.tune_index.get_tunes())
 
     def GetTuneAbc(self, startpos):
         editor = self.editor
@@ -8528,6 +8170,7 @@ class MainFrame(wx.Frame):
     def InitEditor(self, font_face=None, font_size=None):
         editor = self.editor
         editor.ClearDocumentStyle()
+        self.styler.invalidate()
         editor.StyleClearAll()
         editor.SetLexer(stc.STC_LEX_CONTAINER)
         editor.SetProperty("fold", "0")
@@ -8972,7 +8615,9 @@ class MainFrame(wx.Frame):
                         ('abcm2ps_defaults', True), ('abcm2ps_pagewidth', '21.59'),
                         ('abcm2ps_pageheight', '27.94'), ('midiplayer_parameters', ''),
                         ('bpmtempo', 120), ('chordvol', default_midi_volume), ('bassvol', default_midi_volume),
-                        ('melodyvol', default_midi_volume), ('midi_intro', 0), ('version', program_version)
+                        ('melodyvol', default_midi_volume), ('midi_intro', 0), ('version', program_version),
+                        ('svg_cache_size_mb', 100), ('prerender_tune_count', 2), ('export_worker_count', 0),
+                        ('score_tile_cache_size_mb', 64), ('abcm2ps_warm_workers', 1)
                        ]
 
         # 1.3.6 [SS] 2014-12-16
@@ -9324,7 +8969,7 @@ class MyApp(wx.App):
         else:
             self.frame = self.NewMainFrame()
             self.frame.load(filename)
-            
+
     def MacNewFile(self):
         #dlg = wx.MessageDialog(None,
         #                       "This app was just asked to launch",
@@ -9361,7 +9006,7 @@ class MyApp(wx.App):
 
             self.CheckCanDrawSharpFlat()
             options = {}
-            
+
             path = None
             if len(sys.argv) > 1:
                 if sys.version_info >= (3,0,0): #FAU 20210101: In Python3 there isn't anymore the decode.
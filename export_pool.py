@@ -0,0 +1,139 @@
+import sys
+import os, os.path
+import shutil
+import threading
+import time
+import traceback
+from collections import namedtuple
+if sys.version_info >= (3,0,0):
+    from queue import Queue, Empty
+else:
+    from Queue import Queue, Empty
+
+ExportJob = namedtuple('ExportJob', 'index tune file_path')
+ExportResult = namedtuple('ExportResult', 'job success error seconds messages')
+
+
+def get_default_worker_count():
+    try:
+        import multiprocessing
+        return max(1, multiprocessing.cpu_count())
+    except (ImportError, NotImplementedError):
+        return 2
+
+
+class ExportPool(object):
+    """ Runs conversions of many tunes concurrently.
+
+        The heavy lifting is done by external programs (abcm2ps, ghostscript, abc2midi) so worker threads
+        are enough to keep all cores busy. Every worker gets its own scratch directory, so the temp.ps,
+        temp.pdf and temp.abc files of one tune are never overwritten by another worker.
+
+        convert_func(tune, file_path, scratch_dir) is called for each job and should return True on success.
+        Optionally convert_func has the methods:
+          estimate_cost(tune)        jobs with the highest cost are started first, so a long job does not
+                                     end up running alone after all the others are done
+          finish_worker(scratch_dir) called by a worker when it stops, to release what it kept for its jobs
+
+        collect_messages (optional) returns a context manager that gives a list in which the messages of a job
+        are collected, they are returned as ExportResult.messages so they can be shown from the main thread.
+    """
+    def __init__(self, convert_func, scratch_root, worker_count=None, collect_messages=None):
+        self.convert_func = convert_func
+        self.collect_messages = collect_messages
+        self.scratch_root = scratch_root
+        if not worker_count or worker_count <= 0:
+            worker_count = get_default_worker_count()
+        self.worker_count = worker_count
+        self.jobs = Queue()
+        self.results = Queue()
+        self.workers = []
+        self.running_worker_count = 0
+        self.lock = threading.Lock()
+        self.job_count = 0
+        self.finished_count = 0
+        self.cancelled = False
+
+    def start(self, jobs):
+        estimate_cost = getattr(self.convert_func, 'estimate_cost', None)
+        if estimate_cost is not None:
+            jobs = sorted(jobs, key=lambda job: estimate_cost(job.tune), reverse=True)
+        for job in jobs:
+            self.jobs.put(job)
+            self.job_count += 1
+        self.running_worker_count = min(self.worker_count, self.job_count)
+        for i in range(self.running_worker_count):
+            scratch_dir = os.path.join(self.scratch_root, 'export%02d' % i)
+            worker = threading.Thread(target=self.__work, args=(scratch_dir,))
+            worker.daemon = True
+            self.workers.append(worker)
+            worker.start()
+
+    def __work(self, scratch_dir):
+        try:
+            try:
+                if not os.path.isdir(scratch_dir):
+                    os.makedirs(scratch_dir)
+            except (IOError, OSError) as e:
+                self.stop_worker(u'could not create {0}: {1}\n'.format(scratch_dir, e))
+                return
+            while not self.cancelled:
+                try:
+                    job = self.jobs.get(False)
+                except Empty:
+                    break
+                start_time = time.time()
+                messages = []
+                try:
+                    if self.collect_messages is not None:
+                        with self.collect_messages() as messages:
+                            success, error = self.convert_func(job.tune, job.file_path, scratch_dir), None
+                    else:
+                        success, error = self.convert_func(job.tune, job.file_path, scratch_dir), None
+                except Exception:
+                    success, error = False, traceback.format_exc()
+                self.results.put(ExportResult(job, success, error, time.time() - start_time, u''.join(messages)))
+            self.stop_worker()
+        finally:
+            finish_worker = getattr(self.convert_func, 'finish_worker', None)
+            if finish_worker is not None:
+                finish_worker(scratch_dir)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def stop_worker(self, error=None):
+        """ Called when a worker stops. When the last worker stops because of an error, the jobs that are left
+            fail with that error, so every job gets a result """
+        with self.lock:
+            self.running_worker_count -= 1
+            last_worker = self.running_worker_count == 0
+        if error is not None and last_worker:
+            while True:
+                try:
+                    job = self.jobs.get(False)
+                except Empty:
+                    break
+                self.results.put(ExportResult(job, False, error, 0.0, u''))
+
+    @property
+    def is_done(self):
+        return self.finished_count >= self.job_count or (self.cancelled and not any(w.is_alive() for w in self.workers) and self.results.empty())
+
+    def get_results(self, timeout=0.1):
+        """ Waits at most timeout seconds for finished jobs and returns the results that are available """
+        results = []
+        try:
+            results.append(self.results.get(True, timeout))
+            while True:
+                results.append(self.results.get(False))
+        except Empty:
+            pass
+        self.finished_count += len(results)
+        return results
+
+    def cancel(self):
+        """ Jobs that are already running are finished, the others are skipped """
+        self.cancelled = True
+
+    def join(self):
+        for worker in self.workers:
+            worker.join()
@@ -145,6 +145,12 @@ class Synth:            # interface for the FluidSynth synthesizer
     def set_gain(self, gain):
         self.setting_setnum('synth.gain', gain)
 
+    def system_reset(self):                 # reset all channels to their initial programs and controllers
+        return F.fluid_synth_system_reset(c_void_p(self.synth))
+
+    def write_s16_stereo(self, frames, buffer):   # render frames into buffer (c_short array of 2 * frames) as interleaved left/right samples
+        return F.fluid_synth_write_s16(c_void_p(self.synth), frames, buffer, 0, 2, buffer, 1, 2)
+
     def set_buffer(self, size=0, driver=None):
         if self.audio_driver is not None:   # remove current audio driver
             F.delete_fluid_audio_driver(self.audio_driver)
@@ -8,6 +8,7 @@ import sys
 PY3 = sys.version_info.major > 2
 from midiplayer import MidiPlayer
 import fluidsynth as F
+from audio_export import render_midi_to_file, render_midi_to_ffmpeg
 
 is_linux = sys.platform.startswith('linux')
 
@@ -88,22 +89,15 @@ class FluidSynthPlayer(MidiPlayer):
         ticks = self.p.get_ticks() # get play position in midi ticks
         return ticks
 
+    @property
+    def export_soundfont_path(self):
+        return self.pending_soundfont or self.soundfont_path
+
     def render_to_file(self, midi_path, output_path):
-        fs = F.Synth(gain=1.0, bsize=2048, output_path=output_path)
-        soundfont_path = self.pending_soundfont
-        if not soundfont_path:
-            soundfont_path = self.soundfont_path
-        sfid = fs.sfload(soundfont_path)
-        if sfid < 0:
-            return 0     # not a sf2 file
-        fs.program_select(0, sfid, 0, 0)
-        player = F.Player(fs)   # make a new one
-        player.add(midi_path)
-        player.play()
-        samples = player.renderLoop()
-        # print(samples)
-        player.delete()
-        fs.delete()
+        return render_midi_to_file(self.export_soundfont_path, midi_path, output_path)
+
+    def render_to_ffmpeg(self, midi_path, ffmpeg_path, output_path):
+        return render_midi_to_ffmpeg(self.export_soundfont_path, midi_path, ffmpeg_path, output_path)
 
     def dispose(self):             # free some memory
         self.p.delete()
@@ -0,0 +1,181 @@
+# -*- coding: ISO-8859-1 -*-
+
+from collections import namedtuple
+from struct import unpack_from
+
+from .EventDispatcher import EventDispatcher
+from .constants import *
+
+
+MidiEvents = namedtuple('MidiEvents', 'format division tracks')
+
+
+def read_midi_events(infile):
+
+    """
+    Reads all events of a midi file at once. This is a lot faster than
+    MidiInFile, which reads the file byte by byte and dispatches every
+    event through several method calls.
+
+    infile is a path, a file object or the raw data of a midi file.
+    Returns MidiEvents with a list of events for every track. An event
+    is a tuple (time, status, data1, data2) where time is the absolute
+    time in ticks and status the status byte (running status resolved):
+
+    channel messages:  data1 and data2 are the data bytes (data2 is 0
+                       for patch change and channel pressure)
+    meta events:       status is META_EVENT, data1 the meta type and
+                       data2 the data bytes
+    sysex events:      status is SYSTEM_EXCLUSIVE, data1 the data bytes
+                       (without the terminator) and data2 None
+    system common:     data1 the data bytes and data2 None
+    """
+
+    if isinstance(infile, (bytes, bytearray)):
+        data = infile
+    elif hasattr(infile, 'read'):
+        data = infile.read()
+    else:
+        f = open(infile, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    # indexing a bytearray gives integers on both python 2 and 3
+    data = bytearray(data)
+
+    if data[0:4] != b'MThd':
+        raise TypeError("It is not a valid midi file!")
+    header_length, format, n_tracks, division = unpack_from('>LHHH', data, 4)
+    pos = 8 + header_length
+
+    tracks = []
+    data_length = len(data)
+    while len(tracks) < n_tracks and pos + 8 <= data_length:
+        chunk_type = data[pos:pos+4]
+        chunk_length = unpack_from('>L', data, pos + 4)[0]
+        pos += 8
+        if chunk_type == b'MTrk':
+            tracks.append(read_track_events(data, pos, min(pos + chunk_length, data_length)))
+        pos += chunk_length
+
+    return MidiEvents(format, division, tracks)
+
+
+def read_track_events(data, pos, end):
+
+    "Returns the events of the track that is in data[pos:end]"
+
+    events = []
+    append = events.append
+    time = 0
+    status = 0
+    while pos < end:
+        # variable length delta time
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7F
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7F)
+        time += delta
+
+        byte = data[pos]
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        # else: running status, the byte is already data
+
+        if status < 0xF0:
+            hi_nible = status & 0xF0
+            if hi_nible == PATCH_CHANGE or hi_nible == CHANNEL_PRESSURE:
+                append((time, status, data[pos], 0))
+                pos += 1
+            else:
+                append((time, status, data[pos], data[pos+1]))
+                pos += 2
+        elif status == META_EVENT:
+            meta_type = data[pos]
+            pos += 1
+            length = 0
+            byte = 0x80
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                length = (length << 7) | (byte & 0x7F)
+            append((time, status, meta_type, bytes(data[pos:pos+length])))
+            pos += length
+        elif status == SYSTEM_EXCLUSIVE or status == END_OFF_EXCLUSIVE:
+            length = 0
+            byte = 0x80
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                length = (length << 7) | (byte & 0x7F)
+            sysex_data = data[pos:pos+length]
+            if sysex_data[-1:] == b'\xf7':
+                sysex_data = sysex_data[:-1]
+            append((time, SYSTEM_EXCLUSIVE, bytes(sysex_data), None))
+            pos += length
+        else:
+            data_size = {MTC: 1, SONG_POSITION_POINTER: 2, SONG_SELECT: 1}.get(status, 0)
+            append((time, status, bytes(data[pos:pos+data_size]), None))
+            pos += data_size
+    return events
+
+
+class MidiEventReader:
+
+    """
+    Reads a midi file with read_midi_events and triggers the midi events
+    on the outStream object, so it can be used instead of MidiInFile
+    with the existing MidiOutStream subclasses.
+    """
+
+    def __init__(self, outStream, infile):
+        self.outstream = outStream
+        self.dispatch = EventDispatcher(outStream)
+        self.infile = infile
+
+
+    def read(self):
+        "Start parsing the file"
+        midi_events = read_midi_events(self.infile)
+        stream = self.outstream
+        dispatch = self.dispatch
+        convert_zero_velocity = dispatch.convert_zero_velocity
+        stream.header(midi_events.format, len(midi_events.tracks), midi_events.division)
+        for track_number, events in enumerate(midi_events.tracks):
+            dispatch.reset_time()
+            dispatch.start_of_track(track_number)
+            last_time = 0
+            for time, status, data1, data2 in events:
+                stream.update_time(time - last_time)
+                last_time = time
+                if status < 0xF0:
+                    hi_nible, channel = status & 0xF0, status & 0x0F
+                    if hi_nible == NOTE_ON:
+                        if data2 == 0 and convert_zero_velocity:
+                            stream.note_off(channel, data1, 0x40)
+                        else:
+                            stream.note_on(channel, data1, data2)
+                    elif hi_nible == NOTE_OFF:
+                        stream.note_off(channel, data1, data2)
+                    elif hi_nible == CONTINUOUS_CONTROLLER:
+                        stream.continuous_controller(channel, data1, data2)
+                    elif hi_nible == PATCH_CHANGE:
+                        stream.patch_change(channel, data1)
+                    elif hi_nible == PITCH_BEND:
+                        stream.pitch_bend(channel, (data1<<7) + data2)
+                    elif hi_nible == AFTERTOUCH:
+                        stream.aftertouch(channel, data1, data2)
+                    elif hi_nible == CHANNEL_PRESSURE:
+                        stream.channel_pressure(channel, data1)
+                elif status == META_EVENT:
+                    dispatch.meta_event(data1, data2)
+                elif status == SYSTEM_EXCLUSIVE:
+                    dispatch.sysex_event(data1)
+                else:
+                    dispatch.system_commons(status, data1)
+        stream.eof()
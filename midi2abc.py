@@ -20,7 +20,7 @@
 #    better handling of accidentals in keys with many flats and sharps
 
 from midi.MidiOutStream import MidiOutStream
-from midi.MidiInFile import MidiInFile
+from midi.MidiEventReader import MidiEventReader
 from fractions import Fraction
 import os
 import os.path
@@ -218,7 +218,7 @@ def midi_to_abc(filename=None, notes=None, key=None, metre=Fraction(3, 4), defau
         # read midi notes
         handler1 = MidiHandler(0, 15)  # channels 0-15
         # handler1 = MidiHandler(0, 0)  # channels 0-15
-        MidiInFile(handler1, filename).read()
+        MidiEventReader(handler1, filename).read()
         notes = handler1.notes
     elif not filename and not notes:
         raise Exception(
@@ -1,6 +1,8 @@
 from midi.MidiOutStream import MidiOutStream    # downloaded from: http://www.mxm.dk/products/public/pythonmidi
 from midi.MidiInFile import MidiInFile
+from midi.MidiEventReader import MidiEventReader, read_midi_events
 from midi.DataTypeConverters import fromBytes
+from collections import namedtuple
 
 class NoteOnHandler(MidiOutStream):
 
@@ -40,6 +42,107 @@ class NoteOnHandler(MidiOutStream):
 def midi_to_meta_data(midi_file_path):
     ''' returns a list: [(row, col, millisecond_midi_offset), ...] '''
     event_handler = NoteOnHandler()
+    midi_in = MidiEventReader(event_handler, midi_file_path)
+    midi_in.read()
+    return event_handler.offsets
+
+TRACK_START, NOTE_ON, NOTE_OFF, TEMPO, SCORE_POSITION = range(5)
+MidiTimelineEvent = namedtuple('MidiTimelineEvent', 'kind track ticks channel value1 value2')
+
+def midi_to_timeline_events(midi_file_path):
+    ''' returns (division, events) where events is a list of MidiTimelineEvent in the order of the midi file, all times are absolute midi ticks.
+        A SCORE_POSITION event has the abc row as value1 and the 1-based abc column as value2 '''
+    midi_events = read_midi_events(midi_file_path)
+    events = []
+    append = events.append
+    for track, track_events in enumerate(midi_events.tracks):
+        append(MidiTimelineEvent(TRACK_START, track, 0, 0, 0, 0))
+        CC = {}
+        for time, status, data1, data2 in track_events:
+            if status < 0xF0:
+                hi_nible, channel = status & 0xF0, status & 0x0F
+                if hi_nible == 0x90 and data2 > 0:
+                    append(MidiTimelineEvent(NOTE_ON, track, time, channel, data1, data2))
+                elif hi_nible == 0x80:
+                    append(MidiTimelineEvent(NOTE_OFF, track, time, channel, data1, data2))
+                elif hi_nible == 0x90:
+                    # a note on with velocity 0 is the same as a note off with velocity 0x40
+                    append(MidiTimelineEvent(NOTE_OFF, track, time, channel, data1, 0x40))
+                elif hi_nible == 0xB0 and channel == 0 and 110 <= data1 <= 114:
+                    # abc2midi -EA writes the abc position of every note as controllers 110 to 114 on the first channel
+                    if data1 == 110:
+                        CC = {}
+                    CC[data1] = data2
+                    if data1 == 114 and len(CC) == 5:
+                        row = (CC[110] << 14) | (CC[111] << 7) | (CC[112])
+                        col = (CC[113] << 7) | (CC[114])
+                        append(MidiTimelineEvent(SCORE_POSITION, track, time, channel, row, col))
+            elif status == 0xFF and data1 == 0x51:
+                b1, b2, b3 = bytearray(data2)
+                append(MidiTimelineEvent(TEMPO, track, time, 0, (b1 << 16) | (b2 << 8) | b3, 0))
+    return midi_events.division, events
+
+def get_tempo_changes(events, division):
+    ''' returns a list: [(tick, microseconds_per_quarter, milliseconds_until_tick), ...] sorted by tick '''
+    tempo_events = sorted((e.ticks, e.value1) for e in events if e.kind == TEMPO)
+    if not tempo_events or tempo_events[0][0] > 0:
+        tempo_events.insert(0, (0, 500000))  # 120 bpm is the default tempo of a midi file
+    tempo_changes = []
+    ms = 0.0
+    prev_tick, prev_tempo = 0, tempo_events[0][1]
+    for tick, tempo in tempo_events:
+        ms += (tick - prev_tick) * prev_tempo / (division * 1000.0)
+        tempo_changes.append((tick, tempo, ms))
+        prev_tick, prev_tempo = tick, tempo
+    return tempo_changes
+
+def ticks_to_milliseconds(ticks, tempo_changes, division):
+    tick, tempo, ms = [t for t in tempo_changes if t[0] <= ticks][-1]
+    return int(ms + (ticks - tick) * tempo / (division * 1000.0))
+
+class TempoEventHandler(MidiOutStream):
+    ''' finds where the tempo events are in the raw data of a midi file '''
+
+    def __init__(self):
+        MidiOutStream.__init__(self)
+        self.raw_in = None
+        self.first_track_position = None
+        self.tempo_positions = []   # [(tick, position of the 3 tempo data bytes), ...]
+
+    def start_of_track(self, n_track=0):
+        MidiOutStream.start_of_track(self, n_track)
+        if self.first_track_position is None:
+            self.first_track_position = self.raw_in.getCursor()
+
+    def tempo(self, value):
+        # the cursor is just after the tempo data
+        self.tempo_positions.append((self.abs_time(), self.raw_in.getCursor() - 3))
+
+    def sysex_event(self, data):
+        pass
+
+def scale_midi_tempo(midi_file_path, target_file_path, tempo_multiplier):
+    ''' writes a copy of a midi file that plays tempo_multiplier times as fast. Only the tempo events are changed '''
+    event_handler = TempoEventHandler()
     midi_in = MidiInFile(event_handler, midi_file_path)
+    event_handler.raw_in = midi_in.raw_in
     midi_in.read()
-    return event_handler.offsets
\ No newline at end of file
+
+    data = bytearray(midi_in.raw_in.data)
+    for tick, pos in event_handler.tempo_positions:
+        tempo = (data[pos] << 16) | (data[pos+1] << 8) | data[pos+2]
+        tempo = max(1, min(0xFFFFFF, int(round(tempo / tempo_multiplier))))
+        data[pos:pos+3] = bytearray([tempo >> 16, (tempo >> 8) & 0xFF, tempo & 0xFF])
+
+    if event_handler.first_track_position is not None and not any(tick == 0 for tick, pos in event_handler.tempo_positions):
+        # the file uses the default tempo of 120 bpm, so add a tempo event at the start of the first track
+        tempo = max(1, min(0xFFFFFF, int(round(500000 / tempo_multiplier))))
+        tempo_event = bytearray([0, 0xFF, 0x51, 3, tempo >> 16, (tempo >> 8) & 0xFF, tempo & 0xFF])
+        length_pos = event_handler.first_track_position + 4
+        track_length = (data[length_pos] << 24) | (data[length_pos+1] << 16) | (data[length_pos+2] << 8) | data[length_pos+3]
+        track_length += len(tempo_event)
+        data[length_pos:length_pos+4] = bytearray([track_length >> 24, (track_length >> 16) & 0xFF, (track_length >> 8) & 0xFF, track_length & 0xFF])
+        data[length_pos+4:length_pos+4] = tempo_event
+
+    with open(target_file_path, 'wb') as f:
+        f.write(bytes(data))
@@ -1,10 +1,46 @@
 import wx
 import traceback
 import sys
+from collections import OrderedDict
 from wxhelper import wx_cursor, wx_colour
 PY3 = sys.version_info.major > 2
 WX4 = wx.version().startswith('4')
 
+
+class TileCache(object):
+    """ Keeps the most recently used tiles (bitmaps of parts of a page) until they take more than max_bytes.
+        A key contains the page, zoom and tile position, so scrolling back or zooming back is fast. """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        bitmap = self.tiles.pop(key, None)
+        if bitmap is not None:
+            self.tiles[key] = bitmap # most recently used tiles are at the end
+        return bitmap
+
+    def put(self, key, bitmap, keep_count=1):
+        """ Adds the tile, the last keep_count tiles (which are probably still visible) are never removed """
+        old_bitmap = self.tiles.pop(key, None)
+        if old_bitmap is not None:
+            self.size -= get_bitmap_size(old_bitmap)
+        self.tiles[key] = bitmap
+        self.size += get_bitmap_size(bitmap)
+        while self.size > self.max_bytes and len(self.tiles) > keep_count:
+            _, old_bitmap = self.tiles.popitem(last=False)
+            self.size -= get_bitmap_size(old_bitmap)
+
+    def clear(self):
+        self.tiles.clear()
+        self.size = 0
+
+
+def get_bitmap_size(bitmap):
+    return bitmap.GetWidth() * bitmap.GetHeight() * 4
+
+
 class MusicScorePanel(wx.ScrolledWindow):
     def __init__(self, parent, renderer):
         wx.ScrolledWindow.__init__(self, parent, -1)#, style=wx.CLIP_CHILDREN )
@@ -48,6 +84,14 @@ class MusicScorePanel(wx.ScrolledWindow):
         self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.highlighted_notes = None
         self.highlight_follow = False
+        # the page is drawn in tiles, so scrolling and zooming only draw the newly exposed parts
+        self.tile_cache = TileCache()
+        self.tile_width = 1024
+        self.tile_height = 256
+        # what is currently on screen, so a change of selection only repaints the notes that changed
+        self.displayed_page_key = None
+        self.displayed_selection = set()
+        self.displayed_highlighted_notes = ()
 
     def reset_scrolling(self):
         self.SetVirtualSize((self.buffer_width, self.buffer_height))
@@ -145,6 +189,7 @@ class MusicScorePanel(wx.ScrolledWindow):
                 pass
             self.drag_start_x = None
             self.drag_start_y = None
+            self.refresh_page_rect(self.drag_rect)
             self.drag_rect = None
             self.OnMouseMotion(event)
             self.redraw()
@@ -156,7 +201,9 @@ class MusicScorePanel(wx.ScrolledWindow):
         if self.HasCapture():
             if self.drag_start_x is not None and self.drag_start_y is not None:
                 x, y = self.get_xy_of_mouse_event(event)
+                self.refresh_page_rect(self.drag_rect)
                 self.drag_rect = (min(self.drag_start_x, x), min(self.drag_start_y, y), abs(self.drag_start_x-x), abs(self.drag_start_y-y))
+                self.refresh_page_rect(self.drag_rect)
                 rect = wx.Rect(*map(int, self.drag_rect))
                 old_selection = page.selected_indices.copy()
                 page.select_notes(rect)
@@ -201,8 +248,7 @@ class MusicScorePanel(wx.ScrolledWindow):
             self.renderer.min_width = w
             self.renderer.min_height = h
             if self.current_page != self.renderer.empty_page:
-                self.renderer.update_buffer(self.current_page)
-                self.redraw()
+                self.Refresh()
 
     def OnPaint(self, evt):
         # The buffer already contains our drawing, so no need to
@@ -216,9 +262,19 @@ class MusicScorePanel(wx.ScrolledWindow):
         self.PrepareDC(dc)
         if self.current_page != self.renderer.empty_page:
             if self.need_redraw:
-                self.Draw()
+                try:
+                    self.renderer.layout(self.current_page)
+                except Exception:
+                    error_msg = traceback.format_exc()
+                    print('Warning: ' + error_msg)
                 self.need_redraw = False
-            dc.DrawBitmap(self.renderer.buffer, 0, 0)
+            update_rect = self.get_update_rect()
+            self.draw_tiles(dc, update_rect)
+            self.draw_drag_rect(dc)
+            # the tiles do not show the selection, so draw the selected notes on top of them
+            selected_notes = self.get_notes_in_rect(self.current_page.selected_indices, update_rect)
+            if selected_notes:
+                self.renderer.draw_notes(page=self.current_page, note_indices=selected_notes, highlight=True, dc=dc)
             if self.highlighted_notes:
                 self.renderer.draw_notes(page=self.current_page, note_indices=self.highlighted_notes, highlight=True, dc=dc, highlight_follow=self.highlight_follow)
         else:
@@ -234,6 +290,7 @@ class MusicScorePanel(wx.ScrolledWindow):
 
     def clear(self):
         self.current_page = self.renderer.empty_page
+        self.displayed_page_key = None
         self.renderer.clear()
         self.Refresh()
 
@@ -246,13 +303,21 @@ class MusicScorePanel(wx.ScrolledWindow):
             return
 
         z = self.renderer.zoom
+        page_key = (page.serial_number, z)
+        if page_key == self.displayed_page_key and page.layout_key == (id(self.renderer), z):
+            # same page at the same zoom is on screen, so only the notes that were (un)selected need repainting
+            self.update_selection()
+            return
+        self.displayed_page_key = page_key
+        self.displayed_selection = set(page.selected_indices)
+        self.displayed_highlighted_notes = ()
+
         w, h = int(page.svg_width * z), int(page.svg_height * z)
         self.redrawing = True
         try:
             self.SetVirtualSize((w, h)) # triggers redraw again
             self.note_paths = []
             self.need_redraw = True
-            self.renderer.update_buffer(page)
             # self.redraw_counter += 1
             # print 'need_redraw %d' % self.redraw_counter
             self.Refresh()
@@ -269,7 +334,8 @@ class MusicScorePanel(wx.ScrolledWindow):
             #FAU Width argument for pen is an int not a float.
             #dc.SetPen( dc.CreatePen(wx.Pen(wx_colour('black'), 1.0, style=wx.DOT )) )
             dc.SetPen( dc.CreatePen(wx.Pen(wx_colour('black'), width=1, style=wx.DOT )) )
-            dc.SetBrush(dc.CreateBrush(wx.Brush(wx_colour('#fffbc6'), wx.SOLID)))
+            # drawn on top of the score, so semi-transparent to keep the notes visible
+            dc.SetBrush(dc.CreateBrush(wx.Brush(wx.Colour(0xff, 0xfb, 0xc6, 0x80), wx.SOLID)))
             path = dc.CreatePath()
             path.MoveToPoint(x, y)
             path.AddLineToPoint(x+width, y)
@@ -278,34 +344,92 @@ class MusicScorePanel(wx.ScrolledWindow):
             path.AddLineToPoint(x, y)
             dc.DrawPath(path)
 
+    def update_selection(self):
+        page = self.current_page
+        changed_notes = page.selected_indices.symmetric_difference(self.displayed_selection)
+        self.displayed_selection = set(page.selected_indices)
+        if changed_notes:
+            self.refresh_notes(changed_notes)
+            self.Update()
+
+    def refresh_notes(self, note_indices):
+        """ Marks the areas of the given notes for repainting """
+        page = self.current_page
+        if page == self.renderer.empty_page:
+            return
+        try:
+            self.renderer.layout(page)
+        except Exception:
+            self.Refresh()
+            return
+        note_count = len(page.note_draw_info)
+        for i in note_indices:
+            if 0 <= i < note_count:
+                self.refresh_page_rect(self.renderer.get_note_rect(page, i))
+
+    def refresh_page_rect(self, rect):
+        """ Marks an area (x, y, width, height) in page coordinates for repainting """
+        if rect:
+            x, y, width, height = map(int, rect)
+            x, y = self.CalcScrolledPosition(x, y)
+            self.RefreshRect(wx.Rect(x - 1, y - 1, width + 2, height + 2), eraseBackground=False)
+
+    def get_update_rect(self):
+        """ Returns the area (x, y, width, height) in page coordinates that is being repainted """
+        update_rect = self.GetUpdateRegion().GetBox()
+        if update_rect.width and update_rect.height:
+            x, y = self.CalcUnscrolledPosition(update_rect.x, update_rect.y)
+            return x, y, update_rect.width, update_rect.height
+        x, y = self.CalcUnscrolledPosition(0, 0)
+        width, height = self.GetClientSize()
+        return x, y, width, height
+
+    def get_notes_in_rect(self, note_indices, rect):
+        if not note_indices:
+            return []
+        page = self.current_page
+        x, y, width, height = rect
+        right, bottom = x + width, y + height
+        note_count = len(page.note_draw_info)
+        result = []
+        for i in note_indices:
+            if 0 <= i < note_count:
+                nx, ny, nwidth, nheight = self.renderer.get_note_rect(page, i)
+                if nx < right and x < nx + nwidth and ny < bottom and y < ny + nheight:
+                    result.append(i)
+        return result
+
     def draw_notes_highlighted(self, note_indices, highlight_follow=False):
         self.highlighted_notes = note_indices
         self.redrawing = True
         self.highlight_follow = highlight_follow
         try:
-            self.Refresh()
+            # repaint where the notes were highlighted before and where they will be highlighted now
+            self.refresh_notes(set(self.displayed_highlighted_notes or ()).union(note_indices or ()))
+            self.displayed_highlighted_notes = note_indices
             self.Update()
         finally:
             self.redrawing = False
             if not wx.Platform == "__WXMAC__":
                 self.highlighted_notes = None
 
-    def Draw(self):
-        dc = wx.BufferedDC(None, self.renderer.buffer)
-        if not WX4:
-            dc.BeginDrawing()
-        try:
-            dc.SetBackground(wx.WHITE_BRUSH)
-            dc.Clear()
-            self.draw_drag_rect(dc)
-            if self.current_page != self.renderer.empty_page:
-                self.renderer.draw(page=self.current_page, clear_background=False, dc=dc)
-        except Exception as e:
-            error_msg = traceback.format_exc()
-            print('Warning: ' + error_msg)
-        finally:
-            if not WX4:
-                dc.EndDrawing()
-
-
-
+    def draw_tiles(self, dc, update_rect):
+        page = self.current_page
+        renderer = self.renderer
+        x, y, width, height = update_rect
+        key = (page.serial_number, renderer.zoom)
+        tile_width, tile_height = self.tile_width, self.tile_height
+        tile_indices = [(col, row) for row in range(max(y, 0) // tile_height, (y + height - 1) // tile_height + 1)
+                                   for col in range(max(x, 0) // tile_width, (x + width - 1) // tile_width + 1)]
+        for col, row in tile_indices:
+            tile_key = key + (col, row)
+            bitmap = self.tile_cache.get(tile_key)
+            if bitmap is None:
+                try:
+                    bitmap = renderer.draw_tile(page, col * tile_width, row * tile_height, tile_width, tile_height)
+                except Exception:
+                    error_msg = traceback.format_exc()
+                    print('Warning: ' + error_msg)
+                    continue
+                self.tile_cache.put(tile_key, bitmap, keep_count=len(tile_indices))
+            dc.DrawBitmap(bitmap, col * tile_width, row * tile_height)
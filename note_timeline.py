@@ -0,0 +1,244 @@
+import sys
+import itertools
+from bisect import bisect_right
+from collections import namedtuple, defaultdict
+from heapq import heappush, heappop
+
+if sys.version_info >= (3,0,0):
+    max_int = sys.maxsize
+else:
+    max_int = sys.maxint
+
+MidiNote = namedtuple('MidiNote', 'start stop indices page svg_row')
+
+
+class NoteTimeline(object):
+    """ The time slices of a played tune, sorted by start time.
+
+        The start and stop times are kept in separate lists as well so the time slice that is played
+        at a certain offset can be found with a binary search instead of walking through all slices.
+    """
+    def __init__(self, time_slices):
+        self.time_slices = time_slices
+        self.starts = [t.start for t in time_slices]
+        self.stops = [t.stop for t in time_slices]
+
+    def __len__(self):
+        return len(self.time_slices)
+
+    def __iter__(self):
+        return iter(self.time_slices)
+
+    def __getitem__(self, index):
+        return self.time_slices[index]
+
+    def index_at(self, offset):
+        """ Returns the index of the time slice that is played at offset or -1 if there is none """
+        i = bisect_right(self.starts, offset) - 1
+        if i >= 0 and offset < self.stops[i]:
+            return i
+        return -1
+
+    def scaled(self, factor):
+        """ Returns a copy of the timeline with all times multiplied by factor """
+        def scale(t):
+            if t == max_int or t == -max_int:
+                return t
+            return int(t * factor)
+        return NoteTimeline([t._replace(start=scale(t.start), stop=scale(t.stop)) for t in self.time_slices])
+
+    def slice_at(self, offset):
+        """ Returns the time slice that is played at offset or None if there is none """
+        i = self.index_at(offset)
+        if i >= 0:
+            return self.time_slices[i]
+        return None
+
+
+def fill_time_gaps(time_slices):
+    gaps = []
+    last_stop = 0
+    for time_slice in time_slices:
+        if time_slice.start > last_stop:
+            gaps.append(MidiNote(last_stop, time_slice.start, set(), time_slice.page, time_slice.svg_row))
+        last_stop = time_slice.stop
+
+    if gaps:
+        time_slices += gaps
+        time_slices.sort(key=lambda n: n.start)
+
+    time_slices.insert(0, MidiNote(-max_int, 0, set(), 0, 0))
+    last_page = time_slices[-1].page
+    svg_row = time_slices[-1].svg_row
+    time_slices.append(MidiNote(last_stop, max_int, set(), last_page, svg_row))
+    return NoteTimeline(time_slices)
+
+def group_notes_by_time(notes):
+    """ Splits the played notes into time slices during which the same notes sound.
+
+        The notes are swept in order of their start time while a heap keeps the sounding notes in order
+        of their stop time. The indices and svg rows of the sounding notes are counted, so they are updated
+        per started or stopped note instead of being collected again for every time slice.
+    """
+    notes.sort(key=lambda n: n.start)
+    note_count = len(notes)
+    time_slices = []
+    active_notes = []  # heap of (stop, sequence_number, note)
+    sequence_numbers = itertools.count()
+    index_counts = defaultdict(int)
+    svg_row_counts = defaultdict(int)
+    time_stop = max_int
+    page = 0
+    i = 0
+
+    def add_note(note):
+        heappush(active_notes, (note.stop, next(sequence_numbers), note))
+        for index in note.indices:
+            index_counts[index] += 1
+        svg_row_counts[note.svg_row] += 1
+
+    def remove_note(note):
+        for index in note.indices:
+            count = index_counts[index] - 1
+            if count:
+                index_counts[index] = count
+            else:
+                del index_counts[index]
+        count = svg_row_counts[note.svg_row] - 1
+        if count:
+            svg_row_counts[note.svg_row] = count
+        else:
+            del svg_row_counts[note.svg_row]
+
+    while i < note_count or active_notes:
+        time_start = notes[i].start if i < note_count else max_int
+        if time_start <= time_stop:
+            j = i
+            while j < note_count and notes[j].start == time_start:
+                j += 1
+            same_note_start = notes[i:j]
+            i = j
+            time_stop = min(active_notes[0][0] if active_notes else max_int, notes[i].start if i < note_count else max_int)
+            if same_note_start:
+                time_stop = min(time_stop, min(n.stop for n in same_note_start))
+                new_page = max(n.page for n in same_note_start)
+                if active_notes and page >= new_page:
+                    new_page = page
+                elif active_notes:
+                    # prevent mingling of indices from different pages
+                    del active_notes[:]
+                    index_counts.clear()
+                    svg_row_counts.clear()
+                page = new_page
+                for note in same_note_start:
+                    if note.page == page:
+                        add_note(note)
+        else:
+            # a note stops before the next note starts
+            time_start, time_stop = time_stop, time_start
+            time_stop = min(time_stop, active_notes[0][0] if active_notes else max_int)
+
+        svg_row = min(svg_row_counts) if svg_row_counts else 0
+        time_slices.append(MidiNote(time_start, time_stop, set(index_counts), page, svg_row))
+
+        # removing stopped notes
+        while active_notes and active_notes[0][0] <= time_stop:
+            remove_note(heappop(active_notes)[2])
+
+    return fill_time_gaps(time_slices)
+
+
+def write_benchmark_midi(file_path, note_count=50000, voice_count=8, division=480):
+    """ Writes a midi file with a track per voice, where every note is preceded by controllers 110 to 114 with the
+        abc row and column of the note, like abc2midi -EA writes them for follow score """
+    import random
+    import struct
+    random.seed(note_count)
+
+    def var_len(value):
+        result = bytearray([value & 0x7F])
+        value >>= 7
+        while value:
+            result.insert(0, 0x80 | (value & 0x7F))
+            value >>= 7
+        return result
+
+    notes_per_voice = note_count // voice_count
+    data = bytearray(b'MThd') + struct.pack('>IHHH', 6, 1, voice_count, division)
+    for voice in range(voice_count):
+        track = bytearray()
+        if voice == 0:
+            track += bytearray([0, 0xFF, 0x51, 3, 0x07, 0xA1, 0x20])  # 120 bpm
+        channel = voice % 16
+        for n in range(notes_per_voice):
+            row, col = n // 16 + 1, (n % 16) * 4 + 1
+            for controller, value in ((110, row >> 14), (111, (row >> 7) & 0x7F), (112, row & 0x7F), (113, col >> 7), (114, col & 0x7F)):
+                track += bytearray([0, 0xB0, controller, value])
+            pitch = 48 + (voice * 5 + n) % 36
+            track += bytearray([0, 0x90 | channel, pitch, 80])
+            track += var_len(random.choice((120, 240, 240, 480, 720, 960))) + bytearray([0x80 | channel, pitch, 64])
+        track += bytearray([0, 0xFF, 0x2F, 0])
+        data += b'MTrk' + struct.pack('>I', len(track)) + track
+    with open(file_path, 'wb') as f:
+        f.write(bytes(data))
+
+
+def benchmark_grouping(note_count=50000, voice_count=8, repeat=3):
+    """ Prints how long the steps of making the follow score timeline take for a synthetic dense polyphonic midi file:
+        reading the events, pairing the note on and note off events (like MainFrame.extract_note_timings does, but
+        with an index per abc position instead of looking up the notes in the score) and group_notes_by_time """
+    import os
+    import shutil
+    import tempfile
+    import time
+    from midi_meta_data import midi_to_timeline_events, get_tempo_changes, ticks_to_milliseconds, TRACK_START, NOTE_ON, NOTE_OFF, SCORE_POSITION
+
+    def events_to_notes(division, events):
+        tempo_changes = get_tempo_changes(events, division)
+        position_indices = {}
+        notes = []
+        for event in events:
+            kind = event.kind
+            if kind == TRACK_START:
+                active_notes = {}
+                indices = set()
+                svg_row = 0
+            elif kind == SCORE_POSITION:
+                svg_row = event.value1
+                indices = position_indices.setdefault((event.track, event.value1, event.value2), {len(position_indices)})
+            elif kind == NOTE_ON or kind == NOTE_OFF:
+                converted_time = ticks_to_milliseconds(event.ticks, tempo_changes, division)
+                note_key = (event.channel, event.value1)
+                if kind == NOTE_ON:
+                    active_notes[note_key] = MidiNote(converted_time, None, indices, svg_row // 40, svg_row)
+                else:
+                    note_on = active_notes.pop(note_key, None)
+                    if note_on is not None:
+                        notes.append(MidiNote(note_on.start, converted_time, note_on.indices, note_on.page, note_on.svg_row))
+        return notes
+
+    work_dir = tempfile.mkdtemp(prefix='timeline_benchmark')
+    try:
+        midi_file = os.path.join(work_dir, 'benchmark.mid')
+        write_benchmark_midi(midi_file, note_count, voice_count)
+        timings = defaultdict(list)
+        for i in range(repeat):
+            start_time = time.time()
+            division, events = midi_to_timeline_events(midi_file)
+            timings['reading events'].append(time.time() - start_time)
+            start_time = time.time()
+            notes = events_to_notes(division, events)
+            timings['making notes'].append(time.time() - start_time)
+            start_time = time.time()
+            time_slices = group_notes_by_time(notes)
+            timings['grouping'].append(time.time() - start_time)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print('%d notes in %d voices: %d time slices' % (len(notes), voice_count, len(time_slices)))
+    for name in ('reading events', 'making notes', 'grouping'):
+        print('%-15s %.0f ms' % (name, min(timings[name]) * 1000))
+
+
+if __name__ == '__main__':
+    # python note_timeline.py [note_count]
+    benchmark_grouping(*[int(arg) for arg in sys.argv[1:2]])
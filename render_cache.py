@@ -0,0 +1,194 @@
+import os, os.path
+import sys
+import hashlib
+import shutil
+import subprocess
+import threading
+
+from utils import read_text_if_file_exists
+
+
+class RenderCache(object):
+    """ Persistent, content-addressed cache for files generated by external programs (like abcm2ps).
+
+        Every entry is a directory named after the hash of everything that influences the output.
+        The most recently used entries are kept; when the total size exceeds max_size the least
+        recently used entries are removed. The modification time of an entry directory is used
+        as its last access time, so the LRU order survives a restart of EasyABC.
+    """
+    def __init__(self, cache_dir, max_size=100 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        self.__sizes = None  # entry name -> size in bytes, read lazily from disk
+        self.__program_ids = {}
+        self.hits = 0
+        self.misses = 0
+
+    def program_identity(self, program_path):
+        """ Returns a text that changes whenever the given executable is replaced by another version """
+        if not program_path:
+            return ''
+        try:
+            st = os.stat(program_path)
+        except OSError:
+            return program_path
+        identity_key = (program_path, st.st_mtime, st.st_size)
+        identity = self.__program_ids.get(identity_key)
+        if identity is None:  # only ask for the version once per build of the program
+            identity = '%s|%s|%s|%s' % (program_path, st.st_mtime, st.st_size, get_program_version(program_path))
+            self.__program_ids[identity_key] = identity
+        return identity
+
+    def get_key(self, *args):
+        h = hashlib.sha1()
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = u'{0}'.format(arg).encode('utf-8')
+            h.update(arg)
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get_svg_key(self, abc_code, settings, with_annotations=True, one_file_per_page=True):
+        abcm2ps_path = settings.get('abcm2ps_path', '')
+        abcm2ps_format_path = settings.get('abcm2ps_format_path', '')
+        return self.get_key('svg', abc_code, self.program_identity(abcm2ps_path),
+                            read_text_if_file_exists(abcm2ps_format_path),
+                            settings.get('abcm2ps_extra_params', ''), with_annotations, one_file_per_page)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key):
+        return os.path.isdir(self.entry_path(key))
+
+    def get(self, key, target_files_for_count):
+        """ Copies the files of a cache entry to target files. Returns (files, message) or None if key is not cached.
+            target_files_for_count is called with the number of files in the entry and should return the target paths """
+        with self.lock:
+            path = self.entry_path(key)
+            try:
+                names = sorted(f for f in os.listdir(path) if f != 'message.txt')
+            except OSError:
+                self.misses += 1
+                return None
+            message = read_text_if_file_exists(os.path.join(path, 'message.txt')) or b''
+            target_files = target_files_for_count(len(names))
+            try:
+                for name, target in zip(names, target_files):
+                    shutil.copyfile(os.path.join(path, name), target)
+                os.utime(path, None)  # mark as most recently used
+            except (IOError, OSError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return target_files, message.decode('utf-8')
+
+    def put(self, key, files, message=u''):
+        """ Stores copies of the given files (in this order) with the message under the given key """
+        if not files or self.max_size <= 0:
+            return
+        with self.lock:
+            path = self.entry_path(key)
+            if os.path.isdir(path):
+                return
+            temp_path = path + '.tmp'
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                shutil.rmtree(temp_path, ignore_errors=True)
+                os.mkdir(temp_path)
+                for i, f in enumerate(files):
+                    shutil.copyfile(f, os.path.join(temp_path, '%.3d%s' % (i + 1, os.path.splitext(f)[1])))
+                with open(os.path.join(temp_path, 'message.txt'), 'wb') as f:
+                    f.write((message or u'').encode('utf-8'))
+                os.rename(temp_path, path)
+            except (IOError, OSError):
+                shutil.rmtree(temp_path, ignore_errors=True)
+                return
+            sizes = self.get_sizes()
+            sizes[key] = get_dir_size(path)
+            self.evict()
+
+    def get_sizes(self):
+        if self.__sizes is None:
+            self.__sizes = {}
+            if os.path.isdir(self.cache_dir):
+                for name in os.listdir(self.cache_dir):
+                    path = self.entry_path(name)
+                    if name.endswith('.tmp'):
+                        shutil.rmtree(path, ignore_errors=True)
+                    elif os.path.isdir(path):
+                        self.__sizes[name] = get_dir_size(path)
+        return self.__sizes
+
+    @property
+    def total_size(self):
+        with self.lock:
+            return sum(self.get_sizes().values())
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in max_size """
+        with self.lock:
+            sizes = self.get_sizes()
+            total_size = sum(sizes.values())
+            if total_size <= self.max_size:
+                return
+
+            def last_used(name):
+                try:
+                    return os.path.getmtime(self.entry_path(name))
+                except OSError:
+                    return 0
+
+            for name in sorted(sizes, key=last_used):
+                if total_size <= self.max_size:
+                    break
+                shutil.rmtree(self.entry_path(name), ignore_errors=True)
+                total_size -= sizes.pop(name)
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            self.__sizes = None
+
+
+def get_dir_size(path):
+    total = 0
+    for f in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, f))
+        except OSError:
+            pass
+    return total
+
+
+def get_program_version(program_path):
+    """ Returns the first line that the program writes when asked for its version (abcm2ps -V) """
+    version = ''
+    creationflags = 0
+    if sys.platform == 'win32':
+        creationflags = 0x08000000  # CREATE_NO_WINDOW
+    try:
+        process = subprocess.Popen([program_path, '-V'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, creationflags=creationflags)
+        stdout_value, _ = process.communicate(b'')
+        lines = stdout_value.decode('utf-8', 'replace').strip().splitlines()
+        if lines:
+            version = lines[0]
+    except (OSError, ValueError):
+        pass
+    return version
+
+
+_render_caches = {}
+_render_caches_lock = threading.Lock()
+def get_render_cache(cache_dir, max_size):
+    """ Returns the shared render cache for the given directory, so all threads use the same lock """
+    cache_dir = os.path.abspath(cache_dir)
+    with _render_caches_lock:
+        cache = _render_caches.get(cache_dir)
+        if cache is None:
+            cache = _render_caches[cache_dir] = RenderCache(cache_dir, max_size)
+        else:
+            cache.max_size = max_size
+    return cache
@@ -0,0 +1,247 @@
+import os, os.path
+import sys
+import shutil
+import subprocess
+import threading
+import time
+
+creationflags = 0
+if sys.platform == 'win32':
+    creationflags = 0x08000000  # CREATE_NO_WINDOW
+
+
+class Abcm2psRenderServer(object):
+    """ Keeps abcm2ps processes started and waiting for input, so a render does not have to wait for
+        abcm2ps to start and load its format files.
+
+        A warm process is started with the complete command line except for the abc code, which it
+        reads from stdin. It runs in the same directory as a one-shot abcm2ps would, so relative paths
+        (like %%abc-include and %%format) give the same result, but every warm process writes its svg
+        files (-O) in its own directory. Afterwards the svg files are moved to the requested file names. Because the command line is fixed when a process is started,
+        warm processes are only used when the command line and the files it depends on (abcm2ps itself
+        and the format file) have not changed. Otherwise, or if abcm2ps does not wait for input on stdin,
+        render returns None and the caller should run abcm2ps the usual way.
+    """
+    output_name = 'out.svg'
+
+    def __init__(self, work_dir, worker_count=1):
+        self.work_dir = work_dir
+        self.worker_count = worker_count
+        self.lock = threading.Lock()
+        self.signature = None
+        self.idle_workers = []  # (process, worker_dir)
+        self.next_worker_number = 0
+        self.starting_worker_count = 0  # processes that are being started without holding the lock
+        self.fill_thread = None  # starts the replacement workers in the background
+        self.supported = True
+        self.warm_renders = 0
+        self.cold_renders = 0
+
+    def get_signature(self, cmd, cwd, cwd_independent_args):
+        identity = []
+        for path in cwd_independent_args:
+            try:
+                st = os.stat(os.path.join(cwd or '', path))
+                identity.append((path, st.st_mtime, st.st_size))
+            except OSError:
+                identity.append((path, None, None))
+        return (tuple(cmd), cwd, tuple(identity))
+
+    def render(self, cmd, input_abc, svg_file, dependencies=(), cwd=None):
+        """ Runs abcm2ps command cmd (which has '-O', os.path.basename(svg_file)) on input_abc using a warm process.
+            dependencies are files that abcm2ps reads at start (like the format file), cwd is the directory
+            the command would run in without a warm process.
+            Returns (stdout_value, stderr_value, returncode) as bytes or None if no warm process could be used. """
+        if not self.supported or self.worker_count <= 0:
+            return None
+        try:
+            output_index = cmd.index('-O') + 1
+        except ValueError:
+            return None
+        worker_cmd = list(cmd)
+        worker_cmd[output_index] = self.output_name
+        signature = self.get_signature(worker_cmd, cwd, [cmd[0]] + list(dependencies))
+
+        with self.lock:
+            if signature != self.signature:
+                self.stop_idle_workers()
+                self.signature = signature
+            worker = None
+            while self.idle_workers and worker is None:
+                process, worker_dir = self.idle_workers.pop(0)
+                if process.poll() is None:
+                    worker = (process, worker_dir)
+                elif not os.listdir(worker_dir):
+                    # it stopped before getting any input, so this abcm2ps can not be kept waiting
+                    self.supported = False
+                    self.stop_idle_workers()
+                    shutil.rmtree(worker_dir, ignore_errors=True)
+                    return None
+                else:
+                    shutil.rmtree(worker_dir, ignore_errors=True)
+
+        if worker is None:
+            # nothing was warmed up for this command line yet, start one for the next render
+            self.cold_renders += 1
+            self.start_filling_idle_workers(signature, worker_cmd, cwd)
+            return None
+
+        process, worker_dir = worker
+        try:
+            stdout_value, stderr_value = process.communicate(input_abc)
+            self.move_output_files(worker_dir, svg_file)
+        finally:
+            shutil.rmtree(worker_dir, ignore_errors=True)
+        self.warm_renders += 1
+        self.start_filling_idle_workers(signature, worker_cmd, cwd)
+        return stdout_value, stderr_value, process.returncode
+
+    def move_output_files(self, worker_dir, svg_file):
+        output_stem = os.path.splitext(self.output_name)[0]
+        target_dir = os.path.dirname(svg_file)
+        target_stem = os.path.splitext(os.path.basename(svg_file))[0]
+        for file_name in os.listdir(worker_dir):
+            if file_name.startswith(output_stem):
+                target = os.path.join(target_dir, target_stem + file_name[len(output_stem):])
+                if os.path.exists(target):
+                    os.remove(target)
+                shutil.move(os.path.join(worker_dir, file_name), target)
+
+    def start_filling_idle_workers(self, signature, worker_cmd, cwd):
+        """ Starts the replacement workers in a background thread, so starting a process (which is slow on
+            Windows) does not delay the render that is returned now """
+        thread = threading.Thread(target=self.fill_idle_workers, args=(signature, worker_cmd, cwd))
+        thread.daemon = True
+        self.fill_thread = thread
+        thread.start()
+
+    def wait_for_idle_workers(self):
+        """ Waits until the workers that are being started in the background are waiting for input """
+        thread = self.fill_thread
+        if thread is not None:
+            thread.join()
+
+    def fill_idle_workers(self, signature, worker_cmd, cwd):
+        """ Starts processes until worker_count workers are waiting. The lock is only held to reserve a worker and to
+            add it, so a render does not have to wait until a process has started """
+        while True:
+            with self.lock:
+                if self.signature != signature or not self.supported or \
+                        len(self.idle_workers) + self.starting_worker_count >= self.worker_count:
+                    return
+                self.starting_worker_count += 1
+                worker_dir = os.path.join(self.work_dir, 'worker%03d' % self.next_worker_number)
+                self.next_worker_number = (self.next_worker_number + 1) % 1000
+            process = self.start_worker(worker_cmd, worker_dir, cwd)
+            with self.lock:
+                self.starting_worker_count -= 1
+                if process is None:
+                    self.supported = False
+                    return
+                if self.signature == signature:
+                    self.idle_workers.append((process, worker_dir))
+                    continue
+            # the command line changed while the process was starting
+            self.stop_worker(process, worker_dir)
+            return
+
+    def start_worker(self, worker_cmd, worker_dir, cwd):
+        """ Returns a started abcm2ps that writes in worker_dir and waits for input or None if it could not be started """
+        shutil.rmtree(worker_dir, ignore_errors=True)
+        cmd = list(worker_cmd)
+        cmd[cmd.index('-O') + 1] = os.path.join(worker_dir, self.output_name)
+        try:
+            os.makedirs(worker_dir)
+            return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    creationflags=creationflags, cwd=cwd)
+        except (OSError, ValueError):
+            shutil.rmtree(worker_dir, ignore_errors=True)
+            return None
+
+    def stop_worker(self, process, worker_dir):
+        try:
+            process.kill()
+            process.communicate()
+        except OSError:
+            pass
+        shutil.rmtree(worker_dir, ignore_errors=True)
+
+    def stop_idle_workers(self):
+        """ Should be called with self.lock acquired """
+        for process, worker_dir in self.idle_workers:
+            self.stop_worker(process, worker_dir)
+        self.idle_workers = []
+
+    def shutdown(self):
+        with self.lock:
+            self.stop_idle_workers()
+            self.signature = None
+
+
+_render_servers = {}
+_render_servers_lock = threading.Lock()
+def get_abcm2ps_render_server(work_dir, worker_count):
+    """ Returns the shared render server for the given directory """
+    work_dir = os.path.abspath(work_dir)
+    with _render_servers_lock:
+        server = _render_servers.get(work_dir)
+        if server is None:
+            server = _render_servers[work_dir] = Abcm2psRenderServer(work_dir, worker_count)
+        else:
+            server.worker_count = worker_count
+    return server
+
+def shutdown_render_servers():
+    with _render_servers_lock:
+        for server in _render_servers.values():
+            server.shutdown()
+
+
+def benchmark(abcm2ps_path, abc_code, repeat=20):
+    """ Prints the latency of rendering abc_code with a new abcm2ps process per render and with a warm process """
+    import tempfile
+    work_dir = tempfile.mkdtemp(prefix='abcm2ps_benchmark')
+    try:
+        svg_file = os.path.join(work_dir, 'bench.svg')
+        cmd = [abcm2ps_path, '-', '-O', os.path.basename(svg_file), '-v', '-A']
+        input_abc = (abc_code + os.linesep * 2).encode('utf-8')
+
+        def one_shot():
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       creationflags=creationflags, cwd=work_dir)
+            process.communicate(input_abc)
+
+        server = Abcm2psRenderServer(os.path.join(work_dir, 'workers'))
+        server.render(cmd, input_abc, svg_file, cwd=work_dir)  # warm up
+        server.wait_for_idle_workers()
+
+        def warm():
+            if server.render(cmd, input_abc, svg_file, cwd=work_dir) is None:
+                raise Exception('abcm2ps does not support warm processes')
+
+        for name, func in [('one-shot', one_shot), ('warm', warm)]:
+            timings = []
+            for i in range(repeat):
+                start_time = time.time()
+                func()
+                timings.append(time.time() - start_time)
+                time.sleep(0.05)  # like a user typing
+                server.wait_for_idle_workers()  # only measure the render itself, not starting the next warm process
+            timings.sort()
+            print('%-8s median %.1f ms, best %.1f ms' % (name, timings[len(timings) // 2] * 1000, timings[0] * 1000))
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # python render_server.py path/to/abcm2ps [tune.abc]
+    if len(sys.argv) < 2:
+        print('usage: python render_server.py abcm2ps_path [abc_file]')
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'rb') as f:
+            abc = f.read().decode('utf-8', 'replace')
+    else:
+        abc = 'X:1\nT:Benchmark\nM:4/4\nL:1/8\nK:G\n|:GABc dedB|dedB dedB|c2ec B2dB|c2A2 A2BA:|\n'
+    benchmark(sys.argv[1], abc)
@@ -10,7 +10,9 @@
 # svg_to_page is called from render_page in UpdateMusicPane in easy_abc.py
 # This puts the contents of the svg files into a python dictionary called
 # self.page[page_index] and returns it to the variable page in UpdateMusicPane
-# in easy_abc.py. The second call to render.draw() is called indirectly from
+# in easy_abc.py. Normally the pages have already been parsed by parse_page
+# in the MusicUpdateThread, so the GUI thread only has to draw them.
+# The second call to render.draw() is called indirectly from
 # MusicScorePanel when an EVT_PAINT event is processed.
 #
 # page.notes[] (also called self.notes[] in  SvgPage) is used to match
@@ -24,6 +26,7 @@
 #import xml.etree.ElementTree
 import xml.etree.cElementTree as ET
 from collections import defaultdict, deque, namedtuple
+from itertools import count
 import re
 import wx
 from math import hypot, radians, sqrt, pi
@@ -32,6 +35,8 @@ from datetime import datetime
 from wxhelper import wx_colour, wx_bitmap
 import sys
 PY3 = sys.version_info.major > 2
+if PY3:
+    from sys import intern
 WX4 = wx.version().startswith('4')
 WX41 = WX4 and not wx.version().startswith('4.0')
 
@@ -73,12 +78,50 @@ def parse_css_props(props):
     return attributes
 
 
+no_attributes = {}  # shared by all elements without attributes, never modified
+
 class SvgElement(object):
-    def __init__(self, name, attributes, children):
+    """ An element of a parsed svg page. Attributes can be read like a dict (get, [] and in).
+
+        Only the attributes of the element itself are stored per element. The attributes that
+        are inherited from the parent elements are stored once per page in a shared table
+        (see SvgPage.get_inherited_attributes), so a page with thousands of elements
+        does not need a copy of all parent attributes for every element. """
+    __slots__ = ('name', 'own_attributes', 'inherited_attributes', 'children')
+
+    def __init__(self, name, own_attributes, children, inherited_attributes=no_attributes):
         self.name = name              # the name of the svg element (excluding the namespace), eg. 'g', 'circle', 'ellipse'
-        self.attributes = attributes
+        self.own_attributes = own_attributes or no_attributes
+        self.inherited_attributes = inherited_attributes
         self.children = children
 
+    def get(self, key, default=None):
+        own_attributes = self.own_attributes
+        if key in own_attributes:
+            return own_attributes[key]
+        return self.inherited_attributes.get(key, default)
+
+    def __getitem__(self, key):
+        own_attributes = self.own_attributes
+        if key in own_attributes:
+            return own_attributes[key]
+        return self.inherited_attributes[key]
+
+    def __contains__(self, key):
+        return key in self.own_attributes or key in self.inherited_attributes
+
+    def set(self, key, value):
+        if self.own_attributes is no_attributes:
+            self.own_attributes = {}
+        self.own_attributes[key] = value
+
+    @property
+    def attributes(self):
+        """ All attributes of the element in a new dict (slow, use get instead when drawing) """
+        attributes = dict(self.inherited_attributes)
+        attributes.update(self.own_attributes)
+        return attributes
+
     # 1.3.7.2 [JWDJ] not used
     # def tree_iter(self):
     #     yield self
@@ -99,10 +142,84 @@ class SvgElement(object):
 
 NoteData = namedtuple('NoteData', 'note_type row col x y width height')
 
+
+class NoteGrid(object):
+    """ Spatial index for the positions of the notes on a page (page.notes), so finding the notes near the
+        mouse or inside a selection rectangle only looks at a few grid cells instead of at all notes. """
+    def __init__(self, notes, cell_size=32):
+        self.notes = notes
+        self.cell_size = cell_size
+        cells = defaultdict(list)
+        for i, note in enumerate(notes):
+            cells[(int(note[0] // cell_size), int(note[1] // cell_size))].append(i) # indices stay in ascending order
+        self.cells = dict(cells)
+        if cells:
+            self.min_col = min(col for col, row in cells)
+            self.max_col = max(col for col, row in cells)
+            self.min_row = min(row for col, row in cells)
+            self.max_row = max(row for col, row in cells)
+
+    def indices_in_rect(self, x1, y1, x2, y2):
+        """ Returns the indices of the notes in the cells that overlap the rectangle (so also some outside of it) """
+        if not self.cells:
+            return []
+        cell_size = self.cell_size
+        get_cell = self.cells.get
+        result = []
+        for col in range(max(int(x1 // cell_size), self.min_col), min(int(x2 // cell_size), self.max_col) + 1):
+            for row in range(max(int(y1 // cell_size), self.min_row), min(int(y2 // cell_size), self.max_row) + 1):
+                result.extend(get_cell((col, row), ()))
+        return result
+
+    def first_within(self, x, y, distance):
+        """ Returns the lowest index of the notes closer than distance to (x, y) or None """
+        notes = self.notes
+        hits = [i for i in self.indices_in_rect(x - distance, y - distance, x + distance, y + distance)
+                if hypot(x - notes[i][0], y - notes[i][1]) < distance]
+        if hits:
+            return min(hits)
+        return None
+
+    def closest(self, x, y):
+        """ Returns the index of the note closest to (x, y), the lowest index if several are equally close """
+        if not self.cells:
+            return None
+        notes = self.notes
+        cell_size = self.cell_size
+        col, row = int(x // cell_size), int(y // cell_size)
+        max_radius = max(abs(col - self.min_col), abs(col - self.max_col), abs(row - self.min_row), abs(row - self.max_row))
+        get_cell = self.cells.get
+        best = None
+        for radius in range(max_radius + 1):
+            # visit the ring of cells at this distance (in cells) around the cell that contains (x, y)
+            for c in range(col - radius, col + radius + 1):
+                if radius == 0 or c in (col - radius, col + radius):
+                    rows = range(row - radius, row + radius + 1)
+                else:
+                    rows = (row - radius, row + radius)
+                for r in rows:
+                    for i in get_cell((c, r), ()):
+                        candidate = (hypot(x - notes[i][0], y - notes[i][1]), i)
+                        if best is None or candidate < best:
+                            best = candidate
+            # notes in cells further away are at least radius * cell_size away
+            if best is not None and best[0] < radius * cell_size:
+                break
+        return best[1]
+
+
+page_serial_numbers = count() # unique per page, unlike id() which is reused after a page is freed
+
 class SvgPage(object):
     def __init__(self, renderer, svg):
         self.renderer = renderer
-        self.svg = svg
+        self.serial_number = next(page_serial_numbers)
+        self.layout_key = None # renderer and zoom for which notes and note_draw_info are valid
+        self.note_draw_info = []
+        self.note_rects = {} # note index -> area covered by the note, valid for note_rects_key
+        self.note_rects_key = None
+        self.element_bounds = {} # element id -> bounds of element in its own coordinates
+        self.content_bounds = {} # id() of element -> bounds of its content, see SvgRenderer.get_content_bounds
         self.svg_width, self.svg_height = 0.0, 0.0
         self.id_to_element = {}
         self.base_color = 'black'
@@ -110,6 +227,7 @@ class SvgPage(object):
         self.notes_row_col = []
         self.notes_in_row = None
         self.selected_indices = set()
+        self.__note_grid = None
         self.scale = 1.0
         self.index = -1
         children = []
@@ -136,11 +254,13 @@ class SvgPage(object):
             self.base_color = svg.attrib.get('color', self.base_color)
             self.id_to_element = {}
             self.class_attributes = {}
+            self.inherited_attributes_table = {}
             self.notes_in_row = defaultdict(list) # 1.3.6.3 [JWDJ] contains for each row of abctext note information
-            children = [c for c in self.parse_elements(svg, {}) if c.name not in ['defs', 'style']]
+            children = [c for c in self.parse_elements(svg, no_attributes) if c.name not in ['defs', 'style']]
+            self.inherited_attributes_table = None # only needed while parsing
 
         self.indices_per_row_col = self.group_note_indices(self.notes_row_col)
-        self.root_group = SvgElement('g', {}, children)
+        self.root_group = SvgElement('g', no_attributes, children)
 
     def clear_notes(self):
         self.notes = []
@@ -151,8 +271,30 @@ class SvgPage(object):
             indices_per_row_col[abc_row][abc_col].add(i)
         return indices_per_row_col
 
-    def parse_attributes(self, element, parent_attributes):
-        attributes = parent_attributes.copy()
+    def parse_attributes(self, element):
+        """ Returns the attributes of the element itself, including those of its css class and style """
+        element_attributes = element.attrib
+        if not element_attributes:
+            return no_attributes
+        class_name = element_attributes.get('class')
+        style = element_attributes.get('style')
+        if not class_name and not style:
+            return element_attributes  # the element tree is discarded after parsing, so no need to copy
+
+        attributes = {}
+        if class_name:
+            attributes.update(self.class_attributes.get(class_name, no_attributes))
+        # 1.3.6.5 [JWdJ] 2015-11-05 added parsing style property
+        if style:
+            attributes.update(parse_css_props(style))
+        attributes.update(element_attributes)
+        return attributes
+
+    def get_inherited_attributes(self, parent_inherited_attributes, parent_attributes):
+        """ Returns the attributes that the children of an element inherit. Equal sets of
+            inherited attributes are shared between elements via inherited_attributes_table """
+        attributes = dict(parent_inherited_attributes)
+        attributes.update(parent_attributes)
         if 'transform' in attributes:  # don't inherit transform
             transform = attributes.get('transform')
             m = self.renderer.scale_re.match(transform)
@@ -165,45 +307,43 @@ class SvgPage(object):
             del attributes['transform']
         if 'desc' in attributes:  # don't inherit desc
             del attributes['desc']
-        class_name = element.attrib.get('class')
-        if class_name:
-            class_attr = self.class_attributes.get(class_name, {})
-            attributes.update(class_attr)
-        # 1.3.6.5 [JWdJ] 2015-11-05 added parsing style property
-        style = element.attrib.get('style')
-        if style:
-            attributes.update(parse_css_props(style))
-        attributes.update(element.attrib)
-        return attributes
+        if not attributes:
+            return no_attributes
+        key = frozenset(attributes.items())
+        shared_attributes = self.inherited_attributes_table.get(key)
+        if shared_attributes is None:
+            shared_attributes = self.inherited_attributes_table[key] = attributes
+        return shared_attributes
 
     def parse_css(self, css):
         # css = css_comment_re.sub(css, '') # remove comments
         for match in css_class_re.finditer(css):
             class_name = match.group('class')
             props = match.group('props')
-            self.class_attributes[class_name] = parse_css_props(props)
+            # interned because the values are shared by many elements and inherited attribute tables
+            self.class_attributes[class_name] = dict((intern(k), intern(v)) for k, v in parse_css_props(props).items())
 
-    def parse_elements(self, elements, parent_attributes):
+    def parse_elements(self, elements, inherited_attributes):
         result = []
         last_e_use = []
         elementnames_with_children = ['g', 'defs']
         no_children = ()
         notes_row_col_append = self.notes_row_col.append
         for element in elements:
-            name = element.tag.replace(svg_ns, '')
-            attributes = self.parse_attributes(element, parent_attributes)
+            name = intern(element.tag.replace(svg_ns, ''))
+            attributes = self.parse_attributes(element)
             if name in elementnames_with_children:
                 # 1.3.6.3 [JWDJ] 2015-3 use list(element) because getchildren is deprecated
-                children = self.parse_elements(list(element), attributes)
+                children = self.parse_elements(list(element), self.get_inherited_attributes(inherited_attributes, attributes))
             else:
                 children = no_children
 
-            if name == 'style' and attributes.get('type') == 'text/css':
+            if name == 'style' and (attributes.get('type') or inherited_attributes.get('type')) == 'text/css':
                 self.parse_css(element.text)
             elif name == 'abc':
                 note_type = element.get('type')
                 row, col = int(element.get('row')), int(element.get('col'))
-                scale = attributes.get('parent_scale', 1.0)
+                scale = inherited_attributes.get('parent_scale', 1.0)
                 if scale:
                     self.scale = scale # JWDJ: older version of abcm2ps use page scaling of 0.75
 
@@ -216,11 +356,11 @@ class SvgPage(object):
                     last_row_col = (row, col)
                     desc = (note_type, row, col, x, y, width, height)
                     for e_use in last_e_use:
-                        e_use.attributes['desc'] = desc
+                        e_use.set('desc', desc)
                         notes_row_col_append(last_row_col)
                 last_e_use = []
             else:
-                svg_element = SvgElement(name, attributes, children)
+                svg_element = SvgElement(name, attributes, children, inherited_attributes)
                 element_id = element.attrib.get('id')
                 if element_id:
                     self.id_to_element[element_id] = svg_element
@@ -228,7 +368,7 @@ class SvgPage(object):
                     # 1.3.6.3 [JWDJ] 2015-3 fixes !sfz! (z in sfz was missing)
                     text = u''.join(element.itertext())
                     text = text.replace('\n', '')
-                    svg_element.attributes['text'] = text
+                    svg_element.set('text', text)
                 elif name == 'use': # 1.3.7.0 [JWDJ] 2016-01-05 all use-elements without id attribute belong to abc-note
                     href = element.get(href_tag)
                     if href not in ['#hl', '#hl1', '#mrest']: # leave out horizontal lines through notes above and below the stafflines (and measure rest too since abcm2ps does not add abc tag for measure rest)
@@ -236,19 +376,21 @@ class SvgPage(object):
                 result.append(svg_element)
         return result
 
+    @property
+    def note_grid(self):
+        # page.notes is replaced by a new list when the page is drawn, so then the grid is rebuilt
+        if self.__note_grid is None or self.__note_grid.notes is not self.notes:
+            self.__note_grid = NoteGrid(self.notes)
+        return self.__note_grid
+
     def hit_test(self, x, y, return_closest_hit=False):
-        calc_dist = hypot
-        hit_distance = 9 * self.scale
         if return_closest_hit:
             if not self.notes:
                 return None
-            def calc_dist_key(k):
-                return calc_dist(x - k[1][0], y - k[1][1])
-            index, note = min(enumerate(self.notes), key=calc_dist_key)
-            return index
+            return self.note_grid.closest(x, y)
             #return min(enumerate(self.notes), key=lambda k: calc_dist(x - k[1][0], y - k[1][1]))[0]  # [0] is the index generated by enumerate()
         else:
-            return next((i for i, (xpos, ypos, abc_row, abc_col, desc) in enumerate(self.notes) if calc_dist(x - xpos, y - ypos) < hit_distance), None)
+            return self.note_grid.first_within(x, y, 9 * self.scale)
         # min_dist = 9999999
         # closest_i = None
         # for i, (xpos, ypos, abc_row, abc_col, desc) in enumerate(self.notes):
@@ -265,9 +407,13 @@ class SvgPage(object):
 
     def select_notes(self, selection_rect):
         in_selection = selection_rect.Contains
+        notes = self.notes
+        candidates = self.note_grid.indices_in_rect(selection_rect.GetX(), selection_rect.GetY(),
+                                                    selection_rect.GetX() + selection_rect.GetWidth(),
+                                                    selection_rect.GetY() + selection_rect.GetHeight())
         #FAU wx.Rect Contains needs integer as coordinates
         #selected_offsets = set((abc_row, abc_col) for (x, y, abc_row, abc_col, desc) in self.notes if in_selection((x, y)))
-        selected_offsets = set((abc_row, abc_col) for (x, y, abc_row, abc_col, desc) in self.notes if in_selection((int(x), int(y))))
+        selected_offsets = set((notes[i][2], notes[i][3]) for i in candidates if in_selection((int(notes[i][0]), int(notes[i][1]))))
         list_of_sets = [self.indices_per_row_col[row][col] for row, col in selected_offsets]
         selected_indices = set().union(*list_of_sets)
         if selected_indices:
@@ -290,6 +436,9 @@ class SvgPage(object):
     def draw(self, clear_background=True, dc=None):
         self.renderer.draw(self, clear_background, dc)
 
+    def layout(self):
+        self.renderer.layout(self)
+
 
 class SvgRenderer(object):
     def __init__(self, can_draw_sharps_and_flats, highlight_color, highlight_follow_color = None):
@@ -321,6 +470,8 @@ class SvgRenderer(object):
             self.highlight_follow_color = highlight_color
         self.highlight_follow = False
         self.default_transform = None
+        self.clip_rect = None # (left, top, right, bottom) in device coordinates, elements outside of it are skipped
+        self.positions_only = False # only determine the positions of the notes, do not draw
         #self.update_buffer(self.empty_page)
         if wx.Platform == "__WXMAC__":
             self.transform_point = self.transform_point_osx
@@ -363,11 +514,14 @@ class SvgRenderer(object):
             #print 'create new buffer!!!!!!!!', (width, height)
             self.buffer = wx_bitmap(width, height, 32)
 
+    def parse_page(self, svg):
+        # does not touch the buffer, so can be called from another thread than the GUI thread
+        svg_xml = ET.fromstring(svg) # parse xml
+        return SvgPage(self, svg_xml)
+
     def svg_to_page(self, svg):
         try:
-            svg_xml = ET.fromstring(svg) # parse xml
-            page = SvgPage(self, svg_xml)
-            return page
+            return self.parse_page(svg)
         except:
             # print('warning: %s' % traceback.print_exc())
             self.clear()
@@ -421,13 +575,7 @@ class SvgRenderer(object):
         #gc.Translate(0, h) # for simulating OSX
         #gc.Scale(1, -1) # for simulating OSX
 
-        self.default_transform = gc.GetTransform()
-        page.clear_notes()
-        page.note_draw_info = []
-        gc.PushState()
-        gc.Scale(self.zoom, self.zoom)
-        self.draw_svg_element(page, gc, page.root_group, False, page.base_color, {})
-        gc.PopState()
+        self.draw_page(page, gc)
 
         # in order to reveal all the sensitive areas in the music pane,
         # change False to True in the next line.
@@ -442,6 +590,138 @@ class SvgRenderer(object):
                 gc.DrawRoundedRectangle(x-6, y-6, 12, 12, 4)
             gc.PopState()
 
+    def draw_page(self, page, gc):
+        """ Draws the page and fills page.notes and page.note_draw_info with the positions of the notes """
+        self.default_transform = gc.GetTransform()
+        page.clear_notes()
+        page.note_draw_info = []
+        gc.PushState()
+        gc.Scale(self.zoom, self.zoom)
+        self.draw_svg_element(page, gc, page.root_group, False, page.base_color, {})
+        gc.PopState()
+        page.layout_key = (id(self), self.zoom)
+
+    def layout(self, page):
+        """ Determines the positions of the notes at the current zoom, needed for selecting and highlighting
+            notes. Nothing is drawn and nothing is done if the positions are already known. """
+        if page.layout_key == (id(self), self.zoom):
+            return
+        bitmap = wx_bitmap(1, 1, 32)
+        dc = wx.MemoryDC(bitmap)
+        gc = wx.GraphicsContext.Create(dc)
+        self.positions_only = True
+        try:
+            self.draw_page(page, gc)
+        finally:
+            self.positions_only = False
+        del gc
+        dc.SelectObject(wx.NullBitmap)
+
+    def draw_tile(self, page, x, y, width, height):
+        """ Returns a bitmap of the given part of the page, where x and y are in zoomed coordinates.
+            The note positions of the page are left alone, use layout for those. """
+        bitmap = wx_bitmap(width, height, 32)
+        dc = wx.MemoryDC(bitmap)
+        dc.SetBackground(wx.WHITE_BRUSH)
+        dc.Clear()
+        if x < page.svg_width * self.zoom and y < page.svg_height * self.zoom:
+            gc = wx.GraphicsContext.Create(dc)
+            gc.Clip(0, 0, width, height)
+            gc.Translate(-x, -y)
+            # tiles never show the selection, selected notes are drawn on top of them with draw_notes
+            notes, note_draw_info, layout_key, selected_indices = page.notes, page.note_draw_info, page.layout_key, page.selected_indices
+            page.selected_indices = set()
+            # skip the elements that are not on the tile, otherwise every tile costs as much as the whole page
+            self.clip_rect = (0, 0, width, height)
+            try:
+                self.draw_page(page, gc)
+            finally:
+                self.clip_rect = None
+                page.notes, page.note_draw_info, page.layout_key, page.selected_indices = notes, note_draw_info, layout_key, selected_indices
+            del gc
+        dc.SelectObject(wx.NullBitmap)
+        return bitmap
+
+    def get_note_rect(self, page, note_index):
+        """ Returns the area (x, y, width, height) in zoomed page coordinates that a note covers, so
+            only that area needs to be repainted when the note is highlighted or unhighlighted """
+        if page.note_rects_key != page.layout_key:
+            page.note_rects = {}
+            page.note_rects_key = page.layout_key
+        rect = page.note_rects.get(note_index)
+        if rect is None:
+            element_id, current_color, matrix = page.note_draw_info[note_index]
+            user_x, user_y = page.notes[note_index][0:2] # position of the origin of the note element
+            bounds = page.element_bounds.get(element_id, False)
+            if bounds is False:
+                bounds = page.element_bounds[element_id] = self.get_element_bounds(page, page.id_to_element[element_id])
+            a, b, c, d = matrix[0:4]
+            scale_x, scale_y = hypot(a, b), hypot(c, d)
+            if bounds is None:
+                bounds = (-10, -10, 10, 10) # unknown shape, so assume it is about the size of a note head
+            x1, y1, x2, y2 = bounds
+            margin = 2 # for the width of lines and anti-aliasing
+            left, top = int(user_x + x1 * scale_x) - margin, int(user_y + y1 * scale_y) - margin
+            right, bottom = int(user_x + x2 * scale_x + 1) + margin, int(user_y + y2 * scale_y + 1) + margin
+            rect = page.note_rects[note_index] = (left, top, right - left, bottom - top)
+        return rect
+
+    def get_element_bounds(self, page, svg_element):
+        """ Returns (x1, y1, x2, y2) of the shape of an element in its own coordinates or None if not known """
+        if 'transform' in svg_element:
+            return None
+        return self.get_content_bounds(page, svg_element)
+
+    def get_content_bounds(self, page, svg_element):
+        """ Returns (x1, y1, x2, y2) of the shape of an element in the coordinates after its own transform,
+            so where its content is drawn, or None if not known """
+        key = id(svg_element)
+        bounds = page.content_bounds.get(key, False)
+        if bounds is False:
+            bounds = page.content_bounds[key] = self.calc_content_bounds(page, svg_element)
+        return bounds
+
+    def calc_content_bounds(self, page, svg_element):
+        name = svg_element.name
+        attr = svg_element
+        try:
+            if name == 'path':
+                box = self.parse_path(attr['d']).GetBox()
+                return (box.GetLeft(), box.GetTop(), box.GetRight(), box.GetBottom())
+            elif name == 'ellipse':
+                cx, cy, rx, ry = map(float, (attr.get('cx', 0), attr.get('cy', 0), attr['rx'], attr['ry']))
+                return (cx - rx, cy - ry, cx + rx, cy + ry + 0.5)
+            elif name == 'circle':
+                cx, cy, r = map(float, (attr.get('cx', 0), attr.get('cy', 0), attr['r']))
+                return (cx - r, cy - r, cx + r, cy + r)
+            elif name == 'use':
+                x, y = float(attr.get('x', 0)), float(attr.get('y', 0))
+                bounds = self.get_element_bounds(page, page.id_to_element[attr[href_tag][1:]])
+                if bounds:
+                    x1, y1, x2, y2 = bounds
+                    return (x1 + x, y1 + y, x2 + x, y2 + y)
+            elif name == 'g':
+                child_bounds = [self.get_element_bounds(page, child) for child in svg_element.children]
+                if child_bounds and None not in child_bounds:
+                    return (min(b[0] for b in child_bounds), min(b[1] for b in child_bounds),
+                            max(b[2] for b in child_bounds), max(b[3] for b in child_bounds))
+        except (KeyError, ValueError):
+            pass
+        return None
+
+    def is_outside_clip_rect(self, dc, bounds):
+        """ Returns True if bounds (in the current coordinates of dc) lie completely outside of clip_rect """
+        x1, y1, x2, y2 = bounds
+        xs, ys = zip(*[self.transform_point(dc, x, y) for x, y in ((x1, y1), (x2, y1), (x1, y2), (x2, y2))])
+        left, top, right, bottom = self.clip_rect
+        margin = 3 * self.zoom + 2 # for the width of lines and anti-aliasing
+        return max(xs) + margin < left or min(xs) - margin > right or max(ys) + margin < top or min(ys) - margin > bottom
+
+    def get_canvas_size(self, page):
+        if self.buffer:
+            return self.buffer.GetWidth(), self.buffer.GetHeight()
+        return page.svg_width * self.zoom, page.svg_height * self.zoom
+
     def parse_path(self, svg_path_str):
         ''' Translates the path data in the svg file to instructions for drawing
             on the music pane.
@@ -671,12 +951,23 @@ class SvgRenderer(object):
         if name == 'defs':
             return
 
-        attr = svg_element.attributes
+        attr = svg_element # SvgElement supports get and [] like a dict
         transform = attr.get('transform')
         if transform:
             dc.PushState()
             self.do_transform(dc, transform)
 
+        skip = False
+        if self.positions_only:
+            skip = name not in ('g', 'use') # only 'use' elements are notes
+        elif self.clip_rect is not None:
+            bounds = self.get_content_bounds(page, svg_element)
+            skip = bounds is not None and self.is_outside_clip_rect(dc, bounds)
+        if skip:
+            if transform:
+                dc.PopState()
+            return
+
         # 1.3.6.2 [JWdJ] 2015-02-12 Added voicecolor
         if name == 'g':
             style = attr.get('style')
@@ -868,7 +1159,7 @@ class SvgRenderer(object):
             if '%' in width:
                 # 1.3.6.2 [JWdJ] 2015-02-12 Added for %%bgcolor
                 if width == height == '100%':
-                    x, y, width, height = map(float, (0, 0, self.buffer.GetWidth(), self.buffer.GetHeight()))
+                    x, y, width, height = map(float, (0, 0) + tuple(self.get_canvas_size(page)))
                 else:
                     return
             else:
@@ -911,8 +1202,48 @@ class MyApp(wx.App):
 def matrix_to_str(m):
     return '(%s)' % ', '.join(['%.3f' % f for f in m.Get()])
 
+def count_elements(element):
+    return 1 + sum(count_elements(child) for child in element.children)
+
+
+def benchmark_parsing(svg_files, repeat=5):
+    """ Prints the time and memory needed to parse svg files into SvgPages.
+        Use the pages of a large score as corpus, for example the svg files that abcm2ps -g writes. """
+    import time
+    import tracemalloc
+    app = wx.App(False)
+    renderer = SvgRenderer(True, '#000000')
+    svgs = [open(f, 'rb').read() for f in svg_files]
+
+    best_time = None
+    for i in range(repeat):
+        start_time = time.time()
+        for svg in svgs:
+            renderer.parse_page(svg)
+        elapsed = time.time() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    pages = [renderer.parse_page(svg) for svg in svgs]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    element_count = sum(count_elements(page.root_group) for page in pages)
+    page_count = len(pages)
+    print('%d pages, %d elements' % (page_count, element_count))
+    print('parse time: %.1f ms per page' % (best_time * 1000.0 / page_count))
+    print('memory: %.1f kB per page, %.0f bytes per element' % ((after - before) / 1024.0 / page_count, float(after - before) / max(element_count, 1)))
+    del app
+
+
 if __name__ == "__main__":
     import os.path
+    if len(sys.argv) > 1:
+        # python svgrenderer.py page001.svg page002.svg ...
+        benchmark_parsing(sys.argv[1:])
+        sys.exit()
     app = MyApp(0)
 
     buffer = wx_bitmap(200, 200, 32)
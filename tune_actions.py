@@ -27,7 +27,7 @@ except ImportError:
 from fractions import Fraction
 from aligner import get_bar_length
 from generalmidi import general_midi_instruments
-from abc_tune import AbcTune, note_to_number, number_to_note
+from abc_tune import note_to_number, number_to_note
 from abc_character_encoding import unicode_text_to_abc
 
 if PY3:
@@ -1185,7 +1185,7 @@ class ChordNoteChangeAction(ValueChangeAction):
 
     def get_values(self, context):
         try:
-            (tonic, mode) = AbcTune(context.tune).initial_tonic_and_mode
+            (tonic, mode) = context.get_abc_tune().initial_tonic_and_mode
             i = KeyChangeAction.abc_key_to_number(tonic, mode) - 2 + len(key_ladder) // 2
         except:
             i = key_ladder.index('C')
@@ -1439,7 +1439,7 @@ class MidiGuitarChordChangeAction(ValueChangeAction):
 
     def get_values(self, context):
         try:
-            metre, default_len = AbcTune(context.tune_header).get_metre_and_default_length()
+            metre, default_len = context.get_abc_tune(TuneScope.TuneHeader).get_metre_and_default_length()
             if metre.numerator % 3 == 0:
                 return MidiGuitarChordChangeAction.values_odd
         except:
@@ -1855,8 +1855,7 @@ class AddBarAction(AbcAction):
         bar_re = re.compile(AbcBar.pattern)
         last_bar_offset = max([0] + [m.end(0) for m in bar_re.finditer(text)])  # offset of last bar symbol
         text = text[last_bar_offset:]  # the text from the last bar symbol up to the selection point
-        tune_upto_selection = context.get_scope_info(TuneScope.TuneUpToSelection).text
-        metre, default_len = AbcTune(tune_upto_selection).get_metre_and_default_length()
+        metre, default_len = context.get_abc_tune(TuneScope.TuneUpToSelection).get_metre_and_default_length()
 
         if re.match(r"^[XZ]\d*$", text):
             duration = metre
@@ -1909,13 +1908,13 @@ class ShowSingleVoiceAction(ValueChangeAction):
         self.show_current_value = True
 
     def get_values(self, context):
-        tune = AbcTune(context.tune)
+        tune = context.get_abc_tune()
         all_voices = tune.get_voice_ids()
         values = [ValueDescription(voice_id, voice_id) for voice_id in all_voices]
         return values
 
     def can_execute(self, context, params=None):
-        tune = AbcTune(context.tune or '')
+        tune = context.get_abc_tune()
         voice = params.get('value', '')
         if len(tune.get_voice_ids()) > 1 and not self.is_current_value(context, voice):
             return True
@@ -1942,7 +1941,7 @@ class ShowAllVoicesAction(AbcAction):
         super(ShowAllVoicesAction, self).__init__('show_all_voices', display_name=_('Show all voices'))
 
     def can_execute(self, context, params=None):
-        tune = AbcTune(context.tune or '')
+        tune = context.get_abc_tune()
         all_voices = tune.get_voice_ids()
         shown_voices = get_words(context.inner_text)
         hidden_voices = [v for v in all_voices if v not in shown_voices]
@@ -1950,7 +1949,7 @@ class ShowAllVoicesAction(AbcAction):
             return True
 
     def execute(self, context, params=None):
-        tune = AbcTune(context.tune)
+        tune = context.get_abc_tune()
         all_voices = tune.get_voice_ids()
         new_text = ' ' + ' '.join(all_voices)
         context.replace_match_text(new_text, tune_scope=TuneScope.InnerText)
@@ -1961,7 +1960,7 @@ class ShowVoiceAction(ValueChangeAction):
         super(ShowVoiceAction, self).__init__('show_voice', [], display_name=_('Show additional voice'), use_inner_match=True)
 
     def get_values(self, context):
-        tune = AbcTune(context.tune)
+        tune = context.get_abc_tune()
         all_voices = tune.get_voice_ids()
         shown_voices = get_words(context.inner_text)
         hidden_voices = [v for v in all_voices if v not in shown_voices]
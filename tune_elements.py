@@ -14,6 +14,8 @@ except ImportError: # py2
     from urllib2 import urlopen, HTTPError, URLError
 
 import logging
+import time
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
 from wx import GetTranslation as _
 try:
@@ -327,6 +329,29 @@ def get_html_from_url(url):
     return result
 
 
+def get_text_selection(text, p1, p2):
+    """ returns (p1, p2, at_character) for a selection from p1 to p2 in text. When nothing is selected, the character
+        in front of the caret counts as selected unless it is whitespace, at_character then is True and p1 == p2
+        is the offset of that character """
+    if p1 == p2 and 0 < p1 <= len(text) and text[p1 - 1] not in whitespace_chars:
+        return p1 - 1, p1 - 1, True
+    return p1, p2, False
+
+def find_match_at_selection(matches, selection):
+    """ matches is (all matches of a regex in a text, where each of them ends) and selection comes from
+        get_text_selection. Returns the first match that contains the selection or None """
+    matches, ends = matches
+    p1, p2, at_character = selection
+    # the matches do not overlap, so both their starts and their ends are in ascending order
+    if at_character:
+        i = bisect_right(ends, p1)  # first match with p1 < m.end()
+    else:
+        i = bisect_left(ends, p2)   # first match with p2 <= m.end()
+    if i < len(matches) and matches[i].start() <= p1:
+        return matches[i]
+    return None
+
+
 class AbcElement(object):
     """
     Base class for each element in abc-code where element is a piece of structured abc-code
@@ -376,29 +401,15 @@ class AbcElement(object):
         if regex is None:
             return None
 
-        result = None
-        scope_info = context.get_scope_info(self.tune_scope)
-        encoded_text = scope_info.encoded_text
-        text = scope_info.text
-        p1, p2 = context.get_selection_within_scope(self.tune_scope)
-        if len(text) != len(encoded_text):
-            p1 = len(encoded_text[:p1].decode('utf-8'))
-            p2 = len(encoded_text[:p2].decode('utf-8'))
-
-        if p1 == p2 and 0 < p1 <= len(text) and text[p1 - 1] not in whitespace_chars:
-            p1 -= 1
-            for m in regex.finditer(text):
-                if m.start() <= p1 < m.end():
-                    result = m
-                    break
-        else:
-            # if p1 > len(text):
-            #     print(u'Selection ({0}) past length ({1})'.format(p1, len(text)))
-            for m in regex.finditer(text):
-                if m.start() <= p1 <= p2 <= m.end():
-                    result = m
-                    break
-        return result
+        matches = context.get_regex_matches(regex, self.tune_scope)
+        m = find_match_at_selection(matches, context.get_text_selection(self.tune_scope))
+        if m is not None:
+            return self.add_inner_match(m)
+        return None
+
+    def add_inner_match(self, match):
+        """ returns what matches returns for a match of the search regex """
+        return match
 
     def get_regex_for_section(self, section):
         return self._search_re.get(section, None)
@@ -539,10 +550,9 @@ class AbcInformationField(AbcElement):
         if self.inner_pattern:
             self.inner_re = re.compile(self.inner_pattern)
 
-    def matches(self, context):
-        match = super(AbcInformationField, self).matches(context)
+    def add_inner_match(self, match):
         result = match
-        if self.inner_re and match is not None:
+        if self.inner_re:
             i = 1
             inner_text = match.group(i)
             if inner_text is None:
@@ -1071,6 +1081,77 @@ class AbcBackslash(AbcBodyElement):
         super(AbcBackslash, self).__init__('Backslash', AbcBackslash.pattern, display_name=_('Backslash'), description=_('In abc music code, by default, line-breaks in the code generate line-breaks in the typeset score and these can be suppressed by using a backslash.'))
 
 
+class MatchStatistics(object):
+    """ What finding the element at the caret costs, collected by ElementMatcher """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.caret_moves = 0
+        self.elements_tried = 0
+        self.regex_scans = 0  # the number of times a regex searched a complete scope text
+        self.seconds = 0.0
+
+    def add(self, elements_tried, regex_scans, seconds):
+        self.caret_moves += 1
+        self.elements_tried += elements_tried
+        self.regex_scans += regex_scans
+        self.seconds += seconds
+
+    def __str__(self):
+        moves = max(1, self.caret_moves)
+        return '{0} caret moves: {1:.3f} ms, {2:.1f} elements tried and {3:.1f} regex scans per caret move'.format(
+            self.caret_moves, self.seconds * 1000.0 / moves, self.elements_tried / float(moves), self.regex_scans / float(moves))
+
+
+class ElementMatcher(object):
+    """
+    Finds the element at the selection for one AbcSection, with the same outcome as trying element.matches for each
+    element in the order of generate_abc_elements. The search regex of every element for the section is looked up once
+    and the matches of a regex in a scope text come from the context, which keeps them until the text changes. So after
+    the first caret move in a text, finding the element takes one binary search per element.
+    """
+    def __init__(self, section, elements, statistics=None):
+        self.section = section
+        self.statistics = statistics
+        self.entries = []  # (element, regex or None if the element has its own matches method, tune scope)
+        for element in elements:
+            regex = element.get_regex_for_section(section)
+            if regex is not None:
+                if type(element).matches is not AbcElement.matches:
+                    regex = None
+                self.entries.append((element, regex, element.tune_scope))
+
+    def find_element(self, context):
+        """ returns (element, match) or (None, None) """
+        statistics = self.statistics
+        if statistics is not None:
+            start_time = time.time()
+            start_scans = context.document.regex_scans
+        result = None, None
+        elements_tried = 0
+        get_regex_matches = context.document.get_regex_matches
+        scopes = {}  # tune scope -> (scope info, selection)
+        for element, regex, tune_scope in self.entries:
+            elements_tried += 1
+            if regex is None:
+                m = element.matches(context)
+            else:
+                scope = scopes.get(tune_scope)
+                if scope is None:
+                    scope = (context.get_scope_info(tune_scope), context.get_text_selection(tune_scope))
+                    scopes[tune_scope] = scope
+                m = find_match_at_selection(get_regex_matches(regex, scope[0]), scope[1])
+                if m is not None:
+                    m = element.add_inner_match(m)
+            if m:
+                result = element, m
+                break
+        if statistics is not None:
+            statistics.add(elements_tried, context.document.regex_scans - start_scans, time.time() - start_time)
+        return result
+
+
 class AbcStructure(object):
     # static variables
     replace_regexes = None
@@ -1147,6 +1228,11 @@ class AbcStructure(object):
         return sections
 
 
+    @staticmethod
+    def generate_element_matchers(elements, statistics=None):
+        """ returns {section: ElementMatcher} for the elements returned by generate_abc_elements """
+        return dict((section, ElementMatcher(section, elements, statistics)) for section in ABC_SECTIONS)
+
     @staticmethod
     def generate_abc_elements(cwd):
         directive = AbcDirective()
@@ -0,0 +1,121 @@
+import re
+from bisect import bisect_left, bisect_right
+from abc_tune import strip_comments
+from abc_character_encoding import decode_abc
+import sys
+PY3 = sys.version_info.major > 2
+if PY3:
+    xrange = range
+
+tune_index_re = re.compile(r'^X:\s*(\d+)')
+
+
+class TuneIndex(object):
+    """ Keeps track of where the tunes are in an editor, so the tune list does not need a scan of all lines after every edit.
+
+        Only the lines that matter for the tune list are remembered: X: lines (where a tune starts), T: lines (its title)
+        and K: lines (the end of the tune header). When the editor reports a change, the remembered lines after the
+        change are shifted and only the changed lines are read again.
+        get_line(line_no) returns the text of a line and get_line_count() the number of lines of the editor.
+    """
+    def __init__(self, get_line, get_line_count):
+        self.get_line = get_line
+        self.get_line_count = get_line_count
+        self.line_numbers = []  # sorted line numbers of the X:, T: and K: lines
+        self.fields = []        # (field, value) for each line in line_numbers, value is the X: number or the T: title
+        self.tunes = None       # [(xnum, title, line_no), ...], None when it has to be determined again
+        self.is_valid = False
+
+    def invalidate(self):
+        self.is_valid = False
+        self.tunes = None
+
+    def read_lines(self, first_line, last_line):
+        """ returns the line numbers and fields of the remembered lines from first_line up to and including last_line """
+        line_numbers = []
+        fields = []
+        get_line = self.get_line
+        for i in xrange(first_line, last_line + 1):
+            line = get_line(i)
+            field = line[:2]
+            if field == 'X:':
+                m = tune_index_re.search(line)
+                value = int(m.group(1)) if m else None
+            elif field == 'T:':
+                value = decode_abc(strip_comments(line[2:]).strip())
+            elif field == 'K:':
+                value = None
+            else:
+                continue
+            line_numbers.append(i)
+            fields.append((field, value))
+        return line_numbers, fields
+
+    def rebuild(self):
+        self.line_numbers, self.fields = self.read_lines(0, self.get_line_count() - 1)
+        self.tunes = None
+        self.is_valid = True
+
+    def lines_changed(self, first_line, lines_added):
+        """ Should be called after text was inserted or deleted at first_line. lines_added is negative when lines were deleted """
+        if not self.is_valid:
+            return
+        line_count = self.get_line_count()
+        old_last_line = first_line + max(0, -lines_added)
+        new_last_line = min(first_line + max(0, lines_added), line_count - 1)
+
+        start = bisect_left(self.line_numbers, first_line)
+        end = bisect_right(self.line_numbers, old_last_line)
+        line_numbers, fields = self.read_lines(first_line, new_last_line)
+        if lines_added:
+            line_numbers.extend(i + lines_added for i in self.line_numbers[end:])
+        else:
+            line_numbers.extend(self.line_numbers[end:])
+        self.line_numbers[start:] = line_numbers
+        self.fields[end:end] = fields
+        del self.fields[start:end]
+        self.tunes = None
+
+    def get_tunes(self):
+        """ returns [(xnum, title, line_no), ...] for all tunes in the editor """
+        if not self.is_valid:
+            self.rebuild()
+        if self.tunes is None:
+            tunes = []
+            tunes_append = tunes.append
+            cur_index = None
+            cur_startline = None
+            cur_title = u''
+            for line_no, (field, value) in zip(self.line_numbers, self.fields):
+                if field == 'X:':
+                    if cur_index is not None:
+                        tunes_append((cur_index, cur_title, cur_startline))
+                    cur_index = value
+                    cur_startline = line_no
+                    cur_title = u''
+                elif field == 'T:' and cur_index is not None:
+                    cur_title = ' - '.join(filter(None, (cur_title, value)))
+            if cur_index is not None:
+                tunes_append((cur_index, cur_title, cur_startline))
+            self.tunes = tunes
+        return self.tunes
+
+    def get_tune_lines(self, start_line):
+        """ returns (first line, first line of the body, line after the tune) for the tune that starts at start_line.
+            The body starts after the first K: line, if there is no K: line the tune has no body """
+        if not self.is_valid:
+            self.rebuild()
+        line_numbers = self.line_numbers
+        fields = self.fields
+        end_line = self.get_line_count()
+        body_line = None
+        for i in xrange(bisect_right(line_numbers, start_line), len(line_numbers)):
+            field = fields[i][0]
+            if field == 'X:':
+                end_line = line_numbers[i]
+                break
+            elif field == 'K:' and body_line is None:
+                body_line = line_numbers[i] + 1
+        if body_line is None:
+            body_line = end_line
+        return start_line, body_line, end_line